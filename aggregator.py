@@ -0,0 +1,713 @@
+#!/usr/bin/env python3
+"""多拠点の測定結果を1つの索引付きストアに集約するサービス
+
+各拠点のコレクターは自分の作業ディレクトリに履歴を書く。集約サービスはそれを
+2つの経路で受け取り、系列名（target = 拠点名）付きで1つのストアへまとめて書き込む。
+
+- HTTP プッシュ: コレクターの --push URL が POST /ingest?target=拠点名 にまとめて送る
+- ディレクトリ追跡: --watch-dir の下にある各拠点の履歴ファイルを定期的に読む
+  （<dir>/<拠点名>/speed_history.json|.jsonl|.db|.bin または <dir>/<拠点名>.jsonl など）
+
+受け取ったエントリはメモリ上のキューに溜め、書き込みスレッドが batch_size 件ごと
+または batch_interval 秒ごとにまとめて追記する（既定の .db は (target, ts) の索引付き）。
+書き込みが追いつかずキューが max_pending 件を超えたら、プッシュには 503 を返す。
+書き込みに失敗したバッチはキューの先頭に戻し、間隔を空けて書き直す。
+
+問い合わせ（GET、JSON）:
+    /targets                         拠点ごとの最新エントリ
+    /tail?target=X&n=N               拠点の最新 N 件
+    /since?cursor=C                  カーソル以降に受け取った全拠点のエントリ（ビューアの追跡用）
+    /query?target=X&start=&end=&points=N   期間内の系列を拠点ごとに N 点まで間引いて返す
+                                     （長い期間は生データではなくロールアップから）
+    /rollup?resolution=hour&start=&end=&target=   history_query のロールアップ（拠点指定なしは全拠点を併合）
+
+使い方:
+    python aggregator.py --data-file aggregate.db --port 8470 --watch-dir /srv/probes
+    python collector.py --push http://aggregator:8470 --push-target site-a
+    python network_speed_monitor.py --view --data-file http://aggregator:8470 --compare
+"""
+import argparse
+import json
+import os
+import signal
+import threading
+import urllib.error
+import urllib.request
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from history_store import (OPTIONAL_FIELDS, list_targets, open_history_reader,
+                           open_history_store, read_history_range)
+from instrumentation import add_instrument_arguments, run_instrumented, span
+
+DEFAULT_AGGREGATE_FILE = 'aggregate.db'
+DEFAULT_PORT = 8470
+# /query で生データを読む上限の件数（超える期間はロールアップから答える）
+DEFAULT_RAW_LIMIT = 20000
+# ディレクトリ追跡で読む履歴ファイル（.json は旧形式の JSON 配列）
+WATCHED_SUFFIXES = ('.json', '.jsonl', '.db', '.sqlite', '.sqlite3', '.bin')
+# 同じディレクトリに置かれる派生ファイル（レイテンシのバッチ・ロールアップの索引）
+IGNORED_SUFFIXES = ('.latency.jsonl', '.rollup.db')
+
+
+class IngestBusy(Exception):
+    """書き込み待ちのキューがいっぱい（プッシュ側は後で送り直す）"""
+
+
+def normalize_entry(entry, target=None):
+    """受け取ったエントリを保存形式に揃える（不正なら ValueError）
+
+    エントリ自身に target があれば target を前に付けて '拠点/系列' にする（multi_probe の履歴など）。
+    """
+    if not isinstance(entry, dict):
+        raise ValueError("entry must be an object")
+    try:
+        timestamp = datetime.fromisoformat(entry['timestamp'])
+        normalized = {'timestamp': timestamp.isoformat(),
+                      'download': float(entry['download']),
+                      'upload': float(entry['upload'])}
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"invalid entry: {e}")
+    inner = entry.get('target')
+    if target and inner:
+        normalized['target'] = f"{target}/{inner}"
+    elif target or inner:
+        normalized['target'] = str(target or inner)
+    else:
+        raise ValueError("entry has no target")
+    for name, _ in OPTIONAL_FIELDS:
+        if name != 'target' and entry.get(name) is not None:
+            normalized[name] = float(entry[name])
+    return normalized
+
+
+def _entry_ts(entry):
+    return datetime.fromisoformat(entry['timestamp']).timestamp()
+
+
+class AggregatorService:
+    """受け取ったエントリのキュー・書き込みスレッド・問い合わせ
+
+    ストアへの書き込みは書き込みスレッドだけが行い、ストアを使う問い合わせ（/tail）は
+    同じロックで直列化する。/since と /targets はメモリ上の直近の受信分だけで答える。
+    """
+
+    def __init__(self, store, batch_size=500, batch_interval=2.0, max_pending=100000,
+                 recent=100000, raw_limit=DEFAULT_RAW_LIMIT, max_retry_delay=60.0):
+        self.store = store
+        self.path = store.path
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_pending = max_pending
+        self.raw_limit = raw_limit
+        self.max_retry_delay = max_retry_delay
+        self._lock = threading.Lock()
+        self._store_lock = threading.Lock()
+        self._rollup_lock = threading.Lock()
+        self._index = None
+        self._pending = []
+        # (通し番号, エントリ)。/since はカーソルより後の番号を返す
+        self._recent = deque(maxlen=recent)
+        self._seq = 0
+        self.latest = {}
+        self.received = 0
+        self.written = 0
+        self.dropped = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        for target in list_targets(self.path):
+            tail = self.store.tail(1, target=target)
+            if tail:
+                self.latest[target] = tail[-1]
+
+    def ingest(self, entries, target=None, enforce_limit=True):
+        """エントリを検証してキューに入れ、受け付けた件数を返す（不正なエントリは飛ばす）"""
+        rows = []
+        for entry in entries:
+            try:
+                rows.append(normalize_entry(entry, target))
+            except ValueError:
+                continue
+        if not rows:
+            return 0
+        with self._lock:
+            if enforce_limit and len(self._pending) + len(rows) > self.max_pending:
+                self._wake.set()
+                raise IngestBusy(f"{len(self._pending)} entries waiting to be written")
+            self._pending.extend(rows)
+            for row in rows:
+                self._seq += 1
+                self._recent.append((self._seq, row))
+                latest = self.latest.get(row['target'])
+                if latest is None or row['timestamp'] >= latest['timestamp']:
+                    self.latest[row['target']] = row
+            self.received += len(rows)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+        return len(rows)
+
+    def flush_pending(self):
+        """キューの内容をまとめてストアへ書き込み、件数を返す
+
+        書き込みに失敗したバッチはキューの先頭に戻してから例外を送出する
+        （プッシュ側には受け付け済みと返しているので、ここで捨てると失われる）。
+        """
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+        try:
+            with span('aggregate_write'), self._store_lock:
+                written = self.store.append_many(batch)
+        except Exception:
+            self._requeue(batch)
+            raise
+        self.written += written
+        return written
+
+    def _requeue(self, batch):
+        """書き込めなかったバッチをキューの先頭に戻す（max_pending を超える分は古いものから捨てる）"""
+        with self._lock:
+            pending = batch + self._pending
+            overflow = len(pending) - self.max_pending
+            if overflow > 0:
+                del pending[:overflow]
+                self.dropped += overflow
+                print(f"Aggregate queue full after a failed write: dropped {overflow} oldest entries")
+            self._pending = pending
+
+    def run_writer(self):
+        delay = self.batch_interval
+        while not self._stop.is_set():
+            if delay > self.batch_interval:
+                # 再試行中は受信で起こされても待ち時間が過ぎるまで書き直さない
+                self._stop.wait(delay)
+            else:
+                self._wake.wait(delay)
+            self._wake.clear()
+            try:
+                self.flush_pending()
+                delay = self.batch_interval
+            except Exception as e:
+                # キューに戻した分を、間隔を倍にしながら（最大 max_retry_delay 秒）書き直す。
+                # その間にキューが max_pending を超えたらプッシュには 503 を返す
+                delay = min(delay * 2, self.max_retry_delay)
+                print(f"Aggregate write error: {e} ({len(self._pending)} entries queued, "
+                      f"retrying in {delay:.0f}s)")
+        try:
+            self.flush_pending()
+        except Exception as e:
+            print(f"Aggregate write error on shutdown: {e} ({len(self._pending)} entries lost)")
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run_writer, name='aggregate-writer',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._rollup_lock:
+            if self._index is not None:
+                self._index.close()
+                self._index = None
+
+    def since(self, cursor):
+        """cursor より後に受け取ったエントリ。(新しいカーソル, エントリ, 取りこぼしの有無)"""
+        with self._lock:
+            first = self._recent[0][0] if self._recent else self._seq + 1
+            # 保持分より前のカーソルは途中が欠けている（クライアントは読み直す）
+            reset = cursor < first - 1
+            skip = max(0, cursor - first + 1)
+            entries = [entry for _, entry in list(self._recent)[skip:]]
+            return self._seq, entries, reset
+
+    def tail(self, target, n):
+        """(カーソル, 最新 n 件)。カーソルは読む前に取るので、以降の受信は /since で得られる"""
+        with self._lock:
+            cursor = self._seq
+        with self._store_lock:
+            self.store.flush()
+            entries = self.store.tail(n, target=target)
+        return cursor, entries
+
+    def targets(self):
+        with self._lock:
+            return {target: dict(entry) for target, entry in sorted(self.latest.items())}
+
+    def _rollup_index(self):
+        """ストアのロールアップ索引（_rollup_lock を持って呼ぶ）。追記分を取り込んでから返す"""
+        from history_query import RollupIndex, rollup_path
+        if self._index is None:
+            self._index = RollupIndex(rollup_path(self.path))
+        with self._store_lock:
+            self.store.flush()
+        self._index.sync(self.path)
+        return self._index
+
+    def query(self, targets, start=None, end=None, points=1000):
+        """期間内の系列を拠点ごとに points 点（最小・最大を残す）まで間引いて返す
+
+        期間内の件数が raw_limit 以下なら生データを間引き、超えるときは生データを読まずに
+        ロールアップの区間（points / 2 区間に収まる最も細かい分・時・日）の最小・最大を返す。
+        各列の summary（件数・最小・最大・平均・p5・p95）も同じ経路で求める。
+        """
+        import numpy as np
+        from downsample import minmax_decimate
+        from history_query import RESOLUTIONS
+
+        result = {}
+        half = max(1, points // 2)
+        with self._rollup_lock:
+            index = self._rollup_index()
+            for target in targets:
+                count, first, last = index.extent(start, end, target)
+                if count <= self.raw_limit:
+                    with span('aggregate_query_raw'):
+                        entries = read_history_range(self.path, start, end, target)[-self.raw_limit:]
+                    ts = np.array([_entry_ts(entry) for entry in entries], dtype=np.float64)
+                    series = {'resolution': 'raw', 'count': len(entries)}
+                    for column in ('download', 'upload'):
+                        values = np.array([entry[column] for entry in entries], dtype=np.float64)
+                        x, y = minmax_decimate(ts, values, half)
+                        series[column] = {'timestamp': x.tolist(), 'value': y.tolist(),
+                                          'summary': _summary(values)}
+                    result[target] = series
+                    continue
+                span_seconds = (min(last, end) if end is not None else last) - \
+                    (max(first, start) if start is not None else first)
+                resolution = next((name for name, seconds in RESOLUTIONS
+                                   if span_seconds / seconds <= half), 'day')
+                with span('aggregate_query_rollup'):
+                    rows = index.query(start, end, resolution, target, ('download', 'upload'))
+                    summary = index.summary(start, end, resolution, target, ('download', 'upload'))
+                series = {'resolution': resolution,
+                          'count': summary['download']['count'] if summary['download'] else 0}
+                for column in ('download', 'upload'):
+                    ts, values = [], []
+                    for row in rows:
+                        stats = row.get(column)
+                        if stats is None:
+                            continue
+                        bucket = datetime.fromisoformat(row['timestamp']).timestamp()
+                        ts += [bucket, bucket]
+                        values += [stats['min'], stats['max']]
+                    # 日単位でも points を超える長い期間はさらに間引く
+                    x, y = minmax_decimate(np.array(ts, dtype=np.float64),
+                                           np.array(values, dtype=np.float64), half)
+                    series[column] = {'timestamp': x.tolist(), 'value': y.tolist(),
+                                      'summary': summary[column]}
+                result[target] = series
+        return result
+
+    def rollup(self, start=None, end=None, resolution='hour', target=None):
+        with self._rollup_lock:
+            return self._rollup_index().query(start, end, resolution, target)
+
+
+def _summary(values):
+    """生データの集計（ロールアップの summary と同じ形、空なら None）"""
+    import numpy as np
+
+    if len(values) == 0:
+        return None
+    p5, p95 = np.percentile(values, (5, 95))
+    return {'count': len(values), 'min': float(values.min()), 'max': float(values.max()),
+            'mean': float(values.mean()), 'p5': float(p5), 'p95': float(p95)}
+
+
+class AggregatorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data, headers=()):
+        body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        parts = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if parts.path != '/ingest':
+            self._send_json(404, {'error': 'not found'})
+            return
+        target = parse_qs(parts.query).get('target', [None])[0]
+        try:
+            data = json.loads(body)
+            entries = data if isinstance(data, list) else [data]
+        except ValueError:
+            # JSON Lines でも受け付ける
+            try:
+                entries = [json.loads(line) for line in body.splitlines() if line.strip()]
+            except ValueError as e:
+                self._send_json(400, {'error': f"invalid JSON: {e}"})
+                return
+        try:
+            accepted = self.server.service.ingest(entries, target)
+        except IngestBusy as e:
+            self._send_json(503, {'error': str(e)}, headers=[('Retry-After', '10')])
+            return
+        self._send_json(202, {'accepted': accepted, 'rejected': len(entries) - accepted})
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        params = parse_qs(parts.query)
+        service = self.server.service
+
+        def number(name, default=None, convert=float):
+            value = params.get(name, [None])[0]
+            return default if value in (None, '') else convert(value)
+
+        try:
+            if parts.path == '/targets':
+                self._send_json(200, service.targets())
+            elif parts.path == '/tail':
+                cursor, entries = service.tail(params.get('target', [None])[0],
+                                               number('n', 1000, int))
+                self._send_json(200, {'cursor': cursor, 'entries': entries})
+            elif parts.path == '/since':
+                cursor, entries, reset = service.since(number('cursor', 0, int))
+                self._send_json(200, {'cursor': cursor, 'entries': entries, 'reset': reset})
+            elif parts.path == '/query':
+                targets = params.get('target') or list(service.targets())
+                self._send_json(200, service.query(targets, number('start'), number('end'),
+                                                   number('points', 1000, int)))
+            elif parts.path == '/rollup':
+                self._send_json(200, service.rollup(number('start'), number('end'),
+                                                    params.get('resolution', ['hour'])[0],
+                                                    params.get('target', [None])[0]))
+            else:
+                self._send_json(404, {'error': 'not found'})
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+
+
+class AggregatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        super().__init__(address, AggregatorHandler)
+        self.service = service
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_aggregator_server(service, port=DEFAULT_PORT, host='0.0.0.0'):
+    """バックグラウンドスレッドで集約サービスの HTTP を公開して返す（port=0 は空きポート）"""
+    server = AggregatorServer((host, port), service)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def target_for_path(path, root):
+    """追跡するファイルの拠点名（サブディレクトリ名、直下のファイルならファイル名）"""
+    rel = os.path.relpath(path, root)
+    head = rel.split(os.sep)[0]
+    if head != rel:
+        return head
+    return os.path.basename(rel).split('.')[0]
+
+
+class _FileSource:
+    """追跡中の履歴ファイル1つ（取り込み済みの最新時刻より新しいエントリだけを返す）"""
+
+    def __init__(self, path, target, last_ts=None):
+        self.path = path
+        self.target = target
+        self.last_ts = last_ts
+        self._reader = None
+        self._signature = None
+
+    def _newer(self, entries):
+        result = []
+        for entry in entries:
+            try:
+                ts = _entry_ts(entry)
+            except (KeyError, TypeError, ValueError):
+                continue
+            if self.last_ts is None or ts > self.last_ts:
+                result.append(entry)
+                self.last_ts = ts
+        return result
+
+    def read(self):
+        if self.path.endswith('.json'):
+            # 旧形式は毎回全体を書き直されるので、変わったときだけ読み直す
+            st = os.stat(self.path)
+            signature = (st.st_mtime_ns, st.st_size)
+            if signature == self._signature:
+                return []
+            self._signature = signature
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            return self._newer(data if isinstance(data, list) else [])
+        if self._reader is None:
+            # 読み取り位置を末尾に合わせてから、それまでの分を期間指定で読む
+            self._reader = open_history_reader(self.path)
+            self._reader.tail(1)
+            return self._newer(read_history_range(self.path, start=self.last_ts))
+        return self._newer(self._reader.poll())
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+
+
+class DirectoryTailer:
+    """共有ディレクトリ下の各拠点の履歴ファイルを interval 秒ごとに取り込む"""
+
+    def __init__(self, root, service, interval=5.0):
+        self.root = root
+        self.service = service
+        self.interval = interval
+        self._sources = {}
+
+    def _candidates(self):
+        own = os.path.abspath(self.service.path)
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if (name.endswith(WATCHED_SUFFIXES) and not name.endswith(IGNORED_SUFFIXES)
+                        and os.path.abspath(path) != own):
+                    yield path
+
+    def _resume_ts(self, target):
+        """拠点の取り込み済みの最新時刻（'拠点/系列' に分かれたものを含む、なければ None）"""
+        latest = [_entry_ts(entry) for name, entry in self.service.targets().items()
+                  if name == target or name.startswith(target + '/')]
+        return max(latest) if latest else None
+
+    def scan(self):
+        """新しいファイルを見つけ、全ファイルの追記分を取り込んで件数を返す"""
+        count = 0
+        for path in self._candidates():
+            source = self._sources.get(path)
+            if source is None:
+                target = target_for_path(path, self.root)
+                source = self._sources[path] = _FileSource(path, target, self._resume_ts(target))
+            try:
+                entries = source.read()
+            except (OSError, ValueError) as e:
+                print(f"Watch error ({path}): {e}")
+                continue
+            # ファイルに残っているので、キューの上限で断らずに取り込む
+            count += self.service.ingest(entries, source.target, enforce_limit=False)
+        return count
+
+    def run(self, stop_event):
+        while True:
+            with span('watch_scan'):
+                self.scan()
+            if stop_event.wait(self.interval):
+                break
+        for source in self._sources.values():
+            source.close()
+
+
+class AggregatorClient:
+    """集約サービスを履歴リーダーと同じ形（tail / poll / targets）で読むクライアント"""
+
+    def __init__(self, url, timeout=10.0):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self._cursor = None
+        self._last = {}
+
+    def _get(self, path, **params):
+        query = urlencode({k: v for k, v in params.items() if v is not None}, doseq=True)
+        with urllib.request.urlopen(f"{self.url}{path}?{query}", timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def targets(self):
+        return list(self._get('/targets'))
+
+    def tail(self, n, target=None):
+        data = self._get('/tail', target=target, n=n)
+        if self._cursor is None:
+            self._cursor = data['cursor']
+        for entry in data['entries']:
+            key = entry.get('target')
+            self._last[key] = max(self._last.get(key, ''), entry['timestamp'])
+        return data['entries']
+
+    def poll(self):
+        data = self._get('/since', cursor=self._cursor or 0)
+        self._cursor = data['cursor']
+        if data['reset']:
+            print("Aggregator poll fell behind; some entries were skipped")
+        # tail と重なった分（カーソル取得後に書き込まれた分）は時刻で除く
+        entries = []
+        for entry in data['entries']:
+            key = entry.get('target')
+            if entry['timestamp'] > self._last.get(key, ''):
+                self._last[key] = entry['timestamp']
+                entries.append(entry)
+        return entries
+
+    def close(self):
+        pass
+
+
+class AggregatorPusher:
+    """コレクター側：測定結果を溜めて interval 秒ごとに集約サービスへまとめて送る
+
+    送れなかった分は保持して次回送り直す（最大 max_pending 件、超えたら古いものから捨てて
+    dropped に数える）。失敗が続くと送信間隔を倍にする（最大 max_backoff 秒）。
+    """
+
+    def __init__(self, url, target, interval=10.0, max_pending=10000, max_backoff=300.0,
+                 timeout=10.0):
+        self.url = f"{url.rstrip('/')}/ingest?{urlencode({'target': target})}"
+        self.target = target
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        # (通し番号, エントリ)。送信に成功したら送った番号までを取り除く
+        self._pending = deque(maxlen=max_pending)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.sent = 0
+        self.dropped = 0
+        self._dropped_reported = 0
+
+    def push(self, entry):
+        with self._lock:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self._seq += 1
+            self._pending.append((self._seq, entry))
+
+    def _report_dropped(self):
+        with self._lock:
+            dropped = self.dropped - self._dropped_reported
+            self._dropped_reported = self.dropped
+        if dropped:
+            print(f"Push queue full: dropped {dropped} oldest entries "
+                  f"({self.dropped} total, max {self._pending.maxlen})")
+
+    def send(self):
+        """溜まっている分を送り、成功したら True"""
+        self._report_dropped()
+        with self._lock:
+            batch = list(self._pending)
+        if not batch:
+            return True
+        last_seq = batch[-1][0]
+        body = json.dumps([entry for _, entry in batch], separators=(',', ':')).encode('utf-8')
+        request = urllib.request.Request(self.url, data=body, method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with span('push'), urllib.request.urlopen(request, timeout=self.timeout):
+                pass
+        except (OSError, urllib.error.HTTPError) as e:
+            print(f"Push to aggregator failed: {e}")
+            return False
+        with self._lock:
+            # 送った分だけを除く。送信中に追加された分は残し、上限で先に捨てられた分は数えない
+            while self._pending and self._pending[0][0] <= last_seq:
+                self._pending.popleft()
+        self.sent += len(batch)
+        return True
+
+    def run(self):
+        delay = self.interval
+        while not self._stop.wait(delay):
+            delay = self.interval if self.send() else min(delay * 2, self.max_backoff)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='aggregator-push', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        """送信ループを止め、残りを1回だけ送る"""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(self.timeout)
+        self.send()
+
+
+def run(args):
+    store = open_history_store(args.data_file)
+    service = AggregatorService(store, batch_size=args.batch_size,
+                                batch_interval=args.batch_interval, max_pending=args.max_pending,
+                                raw_limit=args.raw_limit)
+    service.start()
+    server = start_aggregator_server(service, args.port, args.host)
+    stop_event = threading.Event()
+
+    def handle(signum, frame):
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, handle)
+    signal.signal(signal.SIGINT, handle)
+    tailers = []
+    for root in args.watch_dir:
+        tailer = DirectoryTailer(root, service, args.watch_interval)
+        thread = threading.Thread(target=tailer.run, args=(stop_event,), daemon=True)
+        thread.start()
+        tailers.append(thread)
+    print(f"Aggregator listening on {server.url} -> {args.data_file} "
+          f"({len(service.latest)} known targets)")
+    try:
+        while not stop_event.wait(60):
+            print(f"{datetime.now().strftime('%H:%M:%S')} - received {service.received}, "
+                  f"written {service.written}, dropped {service.dropped}, "
+                  f"targets {len(service.latest)}")
+    finally:
+        server.shutdown()
+        for thread in tailers:
+            thread.join()
+        service.stop()
+        store.close()
+    print("Aggregator stopped.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate results from many collectors")
+    parser.add_argument('--data-file', default=DEFAULT_AGGREGATE_FILE,
+                        help=f"aggregate store, .db recommended (default: {DEFAULT_AGGREGATE_FILE})")
+    parser.add_argument('--host', default='0.0.0.0',
+                        help="address to listen on (default: 0.0.0.0)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f"HTTP port for pushes and queries (default: {DEFAULT_PORT})")
+    parser.add_argument('--watch-dir', action='append', default=[],
+                        help="directory with one history file (or subdirectory) per site; repeatable")
+    parser.add_argument('--watch-interval', type=float, default=5.0,
+                        help="seconds between directory scans (default: 5)")
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help="entries written per batch (default: 500)")
+    parser.add_argument('--batch-interval', type=float, default=2.0,
+                        help="maximum seconds an entry waits before it is written (default: 2)")
+    parser.add_argument('--max-pending', type=int, default=100000,
+                        help="queued entries before pushes are refused with 503 (default: 100000)")
+    parser.add_argument('--raw-limit', type=int, default=DEFAULT_RAW_LIMIT,
+                        help="largest number of raw rows a /query reads; longer ranges are served "
+                             f"from the rollup index (default: {DEFAULT_RAW_LIMIT})")
+    add_instrument_arguments(parser)
+    args = parser.parse_args(argv)
+    run_instrumented(args, run, args)
+
+
+if __name__ == "__main__":
+    main()
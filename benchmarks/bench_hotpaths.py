@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""ホットパスのベンチマーク（Agg バックエンド・合成データ）
+
+update_graph / add_hacker_status_external / save_data / load_history（.jsonl と .bin）を
+100 / 1k / 8640 / 100k サンプルで計測し、1回あたりの時間・割り当て量（tracemalloc）・
+ファイル I/O バイト数（/proc/self/io）を表示する。
+偽の speedtest モジュール（fake_speedtest.py）で speed_test_worker の
+スループットもネットワークなしで測る。
+
+使い方:
+    python benchmarks/bench_hotpaths.py                                   # 結果を表示
+    python benchmarks/bench_hotpaths.py --sizes 100 1000 --save-baseline benchmarks/baseline.json
+    python benchmarks/bench_hotpaths.py --baseline benchmarks/baseline.json  # 退行で終了コード 1
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+SIZES = (100, 1000, 8640, 100000)
+# 比較に使う指標と、基準値からの許容倍率（時間は環境差が大きいので緩め）
+COMPARED = {'time_ms': 1.5, 'alloc_kb': 1.25, 'write_bytes': 1.1, 'read_bytes': 1.1}
+# 基準値がこれ未満の指標は誤差が大きいので比較しない
+NOISE_FLOOR = {'time_ms': 0.05, 'alloc_kb': 16, 'write_bytes': 4096, 'read_bytes': 4096}
+
+
+def io_counters():
+    """(読み込みバイト, 書き込みバイト)。/proc/self/io がなければ (None, None)"""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            fields = dict(line.split(': ') for line in f.read().splitlines())
+        return int(fields['rchar']), int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def measure(func, setup=None, repeat=5, number=1):
+    """func を計測し、1回あたりの時間・割り当て量・I/O を返す
+
+    setup() の戻り値が func に渡される（setup は計測に含めない）。
+    時間は repeat 回の中央値、I/O は全回の平均。割り当て量は tracemalloc を有効にした別の1回で測る
+    （tracemalloc は実行を遅くするため時間の計測とは分ける）。
+    """
+    # 初回だけの import・キャッシュ読み込みを計測に含めないよう1回空回しする
+    func(setup() if setup else None)
+    times = []
+    read_total = write_total = 0
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        r0, w0 = io_counters()
+        start = time.perf_counter()
+        for _ in range(number):
+            func(arg)
+        times.append((time.perf_counter() - start) / number)
+        r1, w1 = io_counters()
+        if r0 is not None:
+            read_total += r1 - r0
+            write_total += w1 - w0
+    calls = repeat * number
+    io_available = io_counters()[0] is not None
+
+    arg = setup() if setup else None
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    for _ in range(number):
+        func(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'time_ms': statistics.median(times) * 1000,
+        'alloc_kb': (peak - base) / 1024 / number,
+        'read_bytes': read_total / calls if io_available else None,
+        'write_bytes': write_total / calls if io_available else None,
+    }
+
+
+def write_history(path, n, seed=0):
+    """n 件の合成履歴（10秒間隔）を JSON Lines で書く"""
+    rng = random.Random(seed)
+    start = datetime.now() - timedelta(seconds=10 * n)
+    with open(path, 'w') as f:
+        for i in range(n):
+            f.write(json.dumps({
+                'timestamp': (start + timedelta(seconds=10 * i)).isoformat(),
+                'download': max(0.0, rng.gauss(95, 8)),
+                'upload': max(0.0, rng.gauss(18, 2)),
+            }, separators=(',', ':')) + '\n')
+
+
+class Workspace:
+    """サイズごとの作業ディレクトリと合成履歴"""
+
+    def __init__(self, root, n):
+        self.dir = os.path.join(root, str(n))
+        os.makedirs(self.dir, exist_ok=True)
+        self.n = n
+        self.history = os.path.join(self.dir, 'speed_history.jsonl')
+        write_history(self.history, n)
+        self.binary = os.path.join(self.dir, 'speed_history.bin')
+
+
+def _monitor(ws, entries=None, data_file=None):
+    from network_speed_monitor import NetworkSpeedMonitor
+    return NetworkSpeedMonitor(max_data_points=ws.n, data_file=data_file or ws.history,
+                               entries=[] if entries is None else entries)
+
+
+def _monitor_with_figure(ws):
+    """合成データを読み込み、Agg の Figure に初回描画を済ませたモニター"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from history_store import open_history_reader
+    from network_speed_monitor import BlitManager
+
+    reader = open_history_reader(ws.history)
+    monitor = _monitor(ws, reader.tail(ws.n))
+    monitor.fig = Figure(figsize=(12, 6), dpi=100)
+    FigureCanvasAgg(monitor.fig)
+    monitor.blit_manager = BlitManager(monitor.fig.canvas)
+    monitor.setup_layout()
+    monitor.update_graph()
+    return monitor
+
+
+def bench_load_history(ws, repeat):
+    """履歴ストアの末尾 n 件をバッファ・集約ティア・劣化検知へ読み込む"""
+    from history_store import open_history_reader
+
+    def setup():
+        monitor = _monitor(ws)
+        monitor.reader = open_history_reader(ws.history)
+        return monitor
+
+    return measure(lambda monitor: monitor.load_history(), setup, repeat=repeat)
+
+
+def bench_load_binary(ws, repeat):
+    """同じ履歴を固定長バイナリ（.bin、memmap で読む）から読み込む"""
+    from binary_history import convert
+    from history_store import open_history_reader
+
+    if not os.path.exists(ws.binary):
+        convert(ws.history, ws.binary)
+
+    def setup():
+        monitor = _monitor(ws, data_file=ws.binary)
+        monitor.reader = open_history_reader(ws.binary)
+        return monitor
+
+    return measure(lambda monitor: monitor.load_history(), setup, repeat=repeat)
+
+
+def bench_update_graph(ws, repeat, new_sample):
+    """1フレーム分の update_graph（new_sample なら毎回1件追加してから描画）"""
+    monitor = _monitor_with_figure(ws)
+    clock = [monitor.samples.latest_timestamp()]
+
+    def frame(_):
+        if new_sample:
+            clock[0] += 10
+            monitor.record_sample(datetime.fromtimestamp(clock[0]), 90.0, 17.0)
+        monitor.update_graph()
+
+    return measure(frame, repeat=repeat, number=5)
+
+
+def bench_status(ws, repeat):
+    """ステータス領域のテキスト更新"""
+    monitor = _monitor_with_figure(ws)
+    return measure(lambda _: monitor.add_hacker_status_external(), repeat=repeat, number=20)
+
+
+def bench_save_data(ws, repeat):
+    """1件の追記（fsync はまとめて実行される）"""
+    from collector import SpeedCollector
+
+    collector = SpeedCollector(data_file=os.path.join(ws.dir, 'save_bench.jsonl'),
+                               cache_file=os.path.join(ws.dir, 'cache.json'))
+    timestamp = datetime.now()
+    result = measure(lambda _: collector.save_data(timestamp, 95.0, 18.0),
+                     repeat=repeat, number=50)
+    collector.history.close()
+    return result
+
+
+def bench_worker(root, samples=200):
+    """偽の speedtest で speed_test_worker を回し、1秒あたりの測定件数を測る"""
+    import fake_speedtest
+    fake_speedtest.install()
+    from collector import SpeedCollector
+
+    workdir = os.path.join(root, 'worker')
+    os.makedirs(workdir, exist_ok=True)
+    collector = SpeedCollector(test_interval=0, data_file=os.path.join(workdir, 'history.jsonl'),
+                               cache_file=os.path.join(workdir, 'cache.json'))
+    count = [0]
+
+    def on_sample(timestamp, download, upload):
+        count[0] += 1
+        if count[0] >= samples:
+            collector.running = False
+            collector.stop_event.set()
+
+    collector.on_sample = on_sample
+    collector.running = True
+    r0, w0 = io_counters()
+    start = time.perf_counter()
+    # 測定ごとの print は計測から外す
+    with contextlib.redirect_stdout(io.StringIO()):
+        collector.speed_test_worker()
+    elapsed = time.perf_counter() - start
+    r1, w1 = io_counters()
+    collector.history.close()
+    return {
+        'time_ms': elapsed / count[0] * 1000,
+        'samples_per_s': count[0] / elapsed,
+        'alloc_kb': None,
+        'read_bytes': (r1 - r0) / count[0] if r0 is not None else None,
+        'write_bytes': (w1 - w0) / count[0] if w0 is not None else None,
+        'speedtest_calls': dict(fake_speedtest.calls),
+    }
+
+
+SCENARIOS = (
+    ('load_history', bench_load_history),
+    ('load_history (.bin)', bench_load_binary),
+    ('update_graph (new sample)', lambda ws, repeat: bench_update_graph(ws, repeat, True)),
+    ('update_graph (unchanged)', lambda ws, repeat: bench_update_graph(ws, repeat, False)),
+    ('add_hacker_status_external', bench_status),
+    ('save_data', bench_save_data),
+)
+
+
+def _fmt(value, spec):
+    return '-' if value is None else format(value, spec)
+
+
+def print_result(name, result):
+    print(f"{name:<40} {_fmt(result['time_ms'], '10.3f')} {_fmt(result['alloc_kb'], '10.1f')} "
+          f"{_fmt(result['read_bytes'], '12.0f')} {_fmt(result['write_bytes'], '12.0f')}")
+
+
+def compare(results, baseline):
+    """基準値より許容倍率を超えて悪化した指標を返す"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric, tolerance in COMPARED.items():
+            old, new = base.get(metric), result.get(metric)
+            if old is None or new is None or old < NOISE_FLOOR[metric]:
+                continue
+            if new > old * tolerance:
+                regressions.append(f"{name} {metric}: {old:.3f} -> {new:.3f} (x{new / old:.2f})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES),
+                        help=f"sample counts (default: {' '.join(map(str, SIZES))})")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="timed runs per scenario; the median is reported (default: 5)")
+    parser.add_argument('--worker-samples', type=int, default=200,
+                        help="measurements for the speed_test_worker throughput run (default: 200)")
+    parser.add_argument('--json', help="write all results to this file")
+    parser.add_argument('--save-baseline', help="write results as the new baseline")
+    parser.add_argument('--baseline', help="compare with this baseline; exit 1 on regression")
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        print(f"{'scenario':<40} {'ms/op':>10} {'alloc KB':>10} {'read B/op':>12} {'write B/op':>12}")
+        for n in args.sizes:
+            ws = Workspace(root, n)
+            for name, bench in SCENARIOS:
+                key = f"{name} @{n}"
+                results[key] = bench(ws, args.repeat)
+                print_result(key, results[key])
+        key = 'speed_test_worker (fake speedtest)'
+        results[key] = bench_worker(root, args.worker_samples)
+        print_result(key, results[key])
+        print(f"  -> {results[key]['samples_per_s']:.0f} samples/s, "
+              f"speedtest calls: {results[key]['speedtest_calls']}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f))
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
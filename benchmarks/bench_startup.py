@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""起動時間ベンチマーク（python -X importtime）
+
+各起動モードで読み込まれるモジュールと import 時間を計測し、
+重いモジュール（matplotlib / numpy / speedtest）が不要なモードで
+読み込まれていないこと、import 時間が予算内であることを確認する。
+
+使い方:
+    python benchmarks/bench_startup.py            # 結果を表示
+    python benchmarks/bench_startup.py --check    # 予算超過・禁止モジュールで終了コード 1
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (名前, 実行する引数, 読み込んではいけないモジュール, import 時間の予算[ms])
+SCENARIOS = [
+    ('import network_speed_monitor', ['-c', 'import network_speed_monitor'],
+     ('matplotlib', 'numpy', 'speedtest'), 100),
+    ('import collector', ['-c', 'import collector'],
+     ('matplotlib', 'numpy', 'speedtest'), 100),
+    ('network_speed_monitor.py --stats', ['network_speed_monitor.py', '--stats'],
+     ('matplotlib', 'numpy', 'speedtest'), 100),
+    ('network_speed_monitor.py --help', ['network_speed_monitor.py', '--help'],
+     ('matplotlib', 'numpy', 'speedtest'), 100),
+]
+
+
+def parse_importtime(stderr):
+    """-X importtime の出力から {モジュール: (self_us, cumulative_us)} を作る"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            _, rest = line.split(':', 1)
+            self_us, cumulative_us, name = rest.split('|')
+            modules[name.strip()] = (int(self_us), int(cumulative_us))
+        except ValueError:
+            continue
+    return modules
+
+
+def run_scenario(args, cwd):
+    env = dict(os.environ, PYTHONPATH=REPO_DIR, MPLBACKEND='Agg')
+    script_args = [os.path.join(REPO_DIR, a) if a.endswith('.py') else a for a in args]
+    proc = subprocess.run([sys.executable, '-X', 'importtime'] + script_args,
+                          cwd=cwd, env=env, capture_output=True, text=True)
+    return parse_importtime(proc.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--check', action='store_true',
+                        help="exit with status 1 on budget overrun or forbidden imports")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="runs per scenario; the fastest is reported (default: 3)")
+    args = parser.parse_args(argv)
+
+    failed = False
+    # 既存の履歴に影響しないよう空の作業ディレクトリで実行
+    with tempfile.TemporaryDirectory() as cwd:
+        print(f"{'scenario':<36} {'import ms':>10} {'modules':>8}  heavy modules")
+        for name, scenario_args, forbidden, budget_ms in SCENARIOS:
+            runs = [run_scenario(scenario_args, cwd) for _ in range(args.repeat)]
+            modules = min(runs, key=lambda m: sum(s for s, _ in m.values()))
+            total_ms = sum(s for s, _ in modules.values()) / 1000
+            heavy = sorted({m.split('.')[0] for m in modules} & set(forbidden))
+            print(f"{name:<36} {total_ms:>10.1f} {len(modules):>8}  {', '.join(heavy) or '-'}")
+            if heavy or total_ms > budget_ms:
+                failed = True
+
+    if args.check and failed:
+        print("Startup budget check FAILED")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""ネットワークに接続しない speedtest モジュールの代用品
+
+speedtest-cli の Speedtest のうち、server_cache.SpeedtestSession が使う部分だけを実装する。
+install() で sys.modules['speedtest'] を置き換えると、測定ループ全体を
+ネットワークなしで実行できる（ベンチマーク用）。
+
+遅延や速度はモジュール変数で変更できる。
+"""
+import sys
+import time
+
+DOWNLOAD_BPS = 95_000_000
+UPLOAD_BPS = 18_000_000
+LATENCY_MS = 12.5
+# 各測定で待つ秒数（実際の測定時間の代わり）
+CONFIG_DELAY = 0.0
+DOWNLOAD_DELAY = 0.0
+UPLOAD_DELAY = 0.0
+
+SERVERS = [
+    {'id': str(i), 'host': f"speedtest{i}.example.net:8080", 'name': f"City{i}",
+     'sponsor': f"Sponsor{i}", 'country': 'Japan', 'd': 10.0 * i, 'latency': LATENCY_MS + i}
+    for i in range(1, 6)
+]
+
+# 呼び出し回数（ベンチマークの確認用）
+calls = {'get_config': 0, 'get_best_server': 0, 'download': 0, 'upload': 0}
+
+
+class SpeedtestException(Exception):
+    pass
+
+
+class Speedtest:
+    def __init__(self, config=None, source_address=None, timeout=10, secure=False,
+                 shutdown_event=None):
+        self.config = {}
+        self.lat_lon = (0.0, 0.0)
+        self.closest = []
+        self.best = {}
+        self.get_config()
+        if config is not None:
+            self.config.update(config)
+
+    def get_config(self):
+        calls['get_config'] += 1
+        if CONFIG_DELAY:
+            time.sleep(CONFIG_DELAY)
+        self.config.update({
+            'client': {'ip': '192.0.2.1', 'isp': 'Example ISP', 'lat': '35.68', 'lon': '139.69'},
+            'threads': {'download': 8, 'upload': 4},
+        })
+        self.lat_lon = (35.68, 139.69)
+        return self.config
+
+    def get_closest_servers(self, limit=5):
+        self.closest = [dict(server) for server in SERVERS[:limit]]
+        return self.closest
+
+    def get_best_server(self, servers=None):
+        calls['get_best_server'] += 1
+        if not servers:
+            servers = self.get_closest_servers()
+        best = dict(min(servers, key=lambda s: s.get('d', 0)))
+        best['latency'] = LATENCY_MS
+        self.best = best
+        return best
+
+    def download(self, callback=None, threads=None):
+        calls['download'] += 1
+        if DOWNLOAD_DELAY:
+            time.sleep(DOWNLOAD_DELAY)
+        return float(DOWNLOAD_BPS)
+
+    def upload(self, callback=None, pre_allocate=True, threads=None):
+        calls['upload'] += 1
+        if UPLOAD_DELAY:
+            time.sleep(UPLOAD_DELAY)
+        return float(UPLOAD_BPS)
+
+
+def install():
+    """sys.modules['speedtest'] をこのモジュールに置き換えて返す"""
+    module = sys.modules[__name__]
+    sys.modules['speedtest'] = module
+    return module
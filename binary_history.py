@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""固定長レコードのバイナリ履歴（.bin）
+
+JSON Lines は1日 8640 件でも行のパースと datetime.fromisoformat が起動時間の大半を占める。
+.bin は1件を固定長のレコードとして追記し、読み込みは numpy.memmap でファイルを
+そのまま配列として参照するので、1年分でも開くのは一瞬で済む。
+
+ファイルの構成:
+    ヘッダ（HEADER_SIZE バイト）
+        マジック b'SPDHIST\\0'、スキーマのバージョン（uint32）、ヘッダ長（uint32）、
+        続いて JSON {"fields": [[名前, dtype], ...], "targets": [系列名, ...]}（残りは空白で埋める）
+    レコード（リトルエンディアン、パディングなし）
+        ts_ns int64（epoch ナノ秒）, download / upload / ping / jitter float32（Mbps・ms、なしは NaN）,
+        target int16（targets の番号、なしは -1）
+
+新しい系列名が現れたときはヘッダの targets だけを書き換える（レコードは動かさない）。
+ローテーションはしない（1件 26 バイトなので 10 秒間隔で1年分でも約 80MB）。
+
+変換:
+    python binary_history.py convert speed_history.json speed_history.bin   # 旧形式 → .bin
+    python binary_history.py convert speed_history.bin speed_history.json   # .bin → 旧形式
+    python binary_history.py convert speed_history.jsonl speed_history.bin  # .jsonl / .db も可
+    python binary_history.py info speed_history.bin
+"""
+import argparse
+import json
+import os
+import struct
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from history_store import (HistoryStore, JsonlHistoryStore, _is_sqlite_path, open_history_store,
+                           read_history_range)
+from instrumentation import span
+
+MAGIC = b'SPDHIST\0'
+SCHEMA_VERSION = 1
+HEADER_SIZE = 4096
+_PREFIX = struct.Struct('<8sII')  # マジック, バージョン, ヘッダ長
+
+# 現行スキーマのフィールド（名前, dtype）。float32 の列はエントリの同名キーに対応する
+FIELDS = (('ts_ns', '<i8'), ('download', '<f4'), ('upload', '<f4'),
+          ('ping', '<f4'), ('jitter', '<f4'), ('target', '<i2'))
+VALUE_FIELDS = ('download', 'upload', 'ping', 'jitter')
+OPTIONAL_VALUES = ('ping', 'jitter')
+_STRUCT_CODES = {'<i8': 'q', '<f4': 'f', '<i2': 'h'}
+_RECORD = struct.Struct('<' + ''.join(_STRUCT_CODES[dtype] for _, dtype in FIELDS))
+NAN = float('nan')
+
+
+def _to_ns(seconds):
+    """epoch 秒（float）をマイクロ秒単位に丸めたナノ秒へ（ISO 文字列の精度と同じ）"""
+    return round(seconds * 1_000_000) * 1000
+
+
+def _ns_to_iso(ts_ns):
+    seconds, remainder = divmod(int(ts_ns), 1_000_000_000)
+    return (datetime.fromtimestamp(seconds) + timedelta(microseconds=remainder // 1000)).isoformat()
+
+
+def _encode_header(fields, targets):
+    meta = json.dumps({'fields': [list(field) for field in fields], 'targets': targets},
+                      separators=(',', ':')).encode('utf-8')
+    header = _PREFIX.pack(MAGIC, SCHEMA_VERSION, HEADER_SIZE) + meta
+    if len(header) > HEADER_SIZE:
+        raise ValueError(f"too many targets for the {HEADER_SIZE}-byte header")
+    return header.ljust(HEADER_SIZE, b' ')
+
+
+def read_header(path):
+    """ヘッダを読み、(レコードの dtype, 系列名のリスト, ヘッダ長) を返す"""
+    with open(path, 'rb') as f:
+        prefix = f.read(_PREFIX.size)
+        if len(prefix) < _PREFIX.size:
+            raise ValueError(f"{path}: truncated header")
+        magic, version, header_size = _PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not a binary history file")
+        if version > SCHEMA_VERSION:
+            raise ValueError(f"{path}: unsupported schema version {version}")
+        meta = json.loads(f.read(header_size - _PREFIX.size).rstrip(b' \0'))
+    dtype = np.dtype([(name, dtype) for name, dtype in meta['fields']])
+    return dtype, meta['targets'], header_size
+
+
+def _record_count(path, dtype, header_size):
+    """書きかけのレコードを除いた件数"""
+    return max(0, (os.path.getsize(path) - header_size) // dtype.itemsize)
+
+
+class BinaryHistory:
+    """.bin ファイルを読み取り専用で memmap した配列
+
+    records は構造化配列（フィールドは FIELDS）。ファイルの内容を直接参照するので、
+    列の取り出し（records['download'] など）はコピーしない。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dtype, self.targets, self.header_size = read_header(path)
+        count = _record_count(path, self.dtype, self.header_size)
+        if count:
+            self.records = np.memmap(path, dtype=self.dtype, mode='r',
+                                     offset=self.header_size, shape=(count,))
+        else:
+            # 長さ 0 の memmap は作れない
+            self.records = np.empty(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    def target_mask(self, target):
+        """target の系列だけを True とするマスク（None は全件なので None を返す）"""
+        if target is None:
+            return None
+        if target not in self.targets:
+            return np.zeros(len(self.records), dtype=bool)
+        return self.records['target'] == self.targets.index(target)
+
+    def tail_records(self, n, target=None):
+        """最新 n 件のレコード（target なしならファイルのビューのまま）"""
+        if n <= 0:
+            return self.records[:0]
+        mask = self.target_mask(target)
+        records = self.records if mask is None else self.records[mask]
+        return records[-n:]
+
+    def entries(self, records):
+        """レコードを save_data と同じ形式の dict のリストにする"""
+        # float32 は最短の10進表記を経由して戻す（95.3 が 95.30000305... にならないように）
+        columns = {name: [float(v) for v in records[name].astype(str)] for name in VALUE_FIELDS}
+        targets = records['target'].tolist()
+        entries = []
+        for i, ts_ns in enumerate(records['ts_ns'].tolist()):
+            entry = {'timestamp': _ns_to_iso(ts_ns),
+                     'download': columns['download'][i], 'upload': columns['upload'][i]}
+            if targets[i] >= 0:
+                entry['target'] = self.targets[targets[i]]
+            for name in OPTIONAL_VALUES:
+                value = columns[name][i]
+                if value == value:  # NaN はなし
+                    entry[name] = value
+            entries.append(entry)
+        return entries
+
+
+def tail_arrays(path, n, target=None):
+    """最新 n 件を (タイムスタンプ[epoch 秒], download, upload) の配列で返す
+
+    download / upload は memmap の列ビュー（コピーなし）。dict を作らないので
+    NetworkSpeedMonitor.load_history の起動時の読み込みに使う。
+    """
+    if not os.path.exists(path):
+        empty = np.empty(0)
+        return empty, empty, empty
+    records = BinaryHistory(path).tail_records(n, target)
+    return records['ts_ns'] / 1e9, records['download'], records['upload']
+
+
+def read_range(path, start=None, end=None, target=None):
+    """[start, end)（epoch 秒、None は制限なし）のエントリを古い順に返す"""
+    if not os.path.exists(path):
+        return []
+    history = BinaryHistory(path)
+    ts = history.records['ts_ns']
+    mask = np.ones(len(ts), dtype=bool)
+    if start is not None:
+        mask &= ts >= _to_ns(start)
+    if end is not None:
+        mask &= ts < _to_ns(end)
+    target_mask = history.target_mask(target)
+    if target_mask is not None:
+        mask &= target_mask
+    records = history.records[mask]
+    # 追記順は時刻順とは限らない（集約サービスのまとめ書きなど）
+    return history.entries(records[np.argsort(records['ts_ns'], kind='stable')])
+
+
+def entries_after(path, position):
+    """position（(0, レコード数)）より後に追記されたエントリと新しい位置（history_query の取り込み用）"""
+    if not os.path.exists(path):
+        return [], position
+    history = BinaryHistory(path)
+    after = position[1] if position is not None else 0
+    if after > len(history):
+        # 作り直された（convert など）
+        after = 0
+    return history.entries(history.records[after:]), (0, len(history))
+
+
+class BinaryHistoryStore(HistoryStore):
+    """固定長レコードの追記専用ストア
+
+    - 追記は1レコードの書き込みのみ（O(1)）、fsync は JsonlHistoryStore と同じくまとめて実行
+    - 起動時に書きかけの末尾レコード（クラッシュ時）を切り詰めて復旧
+    """
+
+    def __init__(self, path, fsync_every=10, fsync_interval=30.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._pending = 0
+        self._last_fsync = time.monotonic()
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            self.targets = []
+            with open(path, 'wb') as f:
+                f.write(_encode_header(FIELDS, self.targets))
+        else:
+            dtype, self.targets, header_size = read_header(path)
+            if dtype != np.dtype(list(FIELDS)) or header_size != HEADER_SIZE:
+                raise ValueError(f"{path}: schema differs from the current one; convert it first")
+            with open(path, 'rb+') as f:
+                f.truncate(header_size + _record_count(path, dtype, header_size) * dtype.itemsize)
+        self._file = open(path, 'ab')
+
+    def _target_index(self, target):
+        if target is None:
+            return -1
+        try:
+            return self.targets.index(target)
+        except ValueError:
+            pass
+        # 新しい系列名はヘッダの targets に追加して書き直す
+        header = _encode_header(FIELDS, self.targets + [target])
+        self._file.flush()
+        with open(self.path, 'rb+') as f:
+            f.write(header)
+        self.targets.append(target)
+        return len(self.targets) - 1
+
+    def _pack(self, entry):
+        ts = datetime.fromisoformat(entry['timestamp']).timestamp()
+        return _RECORD.pack(_to_ns(ts), entry['download'], entry['upload'],
+                            *(NAN if entry.get(name) is None else entry[name]
+                              for name in OPTIONAL_VALUES),
+                            self._target_index(entry.get('target')))
+
+    def append(self, entry):
+        with span('serialize'):
+            record = self._pack(entry)
+        self._file.write(record)
+        # 別プロセスから読めるよう OS バッファまでは毎回書き出す
+        self._file.flush()
+        self._pending += 1
+        if (self._pending >= self.fsync_every
+                or time.monotonic() - self._last_fsync >= self.fsync_interval):
+            self._fsync()
+
+    def append_many(self, entries):
+        """まとめて追記し、追記した件数を返す（変換用。不正なエントリは飛ばす）"""
+        chunk = bytearray()
+        count = 0
+        for entry in entries:
+            try:
+                chunk += self._pack(entry)
+            except (KeyError, TypeError, ValueError, struct.error):
+                continue
+            count += 1
+        self._file.write(chunk)
+        self._pending += count
+        self.flush()
+        return count
+
+    def _fsync(self):
+        with span('fsync'):
+            os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_fsync = time.monotonic()
+
+    def flush(self):
+        if self._file.closed:
+            return
+        self._file.flush()
+        if self._pending:
+            self._fsync()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def tail(self, n, target=None):
+        self.flush()
+        history = BinaryHistory(self.path)
+        return history.entries(history.tail_records(n, target))
+
+    def tail_arrays(self, n, target=None):
+        self.flush()
+        return tail_arrays(self.path, n, target)
+
+
+class BinaryHistoryReader:
+    """別プロセスから .bin ストアを追跡する読み取り専用リーダー（件数で続きを読む）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._count = 0
+
+    def tail(self, n, target=None):
+        """最新 n 件を返し、以降の poll() はその続きから読む"""
+        if not os.path.exists(self.path):
+            return []
+        history = BinaryHistory(self.path)
+        self._count = len(history)
+        return history.entries(history.tail_records(n, target))
+
+    def tail_arrays(self, n, target=None):
+        if not os.path.exists(self.path):
+            return tail_arrays(self.path, n, target)
+        history = BinaryHistory(self.path)
+        self._count = len(history)
+        records = history.tail_records(n, target)
+        return records['ts_ns'] / 1e9, records['download'], records['upload']
+
+    def poll(self):
+        """前回以降に追記されたエントリを返す"""
+        if not os.path.exists(self.path):
+            return []
+        history = BinaryHistory(self.path)
+        if len(history) < self._count:
+            # 作り直された
+            self._count = 0
+        entries = history.entries(history.records[self._count:])
+        self._count = len(history)
+        return entries
+
+    def close(self):
+        pass
+
+
+def _read_entries(path):
+    """変換元を拡張子で判別して読む（.json は旧形式の JSON 配列）"""
+    if os.path.splitext(path)[1] == '.json':
+        with open(path, 'r') as f:
+            return json.load(f)
+    if os.path.splitext(path)[1] == '.bin':
+        return read_range(path)
+    return read_history_range(path)
+
+
+def _temporary_path(dst):
+    """dst と同じ拡張子の一時ファイル名（拡張子で形式を判別するため .tmp は拡張子の前に挟む）"""
+    root, ext = os.path.splitext(dst)
+    return f"{root}.tmp{ext}"
+
+
+def _remove_files(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def convert(src, dst):
+    """src の履歴を dst へ書き出し、件数を返す（形式はどちらも拡張子で判別）
+
+    一時ファイルに書き終えてから dst を置き換えるので、既存の dst に追記はしない
+    （同じ変換を繰り返しても件数は変わらない）。dst の古いロールアップ索引は削除する。
+    """
+    from history_query import rollup_path
+
+    entries = _read_entries(src)
+    ext = os.path.splitext(dst)[1]
+    tmp_path = _temporary_path(dst)
+    # 中断した前回の変換の残り
+    _remove_files(tmp_path, tmp_path + '-wal', tmp_path + '-shm')
+    if ext == '.json':
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f, indent=2)
+        count = len(entries)
+    elif ext == '.bin':
+        with BinaryHistoryStore(tmp_path) as store:
+            count = store.append_many(entries)
+    elif _is_sqlite_path(dst):
+        with open_history_store(tmp_path) as store:
+            count = store.append_many(entries)
+        # 置き換える前のデータベースの WAL が残っていると新しいファイルに適用されてしまう
+        _remove_files(dst + '-wal', dst + '-shm')
+    else:
+        # 変換中にローテーションすると一時ファイルの外に書かれるので上限なしで書く
+        with JsonlHistoryStore(tmp_path, max_bytes=0, rollups=False) as store:
+            count = store.append_many(entries)
+    os.replace(tmp_path, dst)
+    # 置き換える前の内容を集計した索引が残っていると二重に数える（次の sync で作り直される）
+    index = rollup_path(dst)
+    _remove_files(index, index + '-wal', index + '-shm')
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fixed-width binary history (.bin) tools")
+    sub = parser.add_subparsers(dest='command', required=True)
+    conv = sub.add_parser('convert', help="convert between .json (legacy), .jsonl, .db and .bin")
+    conv.add_argument('src')
+    conv.add_argument('dst')
+    info = sub.add_parser('info', help="print the header and record count of a .bin file")
+    info.add_argument('path')
+    args = parser.parse_args(argv)
+
+    if args.command == 'convert':
+        start = time.perf_counter()
+        count = convert(args.src, args.dst)
+        print(f"Converted {count} entries: {args.src} -> {args.dst} "
+              f"({time.perf_counter() - start:.2f}s)")
+        return
+    try:
+        history = BinaryHistory(args.path)
+    except (OSError, ValueError) as e:
+        raise SystemExit(str(e))
+    print(f"Records : {len(history)} x {history.dtype.itemsize} bytes")
+    print(f"Fields  : {', '.join(f'{name}:{history.dtype[name].str}' for name in history.dtype.names)}")
+    print(f"Targets : {', '.join(history.targets) or '-'}")
+    if len(history):
+        ts = history.records['ts_ns']
+        print(f"Range   : {_ns_to_iso(ts[0])} - {_ns_to_iso(ts[-1])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""ヘッドレス測定コレクター
+
+matplotlib を読み込まずに速度測定と履歴保存だけを行う。
+表示は別プロセスの `network_speed_monitor.py --view` が履歴ストアを追跡して行う。
+"""
+import argparse
+import os
+import signal
+import socket
+import threading
+import time
+from datetime import datetime
+
+from history_store import (DEFAULT_HISTORY_FILE, LEGACY_HISTORY_FILE,
+                           open_history_store, migrate_json_history)
+from instrumentation import add_instrument_arguments, run_instrumented, span
+from latency_probe import add_probe_arguments, prober_from_args, unpack_rtts
+from measurement_engines import SpeedtestEngine, add_engine_arguments, engine_from_args
+from scheduler import AdaptiveScheduler, FixedRateScheduler
+from server_cache import DEFAULT_CACHE_FILE
+
+
+class SpeedCollector:
+    """速度測定のスケジューラと履歴の書き込みを担当する"""
+
+    def __init__(self, test_interval=60, data_file=DEFAULT_HISTORY_FILE,
+                 cache_file=DEFAULT_CACHE_FILE, engine=None, jitter=0.0,
+                 adaptive=False, probe_interval=2.0, baseline_interval=600.0, metrics=None,
+                 prober=None, pusher=None):
+        self.test_interval = test_interval
+        # スケジュール設定（adaptive ではレイテンシ測定を probe_interval ごとに行い、
+        # 帯域測定は異常時と baseline_interval ごとだけ）
+        self.jitter = jitter
+        self.adaptive = adaptive
+        self.probe_interval = probe_interval
+        self.baseline_interval = baseline_interval
+        self.scheduler = None
+        self.data_file = data_file
+        self.running = False
+        # 測定エンジン（既定は speedtest.net、設定・サーバー選択はキャッシュを使う）
+        self.engine = engine if engine is not None else SpeedtestEngine(cache_file)
+        self.stop_event = threading.Event()
+        # 測定ごとに呼ばれるコールバック（timestamp, download, upload）
+        self.on_sample = None
+        # メトリクス（metrics_exporter.SpeedMetrics）。ラベルはエンジン名
+        self.metrics = metrics
+        self.metrics_target = self.engine.name
+        # 帯域測定と並行して動く高頻度のレイテンシプローブ（latency_probe.LatencyProber）
+        self.prober = prober
+        if prober is not None and metrics is not None:
+            prober.add_batch_callback(self.observe_latency_batch)
+        # 集約サービスへの送信（aggregator.AggregatorPusher）
+        self.pusher = pusher
+
+        # 旧形式の履歴ファイルがあれば初回のみ移行
+        migrate_legacy = (not os.path.exists(self.data_file)
+                          and os.path.exists(LEGACY_HISTORY_FILE))
+        self.history = open_history_store(self.data_file)
+        if migrate_legacy:
+            try:
+                count = migrate_json_history(LEGACY_HISTORY_FILE, self.history)
+                print(f"Migrated {count} entries from {LEGACY_HISTORY_FILE}")
+            except (OSError, ValueError) as e:
+                print(f"History migration failed: {e}")
+
+    def save_data(self, timestamp, download, upload, ping=None):
+        """データを保存（履歴ストアへ1件追記）"""
+        entry = {
+            'timestamp': timestamp.isoformat(),
+            'download': download,
+            'upload': upload
+        }
+        if ping is not None:
+            entry['ping'] = ping
+        with span('save_data'):
+            self.history.append(entry)
+        if self.pusher is not None:
+            self.pusher.push(entry)
+
+    def test_speed(self):
+        """速度テストを実行し (download, upload, ping) を返す（失敗時はすべて None）"""
+        start = time.perf_counter()
+        try:
+            with span('measure'):
+                download_speed, upload_speed, ping = self.engine.measure()
+        except Exception as e:
+            if self.metrics is not None:
+                self.metrics.observe_failure(self.metrics_target, time.perf_counter() - start)
+            # 即座に再初期化せず、連続失敗に応じて待ち時間を延ばす
+            delay = self.engine.record_failure()
+            print(f"Speed test error: {e} (retrying in {delay:.0f}s)")
+            return None, None, None
+        if self.metrics is not None:
+            self.metrics.observe_test(self.metrics_target, download_speed, upload_speed,
+                                      ping, time.perf_counter() - start)
+        return download_speed, upload_speed, ping
+
+    def _observe_lag(self):
+        if self.metrics is not None and self.scheduler is not None:
+            self.metrics.set_scheduler_lag(self.metrics_target, self.scheduler.last_lag)
+
+    def probe_latency(self):
+        """adaptive モードのレイテンシ測定（メトリクスにも記録）"""
+        with span('probe_latency'):
+            rtt = self.engine.probe_latency()
+        if self.metrics is not None:
+            self._observe_lag()
+            self.metrics.observe_probe(self.metrics_target, rtt)
+        return rtt
+
+    def observe_latency_batch(self, entry):
+        """レイテンシプローブのバッチをメトリクスに記録（ラベルはプローブの指定）
+
+        個々の RTT を1件ずつ数え、ジッターと損失率はバッチの値で更新する。
+        """
+        rtts = unpack_rtts(entry)
+        target = entry.get('probe', self.prober.probe_spec)
+        for rtt in rtts[:-1]:
+            self.metrics.observe_probe(target, rtt)
+        if rtts:
+            self.metrics.observe_probe(target, rtts[-1], entry.get('jitter'), entry.get('loss'))
+
+    def run_test(self):
+        """1回測定して記録し、ダウンロード速度（失敗時は None）を返す"""
+        with span('run_test'):
+            download, upload, ping = self.test_speed()
+            if not self.running or download is None or upload is None:
+                return None
+            timestamp = datetime.now()
+            if self.on_sample is not None:
+                self.on_sample(timestamp, download, upload)
+            self.save_data(timestamp, download, upload, ping)
+        ping_text = f", Ping: {ping:.1f} ms" if ping is not None else ""
+        print(f"{timestamp.strftime('%H:%M:%S')} - Down: {download:.2f} Mbps, "
+              f"Up: {upload:.2f} Mbps{ping_text}")
+        return download
+
+    def speed_test_worker(self):
+        """スケジューラに従って速度テストを繰り返し実行"""
+        if self.adaptive:
+            self.scheduler = AdaptiveScheduler(
+                self.probe_latency, self.run_test,
+                probe_interval=self.probe_interval, baseline_interval=self.baseline_interval,
+                min_test_gap=self.test_interval, jitter=self.jitter, stop_event=self.stop_event,
+                can_probe=lambda: self.engine.probe_address() is not None)
+            self.scheduler.run(backoff=self.engine.backoff_remaining)
+            return
+
+        # 単調時計で start + k * interval に揃える（測定時間で周期がずれない）
+        self.scheduler = FixedRateScheduler(self.test_interval, jitter=self.jitter,
+                                            stop_event=self.stop_event)
+        while self.running:
+            self.run_test()
+            # バックオフ中はその時間が過ぎるまでのティックを飛ばす。停止要求ならすぐ抜ける
+            if not self.scheduler.wait_next(min_delay=self.engine.backoff_remaining()):
+                break
+            self._observe_lag()
+
+    def measure_once(self):
+        """1回だけ測定して保存し、(timestamp, download, upload) を返す"""
+        self.running = True
+        download, upload, ping = self.test_speed()
+        self.running = False
+        if download is None or upload is None:
+            return None
+        timestamp = datetime.now()
+        self.save_data(timestamp, download, upload, ping)
+        self.history.flush()
+        return timestamp, download, upload
+
+    def start(self):
+        """バックグラウンドスレッドで測定を開始"""
+        self.running = True
+        self.stop_event.clear()
+        thread = threading.Thread(target=self.speed_test_worker, daemon=True)
+        thread.start()
+        self._start_background()
+        return thread
+
+    def stop_monitoring(self):
+        """測定を停止し、履歴をフラッシュ"""
+        self.running = False
+        self.stop_event.set()
+        self.engine.close()
+        self._stop_background()
+        self.history.flush()
+
+    def _start_background(self):
+        if self.prober is not None:
+            self.prober.start()
+        if self.pusher is not None:
+            self.pusher.start()
+
+    def _stop_background(self):
+        if self.prober is not None:
+            self.prober.stop()
+            self.prober.store.close()
+        if self.pusher is not None:
+            self.pusher.stop()
+
+    def install_signal_handlers(self):
+        """SIGTERM / SIGINT で測定ループを止める"""
+        def handle(signum, frame):
+            print(f"\nReceived signal {signum}, stopping collector...")
+            self.running = False
+            self.stop_event.set()
+
+        signal.signal(signal.SIGTERM, handle)
+        signal.signal(signal.SIGINT, handle)
+
+    def run_forever(self):
+        """メインスレッドで測定を続け、停止時に履歴を閉じる"""
+        self.install_signal_handlers()
+        self.running = True
+        self.stop_event.clear()
+        self._start_background()
+        try:
+            self.speed_test_worker()
+        finally:
+            self.running = False
+            self.engine.close()
+            self._stop_background()
+            self.history.close()
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Headless network speed collector")
+    parser.add_argument('--interval', type=float, default=10,
+                        help="measurement interval in seconds (default: 10)")
+    parser.add_argument('--data-file', default=DEFAULT_HISTORY_FILE,
+                        help=f"history store path, .jsonl, .db or .bin (default: {DEFAULT_HISTORY_FILE})")
+    parser.add_argument('--cache-file', default=DEFAULT_CACHE_FILE,
+                        help=f"speedtest server cache path (default: {DEFAULT_CACHE_FILE})")
+    add_engine_arguments(parser)
+    add_schedule_arguments(parser)
+    add_metrics_arguments(parser)
+    add_probe_arguments(parser)
+    add_push_arguments(parser)
+    add_instrument_arguments(parser)
+    return parser
+
+
+def add_schedule_arguments(parser):
+    """スケジュール関連のコマンドライン引数を追加"""
+    group = parser.add_argument_group('schedule')
+    group.add_argument('--jitter', type=float, default=0.0,
+                       help="random offset per tick as a fraction of the interval, e.g. 0.1 (default: 0)")
+    group.add_argument('--adaptive', action='store_true',
+                       help="probe latency often and run bandwidth tests only on anomalies "
+                            "or every --baseline-interval")
+    group.add_argument('--probe-interval', type=float, default=2.0,
+                       help="seconds between latency probes in --adaptive mode (default: 2)")
+    group.add_argument('--baseline-interval', type=float, default=600.0,
+                       help="seconds between routine bandwidth tests in --adaptive mode (default: 600)")
+    return group
+
+
+def add_metrics_arguments(parser):
+    """メトリクス公開のコマンドライン引数を追加"""
+    group = parser.add_argument_group('metrics')
+    group.add_argument('--metrics-port', type=int,
+                       help="serve Prometheus/OpenMetrics metrics on this port (default: disabled)")
+    group.add_argument('--metrics-host', default='0.0.0.0',
+                       help="address for the metrics endpoint (default: 0.0.0.0)")
+    return group
+
+
+def metrics_from_args(args):
+    """--metrics-port が指定されていればメトリクスサーバーを起動して SpeedMetrics を返す"""
+    if args.metrics_port is None:
+        return None
+    # http.server を使うので、メトリクスを公開するときだけ読み込む
+    from metrics_exporter import SpeedMetrics, start_metrics_server
+    metrics = SpeedMetrics()
+    server = start_metrics_server(metrics, args.metrics_port, args.metrics_host)
+    print(f"Serving metrics on {server.url}")
+    return metrics
+
+
+def add_push_arguments(parser):
+    """集約サービスへの送信のコマンドライン引数を追加"""
+    group = parser.add_argument_group('aggregator push')
+    group.add_argument('--push', metavar='URL',
+                       help="also send results to an aggregator, e.g. http://host:8470")
+    group.add_argument('--push-target', default=socket.gethostname(),
+                       help="site name used on the aggregator (default: host name)")
+    group.add_argument('--push-interval', type=float, default=10.0,
+                       help="seconds between pushes (default: 10)")
+    return group
+
+
+def pusher_from_args(args):
+    """--push が指定されていれば集約サービスへの送信を作る（開始は SpeedCollector が行う）"""
+    if not getattr(args, 'push', None):
+        return None
+    # urllib / http を使うので、送信するときだけ読み込む
+    from aggregator import AggregatorPusher
+    print(f"Pushing results to {args.push} as '{args.push_target}'")
+    return AggregatorPusher(args.push, args.push_target, interval=args.push_interval)
+
+
+def collector_options(args):
+    """引数から SpeedCollector のスケジュール設定を取り出す"""
+    return {
+        'jitter': args.jitter,
+        'adaptive': args.adaptive,
+        'probe_interval': args.probe_interval,
+        'baseline_interval': args.baseline_interval,
+    }
+
+
+def run(args):
+    """解析済みの引数でヘッドレス収集を実行"""
+    print("Network Speed Collector starting (headless)...")
+    collector = SpeedCollector(test_interval=args.interval, data_file=args.data_file,
+                               engine=engine_from_args(args, args.cache_file),
+                               metrics=metrics_from_args(args),
+                               prober=prober_from_args(args, args.data_file),
+                               pusher=pusher_from_args(args),
+                               **collector_options(args))
+    run_instrumented(args, collector.run_forever)
+    print("Collector stopped.")
+
+
+def main(argv=None):
+    run(build_arg_parser().parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
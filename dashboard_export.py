@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""ダッシュボードの静的書き出し（PNG / SVG / HTML）
+
+ウィンドウを開かずに、ライブ表示と同じダークテーマのグラフを Agg で描画して保存する。
+タイル（履歴ファイル × ターゲット × 期間）ごとに描画し、前回から
+データが変わっていないタイルは描き直さない。cron から定期実行して
+多数のプローブのダッシュボードを公開する用途を想定している。
+
+- 相対期間（24h, 7d など）は期間の 1/288 単位に終端を揃えるので、
+  同じ区切りの中でデータが増えていなければ描画をスキップできる
+- 履歴ファイルのサイズ・更新時刻が変わっていなければデータも読まない
+- index.html は画像を埋め込んだ単体のファイル
+
+使い方:
+    python dashboard_export.py --out dashboard --range 24h --range 7d
+    python dashboard_export.py --data-file probes.jsonl --target isp --target dc1 --out /var/www/net
+"""
+import argparse
+import base64
+import hashlib
+import html
+import json
+import math
+import os
+import re
+import time
+from datetime import datetime
+
+from history_store import DEFAULT_HISTORY_FILE, read_history_range
+
+MANIFEST_FILE = 'manifest.json'
+FORMATS = ('png', 'svg')
+# 相対期間の終端を揃える単位（期間 / ALIGN_STEPS）
+ALIGN_STEPS = 288
+_DURATION_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+# 描画方法を変えたら上げる（既存のタイルを描き直させる）
+RENDER_VERSION = 1
+
+
+def parse_range(spec, now=None):
+    """期間指定を (start, end) の epoch 秒に変換
+
+    "24h" / "7d" などの相対期間、または "2026-10-01..2026-10-08" の絶対期間。
+    """
+    if '..' in spec:
+        start, end = spec.split('..', 1)
+        return (datetime.fromisoformat(start).timestamp() if start else None,
+                datetime.fromisoformat(end).timestamp() if end else None)
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([mhdw])', spec)
+    if not match:
+        raise ValueError(f"invalid range: {spec} (use e.g. 24h, 7d or START..END)")
+    span = float(match.group(1)) * _DURATION_UNITS[match.group(2)]
+    now = time.time() if now is None else now
+    step = span / ALIGN_STEPS
+    end = math.ceil(now / step) * step
+    return end - span, end
+
+
+def _slug(text):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', text).strip('_') or 'all'
+
+
+def _store_signature(path):
+    """履歴ファイルのサイズ・更新時刻（変わっていなければデータも変わっていない）"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+
+def _digest(entries):
+    h = hashlib.sha1()
+    for entry in entries:
+        h.update(f"{entry['timestamp']}|{entry['download']}|{entry['upload']}\n".encode('utf-8'))
+    return h.hexdigest()
+
+
+class Tile:
+    """1枚のグラフ（履歴ファイル × ターゲット × 期間）"""
+
+    def __init__(self, data_file, target, range_spec, now=None):
+        self.data_file = data_file
+        self.target = target
+        self.range_spec = range_spec
+        self.start, self.end = parse_range(range_spec, now)
+        stem = os.path.splitext(os.path.basename(data_file))[0]
+        self.name = f"{_slug(stem)}-{_slug(target or 'all')}-{_slug(range_spec)}"
+
+    def key(self, formats, figsize, dpi):
+        """描画結果を左右する設定（データ以外）"""
+        return [RENDER_VERSION, self.start, self.end, list(formats), list(figsize), dpi]
+
+    def load(self):
+        return read_history_range(self.data_file, self.start, self.end, self.target)
+
+
+def summarize(entries):
+    """HTML に載せる統計（件数・平均・p5・p95・最新値・状態）"""
+    import numpy as np
+    from speed_stats import DegradationDetector
+
+    summary = {'count': len(entries)}
+    if not entries:
+        return summary
+    summary['first'] = entries[0]['timestamp']
+    summary['last'] = entries[-1]['timestamp']
+    statuses = []
+    for column in ('download', 'upload'):
+        values = np.array([float(e[column]) for e in entries])
+        p5, p95 = np.percentile(values, (5, 95))
+        detector = DegradationDetector()
+        detector.extend(values)
+        statuses.append(detector)
+        summary[column] = {'mean': float(values.mean()), 'p5': float(p5), 'p95': float(p95),
+                           'latest': float(values[-1])}
+    summary['status'] = max(statuses, key=lambda d: d.status).status_name
+    return summary
+
+
+def render_tile(tile, entries, out_dir, formats=('png',), figsize=(12, 6), dpi=100):
+    """タイルを Agg で描画して各形式で保存し、保存したパスを返す"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from network_speed_monitor import NetworkSpeedMonitor
+
+    monitor = NetworkSpeedMonitor(max_data_points=max(1, len(entries)), target=tile.target,
+                                  entries=entries)
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    monitor.render(fig)
+    paths = []
+    for fmt in formats:
+        path = os.path.join(out_dir, f"{tile.name}.{fmt}")
+        # 書きかけの画像を公開しないよう一時ファイルから置き換える
+        tmp = f"{path}.tmp"
+        fig.savefig(tmp, format=fmt, facecolor=fig.get_facecolor(), bbox_inches='tight')
+        os.replace(tmp, path)
+        paths.append(path)
+    return paths
+
+
+class DashboardExporter:
+    """タイルをまとめて書き出し、変更のないタイルは描き直さない"""
+
+    def __init__(self, out_dir, formats=('png',), figsize=(12, 6), dpi=100, force=False):
+        self.out_dir = out_dir
+        self.formats = tuple(formats)
+        self.figsize = tuple(figsize)
+        self.dpi = dpi
+        self.force = force
+        self.manifest_path = os.path.join(out_dir, MANIFEST_FILE)
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self):
+        tmp = f"{self.manifest_path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp, self.manifest_path)
+
+    def _outputs_exist(self, tile, record):
+        # 旧形式のマニフェスト（images なし）は全形式が揃っていることを求める
+        images = record.get('images', self.formats)
+        return all(os.path.exists(os.path.join(self.out_dir, f"{tile.name}.{fmt}"))
+                   for fmt in images)
+
+    def _remove_images(self, tile, keep=()):
+        """今回描画しなかった形式の古い画像を消す（期間内のデータがなくなったときなど）"""
+        for fmt in FORMATS:
+            if fmt in keep:
+                continue
+            try:
+                os.remove(os.path.join(self.out_dir, f"{tile.name}.{fmt}"))
+            except FileNotFoundError:
+                pass
+
+    def export_tile(self, tile):
+        """必要ならタイルを描画し、'rendered' / 'unchanged' / 'skipped' のいずれかを返す"""
+        key = tile.key(self.formats, self.figsize, self.dpi)
+        signature = _store_signature(tile.data_file)
+        previous = self.manifest.get(tile.name)
+        fresh = (not self.force and previous is not None and previous.get('key') == key
+                 and self._outputs_exist(tile, previous))
+        # 履歴ファイルも期間も変わっていなければデータを読まずに済ませる
+        if fresh and previous.get('store') == signature:
+            return 'skipped'
+        entries = tile.load()
+        digest = _digest(entries)
+        record = {'key': key, 'store': signature, 'digest': digest,
+                  'target': tile.target, 'range': tile.range_spec, 'data_file': tile.data_file}
+        if fresh and previous.get('digest') == digest:
+            record['summary'] = previous.get('summary')
+            record['images'] = previous.get('images', list(self.formats))
+            self.manifest[tile.name] = record
+            return 'unchanged'
+        record['summary'] = summarize(entries)
+        # データがなければ描かず、前回の画像も残さない（件数 0 の横に古いグラフを載せない）
+        record['images'] = list(self.formats) if entries else []
+        if entries:
+            render_tile(tile, entries, self.out_dir, self.formats, self.figsize, self.dpi)
+        self._remove_images(tile, keep=record['images'])
+        record['rendered_at'] = datetime.now().isoformat(timespec='seconds')
+        self.manifest[tile.name] = record
+        return 'rendered'
+
+    def export(self, tiles):
+        """全タイルを書き出し、変更があれば index.html を作り直す。結果の件数を返す"""
+        os.makedirs(self.out_dir, exist_ok=True)
+        results = {'rendered': 0, 'unchanged': 0, 'skipped': 0}
+        for tile in tiles:
+            result = self.export_tile(tile)
+            results[result] += 1
+            print(f"{tile.name}: {result}")
+        index_path = os.path.join(self.out_dir, 'index.html')
+        if results['rendered'] or not os.path.exists(index_path):
+            write_html(index_path, tiles, self.manifest, self.out_dir)
+        self._save_manifest()
+        return results
+
+
+def _image_tag(out_dir, tile, record):
+    """PNG（なければ SVG）を data URI で埋め込んだ img タグ
+
+    マニフェストに記録された、現在のデータで描画した形式だけを使う。
+    """
+    images = record.get('images', ())
+    for fmt, mime in (('png', 'image/png'), ('svg', 'image/svg+xml')):
+        if fmt not in images:
+            continue
+        path = os.path.join(out_dir, f"{tile.name}.{fmt}")
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = base64.b64encode(f.read()).decode('ascii')
+            return f'<img alt="{html.escape(tile.name)}" src="data:{mime};base64,{data}">'
+    return '<p class="empty">NO DATA</p>'
+
+
+def _summary_rows(summary):
+    if not summary or not summary.get('count'):
+        return '<tr><td colspan="5">no samples in range</td></tr>'
+    rows = []
+    for column, label in (('download', 'DL'), ('upload', 'UP')):
+        stats = summary[column]
+        rows.append(f"<tr><th>{label}</th><td>{stats['latest']:.1f}</td><td>{stats['mean']:.1f}</td>"
+                    f"<td>{stats['p5']:.1f}</td><td>{stats['p95']:.1f}</td></tr>")
+    return ''.join(rows)
+
+
+HTML_STYLE = """
+body { background: #0D1117; color: #58A6FF; font-family: monospace; margin: 1.5em; }
+h1 { font-size: 1.4em; }
+.tile { border: 1px solid #30363D; margin-bottom: 1.5em; padding: 0.8em; }
+.tile h2 { font-size: 1.1em; margin: 0 0 0.4em 0; }
+.tile img { max-width: 100%; }
+table { border-collapse: collapse; margin-top: 0.4em; }
+th, td { padding: 0.1em 0.8em; text-align: right; }
+.status-OK, .status-WARMUP { color: #00FF41; }
+.status-WARN { color: #F0B429; }
+.status-DEGRADED, .status-DOWN { color: #FF5555; }
+.empty { color: #8B949E; }
+"""
+
+
+def write_html(path, tiles, manifest, out_dir):
+    """画像を埋め込んだ単体の HTML レポートを書き出す"""
+    sections = []
+    for tile in tiles:
+        record = manifest.get(tile.name, {})
+        summary = record.get('summary') or {}
+        status = summary.get('status', 'NO DATA')
+        target = tile.target or 'all'
+        period = (f"{datetime.fromtimestamp(tile.start):%Y-%m-%d %H:%M} - "
+                  f"{datetime.fromtimestamp(tile.end):%Y-%m-%d %H:%M}"
+                  if tile.start is not None and tile.end is not None else tile.range_spec)
+        sections.append(
+            f'<div class="tile"><h2>{html.escape(os.path.basename(tile.data_file))} '
+            f'[{html.escape(target)}] {html.escape(tile.range_spec)} '
+            f'<span class="status-{html.escape(status)}">[{html.escape(status)}]</span></h2>'
+            f'<div>{html.escape(period)} / {summary.get("count", 0)} samples</div>'
+            f'{_image_tag(out_dir, tile, record)}'
+            f'<table><tr><th></th><th>latest</th><th>mean</th><th>p5</th><th>p95</th></tr>'
+            f'{_summary_rows(summary)}</table></div>')
+    document = (
+        '<!DOCTYPE html><html><head><meta charset="utf-8">'
+        '<title>NETWORK_SPEED_MONITOR</title>'
+        f'<style>{HTML_STYLE}</style></head><body>'
+        f'<h1>&gt;&gt;&gt; NETWORK_SPEED_MONITOR</h1>'
+        f'<p>generated {datetime.now():%Y-%m-%d %H:%M:%S} (Mbps)</p>'
+        + ''.join(sections) + '</body></html>\n')
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(document)
+    os.replace(tmp, path)
+
+
+def build_tiles(data_files, targets, ranges, now=None):
+    now = time.time() if now is None else now
+    return [Tile(data_file, target, range_spec, now)
+            for data_file in data_files for target in targets for range_spec in ranges]
+
+
+def add_export_arguments(parser):
+    """書き出し関連のコマンドライン引数を追加"""
+    group = parser.add_argument_group('export')
+    group.add_argument('--range', action='append', dest='ranges',
+                       help="time range per tile: 24h, 7d, 30d or START..END in ISO format "
+                            "(repeatable, default: 24h)")
+    group.add_argument('--format', action='append', dest='formats', choices=FORMATS,
+                       help="image format (repeatable, default: png)")
+    group.add_argument('--size', default='12x6',
+                       help="figure size in inches, WIDTHxHEIGHT (default: 12x6)")
+    group.add_argument('--dpi', type=int, default=100, help="image resolution (default: 100)")
+    group.add_argument('--force', action='store_true', help="re-render every tile")
+    return group
+
+
+def export_from_args(args, out_dir, data_files, targets):
+    """解析済みの引数でダッシュボードを書き出す"""
+    width, _, height = args.size.partition('x')
+    exporter = DashboardExporter(out_dir, formats=args.formats or ('png',),
+                                 figsize=(float(width), float(height)), dpi=args.dpi,
+                                 force=args.force)
+    tiles = build_tiles(data_files, targets, args.ranges or ['24h'])
+    start = time.perf_counter()
+    results = exporter.export(tiles)
+    print(f"{results['rendered']} rendered, {results['unchanged']} unchanged, "
+          f"{results['skipped']} skipped in {time.perf_counter() - start:.2f}s "
+          f"-> {os.path.join(out_dir, 'index.html')}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export static dashboard images and an HTML report")
+    parser.add_argument('--out', default='dashboard', help="output directory (default: dashboard)")
+    parser.add_argument('--data-file', action='append', dest='data_files',
+                        help=f"history store path, repeatable (default: {DEFAULT_HISTORY_FILE})")
+    parser.add_argument('--target', action='append', dest='targets',
+                        help="target series, repeatable (default: all entries merged)")
+    add_export_arguments(parser)
+    args = parser.parse_args(argv)
+    export_from_args(args, args.out, args.data_files or [DEFAULT_HISTORY_FILE],
+                     args.targets or [None])
+
+
+if __name__ == "__main__":
+    main()
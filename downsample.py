@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""長時間表示向けの間引き（ダウンサンプリング）
+
+- minmax_decimate: バケットごとの最小値・最大値を時系列順に残す
+- lttb: Largest-Triangle-Three-Buckets で見た目の形を保って間引く
+- TieredAggregator: 1分 / 10分 / 1時間の集約ティアを追記ごとに更新する（extend でまとめて追加も可）
+"""
+import numpy as np
+
+from sample_buffer import SampleBuffer
+
+# (ティア名, バケット幅[秒])
+DEFAULT_TIERS = (('1min', 60), ('10min', 600), ('1h', 3600))
+
+
+def minmax_decimate(x, y, n_buckets):
+    """各バケットの最小・最大点を残して最大 2*n_buckets 点に間引く"""
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(y)
+    if n_buckets <= 0 or n <= 2 * n_buckets:
+        return x, y
+    bucket = -(-n // n_buckets)  # 切り上げ
+    n_full = -(-n // bucket)
+    # 末尾の値で埋めて (バケット数, バケット幅) に整形（argmin/argmax は最初の出現位置を返す）
+    padded = np.empty(n_full * bucket, dtype=y.dtype)
+    padded[:n] = y
+    padded[n:] = y[-1]
+    blocks = padded.reshape(n_full, bucket)
+    base = np.arange(n_full) * bucket
+    i_min = base + blocks.argmin(axis=1)
+    i_max = base + blocks.argmax(axis=1)
+    # バケット内で時系列順に並べる
+    idx = np.empty(2 * n_full, dtype=np.intp)
+    idx[0::2] = np.minimum(i_min, i_max)
+    idx[1::2] = np.maximum(i_min, i_max)
+    idx = np.minimum(idx, n - 1)
+    return x[idx], y[idx]
+
+
+def lttb(x, y, n_out):
+    """Largest-Triangle-Three-Buckets で n_out 点に間引く"""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n_out >= n:
+        return x, y
+    if n_out < 3:
+        # 三角形を作れないので末尾（2点なら先頭と末尾）だけを残す
+        idx = np.array([0, n - 1] if n_out == 2 else [n - 1], dtype=np.intp)
+        return x[idx], y[idx]
+    # 先頭と末尾を除いた点を n_out - 2 個のバケットへ分割
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)
+    idx = np.empty(n_out, dtype=np.intp)
+    idx[0] = 0
+    idx[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # 次のバケットの平均点
+        next_start = end
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # 三角形の面積が最大になる点を選ぶ
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a])
+                      - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        idx[i + 1] = a
+    return x[idx], y[idx]
+
+
+def decimate_for_width(x, y, width_px, method='minmax'):
+    """描画幅（ピクセル）程度の点数まで間引く"""
+    n_target = max(2, int(width_px))
+    if method == 'lttb':
+        return lttb(x, y, n_target)
+    return minmax_decimate(x, y, n_target // 2)
+
+
+class TieredAggregator:
+    """生データから 1分 / 10分 / 1時間の集約ティアを追記ごとに維持する
+
+    各ティアは列ごとに min / max / mean を持つ SampleBuffer。
+    タイムスタンプはバケットの開始時刻。
+    """
+
+    def __init__(self, capacity, columns=('download', 'upload'), tiers=DEFAULT_TIERS):
+        self.columns = tuple(columns)
+        self.tier_widths = dict(tiers)
+        self.tiers = {}
+        self._open = {}
+        for name, _ in tiers:
+            tier_columns = [f"{c}_{s}" for c in self.columns for s in ('min', 'max', 'mean')]
+            self.tiers[name] = SampleBuffer(capacity, columns=tier_columns)
+            self._open[name] = None
+
+    def tier_names(self):
+        return ['raw'] + list(self.tiers)
+
+    def append(self, timestamp, *values):
+        """生サンプル1件を全ティアへ反映（O(ティア数)）"""
+        for name, width in self.tier_widths.items():
+            bucket_start = timestamp - (timestamp % width)
+            current = self._open[name]
+            if current is not None and current['start'] != bucket_start:
+                self._close(name)
+                current = None
+            if current is None:
+                current = {
+                    'start': bucket_start,
+                    'count': 0,
+                    'sum': [0.0] * len(values),
+                    'min': list(values),
+                    'max': list(values),
+                }
+                self._open[name] = current
+            current['count'] += 1
+            for i, value in enumerate(values):
+                current['sum'][i] += value
+                if value < current['min'][i]:
+                    current['min'][i] = value
+                if value > current['max'][i]:
+                    current['max'][i] = value
+
+    def extend(self, timestamps, *columns):
+        """複数の生サンプルをまとめて反映（append の繰り返しと同じ結果）
+
+        連続して同じバケットに入るサンプルを reduceat でまとめて集計し、
+        確定したバケットは SampleBuffer.extend で一度に追加する。
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if not len(timestamps):
+            return
+        values = [np.asarray(column, dtype=np.float64) for column in columns]
+        for name, width in self.tier_widths.items():
+            starts = timestamps - timestamps % width
+            bounds = np.concatenate(([0], np.flatnonzero(starts[1:] != starts[:-1]) + 1))
+            counts = np.diff(np.append(bounds, len(starts)))
+            sums = [np.add.reduceat(v, bounds) for v in values]
+            mins = [np.minimum.reduceat(v, bounds) for v in values]
+            maxs = [np.maximum.reduceat(v, bounds) for v in values]
+            first = 0
+            current = self._open[name]
+            if current is not None and current['start'] == starts[0]:
+                # 先頭の区間は集計中のバケットの続き
+                current['count'] += int(counts[0])
+                for i in range(len(values)):
+                    current['sum'][i] += float(sums[i][0])
+                    current['min'][i] = min(current['min'][i], float(mins[i][0]))
+                    current['max'][i] = max(current['max'][i], float(maxs[i][0]))
+                first = 1
+            last = len(bounds) - 1
+            if first > last:
+                continue
+            if current is not None:
+                self._close(name)
+            # 最後の区間以外は確定したバケット
+            if last > first:
+                closed = slice(first, last)
+                tier_columns = []
+                for i in range(len(values)):
+                    tier_columns += [mins[i][closed], maxs[i][closed],
+                                     sums[i][closed] / counts[closed]]
+                self.tiers[name].extend(starts[bounds[closed]], *tier_columns)
+            self._open[name] = {
+                'start': float(starts[bounds[last]]),
+                'count': int(counts[last]),
+                'sum': [float(s[last]) for s in sums],
+                'min': [float(m[last]) for m in mins],
+                'max': [float(m[last]) for m in maxs],
+            }
+
+    def _bucket_values(self, bucket):
+        row = []
+        for i in range(len(self.columns)):
+            row.extend((bucket['min'][i], bucket['max'][i], bucket['sum'][i] / bucket['count']))
+        return row
+
+    def _close(self, name):
+        bucket = self._open[name]
+        self.tiers[name].append(bucket['start'], *self._bucket_values(bucket))
+        self._open[name] = None
+
+    def series(self, tier, column):
+        """ティアの (タイムスタンプ, 平均, 最小, 最大) を返す（集計中のバケットも含む）"""
+        return self.snapshot().series(tier, column)
+
+    def snapshot(self):
+        """全ティアの読み取り専用スナップショット（集計中のバケットは値をコピーして固定）"""
+        tiers = {}
+        for name, buf in self.tiers.items():
+            bucket = self._open[name]
+            row = None if bucket is None else (bucket['start'], self._bucket_values(bucket))
+            tiers[name] = (buf.snapshot(), row)
+        return TierSnapshot(self.columns, tiers)
+
+
+class TierSnapshot:
+    """TieredAggregator.snapshot() の結果（別スレッドの追記の影響を受けない）"""
+
+    def __init__(self, columns, tiers):
+        self.columns = columns
+        self._tiers = tiers
+
+    def first_seq(self, tier):
+        """series() の先頭のバケットの通し番号（集計中のバケットは確定後と同じ番号）"""
+        return self._tiers[tier][0].first_seq
+
+    def series(self, tier, column):
+        """ティアの (タイムスタンプ, 平均, 最小, 最大) を返す（集計中のバケットも含む）"""
+        buf, row = self._tiers[tier]
+        ts = buf.timestamps
+        mean = buf.column(f"{column}_mean")
+        low = buf.column(f"{column}_min")
+        high = buf.column(f"{column}_max")
+        if row is None:
+            return ts, mean, low, high
+        start, values = row
+        # _bucket_values の並びは列ごとに (min, max, mean)
+        i = self.columns.index(column) * 3
+        return (np.append(ts, start),
+                np.append(mean, values[i + 2]),
+                np.append(low, values[i]),
+                np.append(high, values[i + 1]))
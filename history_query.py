@@ -0,0 +1,595 @@
+#!/usr/bin/env python3
+"""履歴のロールアップと期間クエリ
+
+履歴ストア（.jsonl / .db / .bin）を分・時・日単位に集約した SQLite の索引
+（既定は `<履歴ファイル>.rollup.db`）を差分だけ更新しながら保持し、
+長期間の範囲クエリを生データを走査せずに返す。
+
+- 集計値: 件数・最小・最大・平均・p5・p95（download / upload / ping）
+- パーセンタイルは対数ビンのスケッチ（相対誤差 1% 程度）で求める。
+  スケッチは足し合わせられるので、追記分だけを既存の集計に併合できる
+- 主キー (resolution, target, field, bucket) がそのまま時刻の索引になる
+- ローテーションで消える古い生データは、削除前にロールアップへ集約される
+- 取り込み位置は時刻ではなくストア内の位置（JSON Lines はファイルの inode とバイト位置、
+  SQLite は rowid、.bin はレコード数）で覚えるので、時刻が前後して追記されたエントリも漏れない
+
+使い方:
+    python history_query.py report --days 90 --resolution day --stat p95
+    python history_query.py compact --keep-days 30
+"""
+import argparse
+import json
+import math
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+from history_store import (DEFAULT_HISTORY_FILE, _is_binary_path, _is_sqlite_path,
+                           _read_lines_reverse, SqliteHistoryStore)
+
+RESOLUTIONS = (('minute', 60), ('hour', 3600), ('day', 86400))
+RESOLUTION_SECONDS = dict(RESOLUTIONS)
+COLUMNS = ('download', 'upload', 'ping')
+STATS = ('count', 'min', 'max', 'mean', 'p5', 'p95')
+
+# 対数ビンの相対誤差
+RELATIVE_ACCURACY = 0.01
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+_ZERO_KEY = 'z'  # 0 以下の値（測定失敗時の 0 Mbps など）
+
+
+def rollup_path(history_path):
+    """履歴ファイルに対応するロールアップ索引のパス"""
+    return f"{history_path}.rollup.db"
+
+
+def _bin_key(value):
+    if value <= 0:
+        return _ZERO_KEY
+    return str(math.ceil(math.log(value) / _LOG_GAMMA))
+
+
+def _bin_value(key):
+    if key == _ZERO_KEY:
+        return 0.0
+    return 2 * _GAMMA ** int(key) / (_GAMMA + 1)
+
+
+class Rollup:
+    """1列・1区間分の集計（件数・合計・最小・最大・対数ビン）"""
+
+    __slots__ = ('count', 'total', 'min', 'max', 'bins')
+
+    def __init__(self, count=0, total=0.0, min=None, max=None, bins=None):
+        self.count = count
+        self.total = total
+        self.min = min
+        self.max = max
+        self.bins = bins if bins is not None else {}
+
+    def add(self, value, key=None):
+        """値を1件加える（key は計算済みのビン）"""
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if key is None:
+            key = _bin_key(value)
+        self.bins[key] = self.bins.get(key, 0) + 1
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        self.count += other.count
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+
+    def percentile(self, q):
+        """q（0〜1）分位点の近似値。最小・最大の範囲に収める"""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        keys = sorted(self.bins, key=lambda k: -math.inf if k == _ZERO_KEY else int(k))
+        for key in keys:
+            seen += self.bins[key]
+            if seen > rank:
+                return min(self.max, max(self.min, _bin_value(key)))
+        return self.max
+
+    def summary(self):
+        if self.count == 0:
+            return None
+        return {
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.total / self.count,
+            'p5': self.percentile(0.05),
+            'p95': self.percentile(0.95),
+        }
+
+
+class BucketClock:
+    """タイムスタンプを区間の開始時刻に丸める（日はローカル時刻の0時で区切る）"""
+
+    def __init__(self):
+        self._days = {}
+
+    def start(self, resolution, ts):
+        if resolution != 'day':
+            step = RESOLUTION_SECONDS[resolution]
+            return ts - ts % step
+        # 夏時間などで1日の長さが変わっても日付で区切れるよう、時単位でキャッシュ
+        hour = int(ts // 3600)
+        day = self._days.get(hour)
+        if day is None:
+            day = datetime.fromtimestamp(ts).replace(
+                hour=0, minute=0, second=0, microsecond=0).timestamp()
+            self._days[hour] = day
+        return day
+
+
+def _entry_ts(entry):
+    return datetime.fromisoformat(entry['timestamp']).timestamp()
+
+
+class RollupIndex:
+    """ロールアップを保存する SQLite の索引
+
+    sync() は前回読み終えた位置より後に追記されたエントリだけを読んで集計に併合する。
+    位置は (世代, オフセット) で、JSON Lines はファイルの inode とバイト位置、
+    SQLite は (0, rowid)、.bin は (0, レコード数)。
+    位置の確認と更新は同じ書き込みトランザクション内で行うので、
+    複数プロセスが同時に sync しても二重に数えない。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS rollups ("
+            " resolution TEXT NOT NULL,"
+            " target TEXT NOT NULL,"
+            " field TEXT NOT NULL,"
+            " bucket REAL NOT NULL,"
+            " count INTEGER NOT NULL,"
+            " total REAL NOT NULL,"
+            " min REAL,"
+            " max REAL,"
+            " bins TEXT NOT NULL,"
+            " PRIMARY KEY (resolution, target, field, bucket)) WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS positions"
+            " (source TEXT PRIMARY KEY, generation INTEGER NOT NULL, offset INTEGER NOT NULL)"
+        )
+        # 旧版の時刻カーソル（次の sync で位置に置き換える）
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cursors (source TEXT PRIMARY KEY, ts REAL NOT NULL)"
+        )
+        self.clock = BucketClock()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def position(self, source):
+        """source を読み終えた位置 (世代, オフセット)。まだ取り込んでいなければ None"""
+        row = self.conn.execute("SELECT generation, offset FROM positions WHERE source = ?",
+                                (source,)).fetchone()
+        return tuple(row) if row else None
+
+    def _legacy_cursor(self, source):
+        row = self.conn.execute("SELECT ts FROM cursors WHERE source = ?", (source,)).fetchone()
+        return row[0] if row else None
+
+    def _aggregate(self, entries):
+        """エントリをメモリ上で (resolution, target, field, bucket) ごとに集計"""
+        groups = {}
+        for ts, entry in entries:
+            target = entry.get('target') or ''
+            starts = [(resolution, self.clock.start(resolution, ts)) for resolution, _ in RESOLUTIONS]
+            for column in COLUMNS:
+                value = entry.get(column)
+                if value is None:
+                    continue
+                value = float(value)
+                bin_key = _bin_key(value)
+                for resolution, bucket in starts:
+                    key = (resolution, target, column, bucket)
+                    rollup = groups.get(key)
+                    if rollup is None:
+                        rollup = groups[key] = Rollup()
+                    rollup.add(value, bin_key)
+        return groups
+
+    @staticmethod
+    def _timed(entries):
+        timed = []
+        for entry in entries:
+            try:
+                timed.append((_entry_ts(entry), entry))
+            except (KeyError, TypeError, ValueError):
+                continue
+        return timed
+
+    def add_entries(self, entries):
+        """エントリを集計に併合し、取り込んだ件数を返す（位置は記録しない）"""
+        timed = self._timed(entries)
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            if timed:
+                self._merge(self._aggregate(timed))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return len(timed)
+
+    def _merge(self, groups):
+        # 既存の集計は系列ごとに今回の最も古い区間以降だけを範囲検索で読む
+        lowest = {}
+        for resolution, target, field, bucket in groups:
+            series = (resolution, target, field)
+            if series not in lowest or bucket < lowest[series]:
+                lowest[series] = bucket
+        for series, bucket in lowest.items():
+            existing = self.conn.execute(
+                "SELECT bucket, count, total, min, max, bins FROM rollups"
+                " WHERE resolution = ? AND target = ? AND field = ? AND bucket >= ?",
+                series + (bucket,)).fetchall()
+            for bucket, count, total, low, high, bins in existing:
+                key = series + (bucket,)
+                rollup = groups.get(key)
+                if rollup is None:
+                    continue
+                merged = Rollup(count, total, low, high, json.loads(bins))
+                merged.merge(rollup)
+                groups[key] = merged
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO rollups"
+            " (resolution, target, field, bucket, count, total, min, max, bins)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [key + (rollup.count, rollup.total, rollup.min, rollup.max,
+                    json.dumps(rollup.bins, separators=(',', ':')))
+             for key, rollup in groups.items()])
+
+    def sync(self, history_path, backups=5):
+        """履歴ストアの前回の位置以降のエントリを取り込み、件数を返す"""
+        source = os.path.abspath(history_path)
+        position = self.position(source)
+        if _is_sqlite_path(history_path):
+            entries, new_position = _sqlite_entries_after(history_path, position)
+        elif _is_binary_path(history_path):
+            from binary_history import entries_after
+            entries, new_position = entries_after(history_path, position)
+        else:
+            entries, new_position = _jsonl_entries_after(history_path, position, backups)
+        timed = self._timed(entries)
+        legacy = self._legacy_cursor(source) if position is None else None
+        if legacy is not None:
+            # 旧版の索引：時刻カーソルまでは取り込み済み（移行の1回だけ時刻で絞る）
+            timed = [item for item in timed if item[0] > legacy]
+        if new_position is None or (new_position == position and legacy is None):
+            return 0
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self.position(source) != position:
+                # 別プロセスが先に取り込んだ（残りは次の sync で読む）
+                self.conn.execute("COMMIT")
+                return 0
+            if timed:
+                self._merge(self._aggregate(timed))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO positions (source, generation, offset) VALUES (?, ?, ?)",
+                (source,) + tuple(new_position))
+            self.conn.execute("DELETE FROM cursors WHERE source = ?", (source,))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return len(timed)
+
+    def _select(self, start, end, resolution, target, column):
+        """[start, end) に始まる区間の (区間の開始時刻, Rollup) を返す"""
+        if resolution not in RESOLUTION_SECONDS:
+            raise ValueError(f"unknown resolution: {resolution}")
+        if isinstance(start, datetime):
+            start = start.timestamp()
+        if isinstance(end, datetime):
+            end = end.timestamp()
+        sql = ("SELECT bucket, count, total, min, max, bins FROM rollups"
+               " WHERE resolution = ? AND field = ? AND bucket >= ? AND bucket < ?")
+        params = (resolution, column,
+                  -math.inf if start is None else start, math.inf if end is None else end)
+        if target is not None:
+            sql += " AND target = ?"
+            params += (target,)
+        for bucket, count, total, low, high, bins in self.conn.execute(sql, params):
+            yield bucket, Rollup(count, total, low, high, json.loads(bins))
+
+    def query(self, start=None, end=None, resolution='hour', target=None, columns=COLUMNS):
+        """[start, end) の区間集計を古い順に返す
+
+        start / end は datetime または UNIX 時間（None は制限なし）。
+        target を省略すると全系列を併合する。各要素は
+        {'timestamp': ISO 文字列, 'download': {'count', 'min', 'max', 'mean', 'p5', 'p95'}, ...}
+        """
+        buckets = {}
+        for column in columns:
+            for bucket, rollup in self._select(start, end, resolution, target, column):
+                slot = buckets.setdefault(bucket, {})
+                if column in slot:
+                    slot[column].merge(rollup)
+                else:
+                    slot[column] = rollup
+        result = []
+        for bucket in sorted(buckets):
+            row = {'timestamp': datetime.fromtimestamp(bucket).isoformat()}
+            for column, rollup in buckets[bucket].items():
+                row[column] = rollup.summary()
+            result.append(row)
+        return result
+
+    def summary(self, start=None, end=None, resolution='hour', target=None, columns=COLUMNS):
+        """[start, end) に始まる区間をすべて併合した集計 {列: {'count', ..., 'p95'} または None}"""
+        result = {}
+        for column in columns:
+            total = Rollup()
+            for _, rollup in self._select(start, end, resolution, target, column):
+                total.merge(rollup)
+            result[column] = total.summary()
+        return result
+
+    def extent(self, start=None, end=None, target=None):
+        """[start, end) に掛かる (件数, 最初の時間の開始時刻, 最後の時間の終了時刻) の概算
+
+        時単位の集計から求め、両端の時間は丸ごと数えるので件数は多めになる。
+        データがなければ (0, None, None)。
+        """
+        step = RESOLUTION_SECONDS['hour']
+        sql = ("SELECT SUM(count), MIN(bucket), MAX(bucket) FROM rollups"
+               " WHERE resolution = 'hour' AND field = 'download' AND bucket > ? AND bucket < ?")
+        params = (-math.inf if start is None else start - step,
+                  math.inf if end is None else end)
+        if target is not None:
+            sql += " AND target = ?"
+            params += (target,)
+        count, first, last = self.conn.execute(sql, params).fetchone()
+        if not count:
+            return 0, None, None
+        return count, first, last + step
+
+    def prune(self, resolution, before):
+        """resolution の集計のうち before（UNIX 時間）より前の区間を削除し、件数を返す"""
+        cur = self.conn.execute(
+            "DELETE FROM rollups WHERE resolution = ? AND bucket < ?", (resolution, before))
+        return cur.rowcount
+
+
+def _read_complete_lines(path, offset):
+    """offset 以降の改行で終わる行を読み、(エントリ, inode, 読み終えた位置) を返す
+
+    書きかけの末尾行は位置を進めずに次回読む。offset がファイルより大きければ
+    （作り直された）先頭から読む。
+    """
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        if offset > st.st_size:
+            offset = 0
+        f.seek(offset)
+        data = f.read(st.st_size - offset)
+    end = data.rfind(b'\n') + 1
+    entries = []
+    for line in data[:end].split(b'\n'):
+        if not line:
+            continue
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return entries, st.st_ino, offset + end
+
+
+def _jsonl_entries_after(path, position, backups=5):
+    """JSON Lines ストア（ローテーション済みを含む）の position 以降のエントリと新しい位置
+
+    position の inode のファイルをローテーション済みの中から探し、その続きと
+    それより新しいファイルの全体を古い順に読む。見つからなければ（初回、または
+    ローテーションで消えた後）残っているファイルを全部読む。
+    path.<backups + 1> はローテーションで押し出されてロールアップへの集約を待つファイルで、
+    集約が終わるまではこれも探す（探さないと位置を見失って全部を読み直し、二重に数える）。
+    """
+    paths = [path] + [f"{path}.{i}" for i in range(1, backups + 2)]
+    existing = []
+    for p in paths:
+        try:
+            existing.append((p, os.stat(p).st_ino))
+        except OSError:
+            break
+    if not existing:
+        return [], position
+    start = len(existing) - 1
+    offset = 0
+    if position is not None:
+        for i, (_, ino) in enumerate(existing):
+            if ino == position[0]:
+                start, offset = i, position[1]
+                break
+    entries = []
+    new_position = position
+    # 古いファイルから順に読む（existing は新しい順）
+    for i in range(start, -1, -1):
+        p = existing[i][0]
+        try:
+            file_entries, ino, end = _read_complete_lines(p, offset if i == start else 0)
+        except OSError:
+            continue
+        entries.extend(file_entries)
+        new_position = (ino, end)
+    return entries, new_position
+
+
+def _sqlite_entries_after(path, position):
+    """SQLite ストアの rowid が position より後のエントリと新しい位置"""
+    if not os.path.exists(path):
+        return [], position
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        last = conn.execute("SELECT MAX(rowid) FROM samples").fetchone()[0] or 0
+        after = position[1] if position is not None else 0
+        if after > last:
+            # 全件削除の後に rowid が振り直された
+            after = 0
+        rows = conn.execute(
+            "SELECT ts, download, upload, target, ping, jitter FROM samples"
+            " WHERE rowid > ? AND rowid <= ? ORDER BY rowid", (after, last)
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return [], position
+    finally:
+        conn.close()
+    return [SqliteHistoryStore._row_to_entry(row) for row in rows], (0, last)
+
+
+def open_rollup_index(history_path=DEFAULT_HISTORY_FILE, path=None, backups=5):
+    """索引を開き、履歴ストアの追記分を取り込んでから返す"""
+    index = RollupIndex(path or rollup_path(history_path))
+    index.sync(history_path, backups)
+    return index
+
+
+def query(start=None, end=None, resolution='hour', target=None, data_file=DEFAULT_HISTORY_FILE):
+    """履歴ストア data_file に対する期間クエリ（索引は自動で更新される）"""
+    with open_rollup_index(data_file) as index:
+        return index.query(start, end, resolution, target)
+
+
+def compact(data_file=DEFAULT_HISTORY_FILE, keep_days=30, keep_minute_days=None, backups=5):
+    """keep_days より古い生データをロールアップに集約したうえで削除する
+
+    JSON Lines はローテーション済みファイルのうち全件が古いものだけを削除する。
+    keep_minute_days を指定すると、それより古い分単位の集計も削除する（時・日は残る）。
+    (削除した生データ件数またはファイル数, 削除した分単位の集計数) を返す。
+    """
+    cutoff = time.time() - keep_days * 86400
+    with open_rollup_index(data_file, backups=backups) as index:
+        removed = 0
+        if _is_sqlite_path(data_file):
+            conn = sqlite3.connect(data_file)
+            try:
+                removed = conn.execute("DELETE FROM samples WHERE ts < ?", (cutoff,)).rowcount
+                conn.commit()
+                if conn.execute("SELECT MAX(rowid) FROM samples").fetchone()[0] is None:
+                    # 空になると rowid は 1 から振り直されるので、取り込み位置も戻す
+                    index.conn.execute("UPDATE positions SET offset = 0 WHERE source = ?",
+                                       (os.path.abspath(data_file),))
+            finally:
+                conn.close()
+        else:
+            for i in range(1, backups + 1):
+                p = f"{data_file}.{i}"
+                newest = next(_read_lines_reverse(p), None) if os.path.exists(p) else None
+                if newest is None:
+                    continue
+                try:
+                    if _entry_ts(json.loads(newest)) < cutoff:
+                        os.remove(p)
+                        removed += 1
+                except (KeyError, TypeError, ValueError):
+                    continue
+        pruned = 0
+        if keep_minute_days is not None:
+            pruned = index.prune('minute', time.time() - keep_minute_days * 86400)
+        return removed, pruned
+
+
+def _format_stat(summary, stat):
+    if summary is None:
+        return '-'
+    value = summary[stat]
+    return str(value) if stat == 'count' else f"{value:.2f}"
+
+
+def print_report(rows, stat, columns=('download', 'upload', 'ping')):
+    """クエリ結果を表形式で表示"""
+    header = f"{'period':<20}" + ''.join(f"{column:>12}" for column in columns)
+    print(header)
+    print('-' * len(header))
+    for row in rows:
+        print(f"{row['timestamp'][:19].replace('T', ' '):<20}"
+              + ''.join(f"{_format_stat(row.get(column), stat):>12}" for column in columns))
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Query and compact long-term speed history")
+    parser.add_argument('--data-file', default=DEFAULT_HISTORY_FILE,
+                        help=f"history store path, .jsonl, .db or .bin (default: {DEFAULT_HISTORY_FILE})")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    report = commands.add_parser('report', help="print rollups for a time range")
+    report.add_argument('--days', type=float, default=90,
+                        help="how far back to report (default: 90)")
+    report.add_argument('--resolution', choices=RESOLUTION_SECONDS, default='day',
+                        help="bucket size (default: day)")
+    report.add_argument('--stat', choices=STATS, default='p95',
+                        help="statistic to print per bucket (default: p95)")
+    report.add_argument('--target', help="only this target (default: all targets merged)")
+    report.add_argument('--json', action='store_true', help="print all statistics as JSON")
+
+    compact_cmd = commands.add_parser('compact', help="fold old raw samples into rollups and delete them")
+    compact_cmd.add_argument('--keep-days', type=float, default=30,
+                             help="keep raw samples newer than this (default: 30)")
+    compact_cmd.add_argument('--keep-minute-days', type=float,
+                             help="also drop minute rollups older than this (hour/day are kept)")
+
+    commands.add_parser('sync', help="bring the rollup index up to date with the history")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.command == 'report':
+        start = time.perf_counter()
+        with open_rollup_index(args.data_file) as index:
+            synced = time.perf_counter()
+            # 区間は開始時刻で選ぶので、期間の始まりを含む区間も入るよう区切りに切り下げる
+            since = index.clock.start(args.resolution,
+                                      (datetime.now() - timedelta(days=args.days)).timestamp())
+            rows = index.query(since, None, args.resolution, args.target)
+        elapsed = time.perf_counter() - synced
+        if args.json:
+            json.dump(rows, sys.stdout, indent=2)
+            print()
+        else:
+            print(f"{args.stat} per {args.resolution}, last {args.days:g} days")
+            print_report(rows, args.stat)
+        print(f"{len(rows)} buckets (sync {(synced - start) * 1000:.1f} ms, "
+              f"query {elapsed * 1000:.1f} ms)", file=sys.stderr)
+    elif args.command == 'compact':
+        removed, pruned = compact(args.data_file, args.keep_days, args.keep_minute_days)
+        unit = 'rows' if _is_sqlite_path(args.data_file) else 'rotated files'
+        print(f"Removed {removed} raw {unit}, {pruned} minute rollups")
+    else:
+        with RollupIndex(rollup_path(args.data_file)) as index:
+            print(f"Synced {index.sync(args.data_file)} entries")
+
+
+if __name__ == "__main__":
+    main()
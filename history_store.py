@@ -0,0 +1,684 @@
+#!/usr/bin/env python3
+"""測定履歴の保存バックエンド
+
+1件の追記ごとにファイル全体を読み書きしないよう、追記専用の
+JSON Lines ストアと SQLite ストアを提供する。
+固定長レコードのバイナリ形式（.bin）は binary_history.py（numpy が必要なので使うときだけ読み込む）。
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+from instrumentation import span
+
+# 旧形式（JSON配列）の履歴ファイル
+LEGACY_HISTORY_FILE = "speed_history.json"
+DEFAULT_HISTORY_FILE = "speed_history.jsonl"
+
+# 任意項目（複数ターゲット測定の系列名、レイテンシ・ジッター[ms]）
+OPTIONAL_FIELDS = (('target', 'TEXT'), ('ping', 'REAL'), ('jitter', 'REAL'))
+
+
+def entry_matches(entry, target):
+    """target を指定した場合、その系列のエントリだけを残す"""
+    return target is None or entry.get('target') == target
+
+
+class HistoryStore:
+    """履歴ストアの共通インターフェース
+
+    エントリは save_data と同じ形式の dict
+    （'timestamp' は ISO 形式文字列、'download'/'upload' は Mbps）。
+    任意で 'target'（系列名）、'ping'/'jitter'（ms）を持つ。
+    """
+
+    def append(self, entry):
+        """1件追記"""
+        raise NotImplementedError
+
+    def append_many(self, entries):
+        """まとめて追記して永続化し、件数を返す"""
+        count = 0
+        for entry in entries:
+            self.append(entry)
+            count += 1
+        self.flush()
+        return count
+
+    def tail(self, n, target=None):
+        """最新 n 件を古い順に返す（target 指定時はその系列のみ）"""
+        raise NotImplementedError
+
+    def flush(self):
+        """バッファ中のデータを永続化"""
+
+    def close(self):
+        """ストアを閉じる"""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JsonlHistoryStore(HistoryStore):
+    """追記専用の JSON Lines ストア
+
+    - 追記は1行書き込みのみ（O(1)）
+    - fsync は fsync_every 件ごと、または fsync_interval 秒ごとにまとめて実行
+    - max_bytes を超えたら os.replace でアトミックにローテーション
+    - 起動時に書きかけの末尾行（クラッシュ時）を切り詰めて復旧
+    - 最も古いバックアップは削除前にロールアップ（history_query.py）へ集約する。
+      集約はローテーション時に <path>.<backups + 1> へ退避してから別スレッドで行い、追記は待たせない
+    """
+
+    def __init__(self, path=DEFAULT_HISTORY_FILE, fsync_every=10, fsync_interval=30.0,
+                 max_bytes=50 * 1024 * 1024, backups=5, rollups=True):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        # ローテーションで消える古いファイルを history_query のロールアップに集約するか
+        self.rollups = rollups
+        self._pending = 0
+        self._last_fsync = time.monotonic()
+        self._compaction = None
+        self._recover_tail()
+        self._file = open(self.path, 'ab')
+        # 前回の集約が終わる前に止まった場合は、退避されたままのファイルを集約する
+        if self.rollups and os.path.exists(self.compaction_path()):
+            self._start_compaction()
+
+    def _recover_tail(self):
+        """改行で終わっていない末尾（書きかけの行）を切り詰める"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return
+            # 最後の改行位置を後ろから探す
+            pos = size
+            block = 4096
+            while pos > 0:
+                start = max(0, pos - block)
+                f.seek(start)
+                chunk = f.read(pos - start)
+                idx = chunk.rfind(b'\n')
+                if idx >= 0:
+                    f.truncate(start + idx + 1)
+                    return
+                pos = start
+            f.truncate(0)
+
+    def append(self, entry):
+        with span('serialize'):
+            line = json.dumps(entry, separators=(',', ':')).encode('utf-8') + b'\n'
+        self._file.write(line)
+        # 別プロセスから tail できるよう OS バッファまでは毎回書き出す
+        self._file.flush()
+        self._pending += 1
+        if (self._pending >= self.fsync_every
+                or time.monotonic() - self._last_fsync >= self.fsync_interval):
+            self._fsync()
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            self.rotate()
+
+    def _fsync(self):
+        with span('fsync'):
+            os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_fsync = time.monotonic()
+
+    def flush(self):
+        if self._file.closed:
+            return
+        self._file.flush()
+        if self._pending:
+            self._fsync()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+        self._wait_compaction()
+
+    def compaction_path(self):
+        """ローテーションで押し出され、ロールアップへの集約を待つファイル"""
+        return f"{self.path}.{self.backups + 1}"
+
+    def _compact_into_rollups(self):
+        """退避したファイルの未集計分をロールアップへ取り込んでから削除する（集約スレッド）"""
+        from history_query import RollupIndex, rollup_path
+        try:
+            # sync は退避先のファイルも読み取り位置の検索対象に含める
+            with RollupIndex(rollup_path(self.path)) as index:
+                index.sync(self.path, self.backups)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Rollup compaction failed: {e}")
+        try:
+            os.remove(self.compaction_path())
+        except FileNotFoundError:
+            pass
+
+    def _start_compaction(self):
+        self._compaction = threading.Thread(target=self._compact_into_rollups,
+                                            name='rollup-compaction', daemon=True)
+        self._compaction.start()
+
+    def _wait_compaction(self):
+        if self._compaction is not None:
+            self._compaction.join()
+            self._compaction = None
+
+    def rotated_paths(self):
+        """ローテーション済みファイル（新しい順）"""
+        return [f"{self.path}.{i}" for i in range(1, self.backups + 1)]
+
+    def rotate(self):
+        """現在のファイルを .1 に退避し、新しいファイルを開く"""
+        self.flush()
+        self._file.close()
+        paths = self.rotated_paths()
+        if os.path.exists(paths[-1]):
+            if self.rollups:
+                # 削除する前にロールアップへ集約する（長期の統計は残る）。集約は別スレッドで行うので
+                # 退避先は1つだけ使い、前回の集約が終わっていなければ待つ
+                self._wait_compaction()
+                os.replace(paths[-1], self.compaction_path())
+            else:
+                os.remove(paths[-1])
+        for older, newer in zip(reversed(paths[1:]), reversed(paths[:-1])):
+            if os.path.exists(newer):
+                os.replace(newer, older)
+        os.replace(self.path, paths[0])
+        self._file = open(self.path, 'ab')
+        # ファイルの移動を終えてから集約を始める（sync が移動中のファイルを二重に読まない）
+        if self.rollups and os.path.exists(self.compaction_path()):
+            self._start_compaction()
+
+    def tail(self, n, target=None):
+        self.flush()
+        return _tail_jsonl([self.path] + self.rotated_paths(), n, target=target)
+
+
+def _read_lines_reverse(path, end=None, block=64 * 1024):
+    """ファイル末尾（または end）から1行ずつ逆順に返す（全体は読まない）"""
+    with open(path, 'rb') as f:
+        if end is None:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+        pos = end
+        remainder = b''
+        while pos > 0:
+            start = max(0, pos - block)
+            f.seek(start)
+            chunk = f.read(pos - start) + remainder
+            pos = start
+            lines = chunk.split(b'\n')
+            # 先頭は途中から始まる可能性があるので次のブロックに回す
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line
+        if remainder:
+            yield remainder
+
+
+def _tail_jsonl(paths, n, end=None, target=None):
+    """paths（新しい順）から最新 n 件を古い順に返す（end は先頭ファイルの読み取り上限）"""
+    if n <= 0:
+        return []
+    entries = []
+    for i, path in enumerate(paths):
+        if not os.path.exists(path):
+            break
+        for line in _read_lines_reverse(path, end if i == 0 else None):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry_matches(entry, target):
+                entries.append(entry)
+            if len(entries) >= n:
+                break
+        if len(entries) >= n:
+            break
+    entries.reverse()
+    return entries
+
+
+class JsonlHistoryReader:
+    """別プロセスから JSON Lines ストアを追跡する読み取り専用リーダー
+
+    書き込み中の末尾行は読まず、ローテーション（inode の変化）にも追従する。
+    poll() の間に複数回ローテーションしても、残っている世代から順に読み直す。
+    """
+
+    def __init__(self, path=DEFAULT_HISTORY_FILE, backups=5):
+        self.path = path
+        self.backups = backups
+        self._pos = 0
+        self._ino = None
+
+    def _complete_end(self, f, size):
+        """size 以下で最後の改行の直後の位置"""
+        start = max(0, size - 64 * 1024)
+        f.seek(start)
+        idx = f.read(size - start).rfind(b'\n')
+        return start + idx + 1 if idx >= 0 else 0
+
+    def tail(self, n, target=None):
+        """最新 n 件を返し、以降の poll() はその続きから読む"""
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            end = self._complete_end(f, st.st_size)
+        self._pos, self._ino = end, st.st_ino
+        paths = [self.path] + [f"{self.path}.{i}" for i in range(1, self.backups + 1)]
+        return _tail_jsonl(paths, n, end, target)
+
+    def _read_from(self, path, pos):
+        """pos 以降の完結した行を読み、(エントリ, 新しい位置) を返す"""
+        with open(path, 'rb') as f:
+            f.seek(pos)
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        entries = []
+        for line in data[:end].split(b'\n'):
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+        return entries, pos + end
+
+    def poll(self):
+        """前回以降に追記されたエントリを返す"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return []
+        entries = []
+        if self._ino is not None and st.st_ino != self._ino:
+            entries = self._read_rotated()
+            self._pos = 0
+        elif st.st_size < self._pos:
+            self._pos = 0
+        self._ino = st.st_ino
+        if st.st_size > self._pos:
+            new_entries, self._pos = self._read_from(self.path, self._pos)
+            entries.extend(new_entries)
+        return entries
+
+    def _read_rotated(self):
+        """ローテーション済みの世代から、前回の続きと間の世代を古い順に読む
+
+        前回読んでいたファイルを inode で探し（集約待ちの枠 .<backups+1> も含む）、
+        その残りと、それより新しい世代を全部読む。見つからなければ警告して飛ばす。
+        """
+        generations = []
+        for i in range(1, self.backups + 2):
+            path = f"{self.path}.{i}"
+            try:
+                ino = os.stat(path).st_ino
+            except OSError:
+                continue
+            generations.append(path)
+            if ino == self._ino:
+                break
+        else:
+            print(f"Warning: {self.path} rotated out of reach since the last poll;"
+                  " some entries were skipped")
+            return []
+        entries, _ = self._read_from(generations[-1], self._pos)
+        for path in reversed(generations[:-1]):
+            try:
+                entries.extend(self._read_from(path, 0)[0])
+            except OSError:
+                continue
+        return entries
+
+    def close(self):
+        pass
+
+
+SQLITE_COLUMNS = "ts, download, upload, " + ", ".join(name for name, _ in OPTIONAL_FIELDS)
+
+
+class SqliteHistoryStore(HistoryStore):
+    """タイムスタンプにインデックスを張った SQLite ストア
+
+    コミットは commit_every 件ごと、または commit_interval 秒ごとにまとめる。
+    接続はスレッド間で共有する（集約サービスの書き込みスレッドと HTTP ハンドラー）ので、
+    使うときは必ず _lock を取る。
+    """
+
+    def __init__(self, path="speed_history.db", commit_every=10, commit_interval=30.0):
+        self.path = path
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS samples ("
+            " ts REAL NOT NULL,"
+            " download REAL NOT NULL,"
+            " upload REAL NOT NULL)"
+        )
+        # 旧スキーマには任意項目の列を追加
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(samples)")}
+        for name, sql_type in OPTIONAL_FIELDS:
+            if name not in existing:
+                self.conn.execute(f"ALTER TABLE samples ADD COLUMN {name} {sql_type}")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_samples_ts ON samples(ts)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_samples_target_ts ON samples(target, ts)")
+        self.conn.commit()
+
+    def append(self, entry):
+        ts = datetime.fromisoformat(entry['timestamp']).timestamp()
+        with self._lock:
+            self.conn.execute(
+                f"INSERT INTO samples ({SQLITE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                (ts, entry['download'], entry['upload'],
+                 entry.get('target'), entry.get('ping'), entry.get('jitter'))
+            )
+            self._pending += 1
+            if (self._pending >= self.commit_every
+                    or time.monotonic() - self._last_commit >= self.commit_interval):
+                self.flush()
+
+    def append_many(self, entries):
+        """まとめて1つのトランザクションで追記し、件数を返す
+
+        失敗したときはロールバックするので、同じエントリをそのまま送り直せる（二重に入らない）。
+        """
+        rows = [(datetime.fromisoformat(entry['timestamp']).timestamp(),
+                 entry['download'], entry['upload'],
+                 entry.get('target'), entry.get('ping'), entry.get('jitter'))
+                for entry in entries]
+        with self._lock:
+            # それまでの append の分を先に確定し、失敗時のロールバックに巻き込まない
+            self.flush()
+            try:
+                self.conn.executemany(
+                    f"INSERT INTO samples ({SQLITE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)", rows)
+                self._pending += len(rows)
+                self.flush()
+            except sqlite3.Error:
+                self.conn.rollback()
+                self._pending = 0
+                raise
+        return len(rows)
+
+    def flush(self):
+        with self._lock:
+            if self._pending:
+                with span('commit'):
+                    self.conn.commit()
+                self._pending = 0
+            self._last_commit = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self.conn.close()
+
+    @staticmethod
+    def _row_to_entry(row):
+        ts, download, upload = row[:3]
+        entry = {
+            'timestamp': datetime.fromtimestamp(ts).isoformat(),
+            'download': download,
+            'upload': upload
+        }
+        for (name, _), value in zip(OPTIONAL_FIELDS, row[3:]):
+            if value is not None:
+                entry[name] = value
+        return entry
+
+    def tail(self, n, target=None):
+        if n <= 0:
+            return []
+        with self._lock:
+            if target is None:
+                rows = self.conn.execute(
+                    f"SELECT {SQLITE_COLUMNS} FROM samples ORDER BY ts DESC LIMIT ?", (n,)
+                ).fetchall()
+            else:
+                rows = self.conn.execute(
+                    f"SELECT {SQLITE_COLUMNS} FROM samples WHERE target = ? ORDER BY ts DESC LIMIT ?",
+                    (target, n)
+                ).fetchall()
+        return [self._row_to_entry(row) for row in reversed(rows)]
+
+
+class SqliteHistoryReader:
+    """別プロセスから SQLite ストアを追跡する読み取り専用リーダー"""
+
+    def __init__(self, path="speed_history.db"):
+        self.path = path
+        # 収集側より先に起動した場合や旧スキーマの場合に備えてスキーマを整える
+        SqliteHistoryStore(path).close()
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._last_rowid = 0
+
+    def tail(self, n, target=None):
+        if n <= 0:
+            return []
+        self._last_rowid = self.conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM samples").fetchone()[0]
+        if target is None:
+            rows = self.conn.execute(
+                f"SELECT rowid, {SQLITE_COLUMNS} FROM samples WHERE rowid <= ?"
+                " ORDER BY rowid DESC LIMIT ?", (self._last_rowid, n)
+            ).fetchall()
+        else:
+            rows = self.conn.execute(
+                f"SELECT rowid, {SQLITE_COLUMNS} FROM samples WHERE rowid <= ? AND target = ?"
+                " ORDER BY rowid DESC LIMIT ?", (self._last_rowid, target, n)
+            ).fetchall()
+        return [SqliteHistoryStore._row_to_entry(row[1:]) for row in reversed(rows)]
+
+    def poll(self):
+        rows = self.conn.execute(
+            f"SELECT rowid, {SQLITE_COLUMNS} FROM samples WHERE rowid > ? ORDER BY rowid",
+            (self._last_rowid,)
+        ).fetchall()
+        if rows:
+            self._last_rowid = rows[-1][0]
+        return [SqliteHistoryStore._row_to_entry(row[1:]) for row in rows]
+
+    def close(self):
+        self.conn.close()
+
+
+def _is_sqlite_path(path):
+    return os.path.splitext(path)[1] in ('.db', '.sqlite', '.sqlite3')
+
+
+def _is_binary_path(path):
+    return os.path.splitext(path)[1] == '.bin'
+
+
+def is_remote_path(path):
+    """集約サービス（aggregator.py）の URL か"""
+    return path.startswith(('http://', 'https://'))
+
+
+def open_history_reader(path=DEFAULT_HISTORY_FILE):
+    """拡張子に応じた読み取り専用リーダーを開く（URL は集約サービスのクライアント）"""
+    if is_remote_path(path):
+        from aggregator import AggregatorClient
+        return AggregatorClient(path)
+    if _is_sqlite_path(path):
+        return SqliteHistoryReader(path)
+    if _is_binary_path(path):
+        from binary_history import BinaryHistoryReader
+        return BinaryHistoryReader(path)
+    return JsonlHistoryReader(path)
+
+
+def open_history_store(path=DEFAULT_HISTORY_FILE, **kwargs):
+    """拡張子に応じてストアを開く（.db/.sqlite/.sqlite3 は SQLite、.bin は固定長バイナリ、
+    それ以外は JSON Lines）"""
+    if _is_sqlite_path(path):
+        return SqliteHistoryStore(path, **kwargs)
+    if _is_binary_path(path):
+        from binary_history import BinaryHistoryStore
+        return BinaryHistoryStore(path, **kwargs)
+    return JsonlHistoryStore(path, **kwargs)
+
+
+def list_targets(path=DEFAULT_HISTORY_FILE):
+    """履歴に含まれる系列名（target）の一覧（名前順、target のないエントリは数えない）"""
+    if not os.path.exists(path):
+        return []
+    if _is_sqlite_path(path):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute("SELECT DISTINCT target FROM samples WHERE target IS NOT NULL"
+                                " ORDER BY target").fetchall()
+        except sqlite3.OperationalError:
+            return []
+        finally:
+            conn.close()
+        return [row[0] for row in rows]
+    if _is_binary_path(path):
+        from binary_history import read_header
+        return sorted(read_header(path)[1])
+    return _jsonl_targets(path)
+
+
+# (パス -> {inode: (走査済みの位置, 系列名の集合)})
+_TARGET_SCANS = {}
+
+
+def _jsonl_targets(path, backups=5):
+    """JSON Lines の系列名を、前回の呼び出し以降に追記された分だけ読んで返す
+
+    走査位置は inode ごとに覚えるので、ローテーションで名前が変わっても読み直さない。
+    target を含まない行は JSON として解析しない。
+    """
+    previous = _TARGET_SCANS.get(path, {})
+    scans = {}
+    for p in [path] + [f"{path}.{i}" for i in range(1, backups + 1)]:
+        try:
+            f = open(p, 'rb')
+        except OSError:
+            break
+        with f:
+            st = os.fstat(f.fileno())
+            pos, targets = previous.get(st.st_ino, (0, set()))
+            if pos > st.st_size:
+                pos, targets = 0, set()
+            f.seek(pos)
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        targets = set(targets)
+        for line in data[:end].split(b'\n'):
+            if b'"target"' not in line:
+                continue
+            try:
+                target = json.loads(line).get('target')
+            except (AttributeError, ValueError):
+                continue
+            if target:
+                targets.add(target)
+        scans[st.st_ino] = (pos + end, targets)
+    _TARGET_SCANS[path] = scans
+    return sorted(set().union(*(targets for _, targets in scans.values())))
+
+
+def read_history_range(path=DEFAULT_HISTORY_FILE, start=None, end=None, target=None, backups=5):
+    """[start, end)（epoch 秒、None は制限なし）のエントリを古い順に返す
+
+    JSON Lines はローテーション済みを含めて全行を読む。集約サービスのまとめ書きや
+    複数系列の書き込みでは行の順序が時刻順とは限らないので、start より古い行があっても
+    打ち切らない。
+    """
+    if _is_sqlite_path(path):
+        if not os.path.exists(path):
+            return []
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            sql = f"SELECT {SQLITE_COLUMNS} FROM samples WHERE ts >= ? AND ts < ?"
+            params = (float('-inf') if start is None else start,
+                      float('inf') if end is None else end)
+            if target is not None:
+                sql += " AND target = ?"
+                params += (target,)
+            rows = conn.execute(sql + " ORDER BY ts", params).fetchall()
+        except sqlite3.OperationalError:
+            return []
+        finally:
+            conn.close()
+        return [SqliteHistoryStore._row_to_entry(row) for row in rows]
+    if _is_binary_path(path):
+        from binary_history import read_range
+        return read_range(path, start, end, target)
+
+    paths = []
+    for p in [path] + [f"{path}.{i}" for i in range(1, backups + 1)]:
+        if not os.path.exists(p):
+            break
+        paths.append(p)
+    rows = []
+    # 古いファイルから順に読む
+    for p in reversed(paths):
+        with open(p, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    ts = datetime.fromisoformat(entry['timestamp']).timestamp()
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if ((start is None or ts >= start) and (end is None or ts < end)
+                        and entry_matches(entry, target)):
+                    rows.append((ts, entry))
+    rows.sort(key=lambda row: row[0])
+    return [entry for _, entry in rows]
+
+
+def migrate_json_history(src, store):
+    """旧形式の speed_history.json（JSON配列）をストアへ移行し、移行件数を返す"""
+    with open(src, 'r') as f:
+        data = json.load(f)
+    count = 0
+    for entry in data:
+        try:
+            store.append({
+                'timestamp': entry['timestamp'],
+                'download': float(entry['download']),
+                'upload': float(entry['upload'])
+            })
+        except (KeyError, TypeError, ValueError):
+            continue
+        count += 1
+    store.flush()
+    return count
+
+
+if __name__ == "__main__":
+    # 使い方: python history_store.py [speed_history.json] [speed_history.jsonl|.db|.bin]
+    src = sys.argv[1] if len(sys.argv) > 1 else LEGACY_HISTORY_FILE
+    dst = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_HISTORY_FILE
+    with open_history_store(dst) as store:
+        migrated = migrate_json_history(src, store)
+    print(f"Migrated {migrated} entries: {src} -> {dst}")
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""内部計測（スパンタイマー）とプロファイリング
+
+測定の各段階（get_best_server / download / upload / save_data / update_graph など）を
+with span('名前'): で囲み、所要時間をリングバッファに記録する。
+無効時（既定）の span() は共有の何もしないコンテキストを返すだけなので、
+計測コードを入れたままでもほとんどコストがかからない。
+
+- --instrument で記録を有効化し、SIGUSR1 または終了時に集計を stderr へ出力
+- --spans-out FILE でスパンを畳み込みスタック形式（flamegraph.pl / speedscope / py-spy の
+  raw 出力と同じ形式）でも書き出す
+- --profile FILE で実行全体を cProfile にかけ、pstats 形式で保存
+"""
+import collections
+import os
+import signal
+import sys
+import threading
+import time
+
+DEFAULT_CAPACITY = 4096
+
+
+class _NullSpan:
+    """無効時に返す何もしないコンテキスト"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('recorder', 'name', 'start', 'path')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        # 入れ子のスパンは呼び出し元の名前をつなげたパスで記録する（スレッドごと）
+        stack = self.recorder._stack()
+        stack.append(self.name)
+        self.path = tuple(stack)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        self.recorder._stack().pop()
+        self.recorder.record(self.path, self.start, duration, exc_type is not None)
+        return False
+
+
+class SpanRecorder:
+    """スパンを固定容量のリングバッファに記録し、名前ごとの累計も持つ
+
+    リングバッファには (パス, 開始時刻, 所要秒, スレッド名, 例外の有無) を直近 capacity 件、
+    累計には名前ごとの [回数, 合計秒, 最大秒, 例外回数] を全期間分保持する。
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.enabled = False
+        self._spans = collections.deque(maxlen=capacity)
+        self._totals = {}
+        # SIGUSR1 のハンドラは記録中のメインスレッドに割り込むので再入可能なロックにする
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    @property
+    def capacity(self):
+        return self._spans.maxlen
+
+    def enable(self, capacity=None):
+        if capacity is not None and capacity != self.capacity:
+            with self._lock:
+                self._spans = collections.deque(self._spans, maxlen=capacity)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._totals.clear()
+
+    def span(self, name):
+        """with で囲んだ区間を name として記録する（無効時は NULL_SPAN）"""
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name)
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def record(self, path, start, duration, error=False):
+        name = path[-1]
+        with self._lock:
+            self._spans.append((path, start, duration, threading.current_thread().name, error))
+            totals = self._totals.get(name)
+            if totals is None:
+                totals = self._totals[name] = [0, 0.0, 0.0, 0]
+            totals[0] += 1
+            totals[1] += duration
+            if duration > totals[2]:
+                totals[2] = duration
+            if error:
+                totals[3] += 1
+
+    def spans(self):
+        """リングバッファの内容（古い順）のコピー"""
+        with self._lock:
+            return list(self._spans)
+
+    def summary(self):
+        """名前ごとの集計（合計時間の降順）
+
+        count / total / mean / max / errors は全期間、last / p50 / p95 はリングバッファ内の値。
+        """
+        with self._lock:
+            spans = list(self._spans)
+            totals = {name: list(values) for name, values in self._totals.items()}
+        recent = collections.defaultdict(list)
+        for path, _, duration, _, _ in spans:
+            recent[path[-1]].append(duration)
+        rows = []
+        for name, (count, total, maximum, errors) in totals.items():
+            durations = sorted(recent.get(name, ()))
+            rows.append({
+                'name': name,
+                'count': count,
+                'total': total,
+                'mean': total / count,
+                'max': maximum,
+                'errors': errors,
+                'last': recent[name][-1] if durations else None,
+                'p50': _percentile(durations, 50),
+                'p95': _percentile(durations, 95),
+            })
+        rows.sort(key=lambda row: row['total'], reverse=True)
+        return rows
+
+    def format_summary(self, limit=None, compact=False):
+        """集計を表形式の文字列にする（compact はグラフ上のパネル用の短い形式）"""
+        rows = self.summary()[:limit]
+        if not rows:
+            return "no spans recorded" if not compact else "[PROF] no spans"
+        if compact:
+            lines = ["[PROF]          n   mean    p95"]
+            lines += [f"{row['name'][:14]:<14} {row['count']:>4} {_ms(row['mean']):>6} "
+                      f"{_ms(row['p95']):>6}" for row in rows]
+            return '\n'.join(lines)
+        lines = [f"{'span':<24} {'count':>7} {'total s':>9} {'mean ms':>9} {'p50 ms':>9} "
+                 f"{'p95 ms':>9} {'max ms':>9} {'err':>5}"]
+        for row in rows:
+            lines.append(f"{row['name']:<24} {row['count']:>7} {row['total']:>9.3f} "
+                         f"{_ms(row['mean']):>9} {_ms(row['p50']):>9} {_ms(row['p95']):>9} "
+                         f"{_ms(row['max']):>9} {row['errors']:>5}")
+        return '\n'.join(lines)
+
+    def folded_stacks(self):
+        """リングバッファのスパンを畳み込みスタック形式（'スレッド;a;b 自己時間[µs]'）にする"""
+        self_time = collections.Counter()
+        for path, _, duration, thread, _ in self.spans():
+            key = (thread,) + path
+            self_time[key] += duration
+            if len(path) > 1:
+                # 子スパンの時間は親の自己時間から引く
+                self_time[key[:-1]] -= duration
+        lines = []
+        for key, seconds in sorted(self_time.items()):
+            micros = int(round(seconds * 1_000_000))
+            if micros > 0:
+                lines.append(f"{';'.join(key)} {micros}")
+        return lines
+
+    def write_folded(self, path):
+        """畳み込みスタックを path へ書き出す（一時ファイル経由で置き換え）"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for line in self.folded_stacks():
+                f.write(line + '\n')
+        os.replace(tmp_path, path)
+
+    def dump(self, stream=None, folded_path=None):
+        """集計を stream（既定 stderr）へ、指定があれば畳み込みスタックをファイルへ出力"""
+        stream = stream if stream is not None else sys.stderr
+        stream.write(f"--- spans (last {len(self._spans)} of capacity {self.capacity}) ---\n")
+        stream.write(self.format_summary() + '\n')
+        stream.flush()
+        if folded_path:
+            try:
+                self.write_folded(folded_path)
+            except OSError as e:
+                print(f"Span dump error: {e}")
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * q / 100))
+    return sorted_values[index]
+
+
+def _ms(seconds):
+    return '-' if seconds is None else f"{seconds * 1000:.1f}"
+
+
+# プロセス全体で共有するレコーダー
+recorder = SpanRecorder()
+
+
+def span(name):
+    """共有レコーダーのスパン（無効時は NULL_SPAN を返すだけ）"""
+    if not recorder.enabled:
+        return NULL_SPAN
+    return _Span(recorder, name)
+
+
+def install_dump_signal(folded_path=None, signum=None):
+    """SIGUSR1 を受けたら集計を stderr へ出力する（SIGUSR1 のない環境では何もしない）"""
+    if signum is None:
+        signum = getattr(signal, 'SIGUSR1', None)
+    if signum is None:
+        return False
+
+    def handle(signum, frame):
+        recorder.dump(folded_path=folded_path)
+
+    try:
+        signal.signal(signum, handle)
+    except ValueError:
+        # メインスレッド以外からは登録できない
+        return False
+    return True
+
+
+def profile_call(path, func, *args, **kwargs):
+    """func を cProfile 下で実行し、pstats 形式で path へ保存する"""
+    # プロファイルするときだけ読み込む
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(path)
+        print(f"Profile written to {path} (python -m pstats {path})")
+
+
+def add_instrument_arguments(parser):
+    """内部計測・プロファイリングのコマンドライン引数を追加"""
+    group = parser.add_argument_group('instrumentation')
+    group.add_argument('--instrument', action='store_true',
+                       help="record span timings; dump them on SIGUSR1 and at exit")
+    group.add_argument('--spans-out', metavar='FILE',
+                       help="also write spans as folded stacks (flamegraph/speedscope) to FILE "
+                            "on each dump; implies --instrument")
+    group.add_argument('--spans-capacity', type=int, default=DEFAULT_CAPACITY,
+                       help=f"spans kept in the ring buffer (default: {DEFAULT_CAPACITY})")
+    group.add_argument('--profile', metavar='FILE',
+                       help="run under cProfile and write pstats output to FILE")
+    return group
+
+
+def run_instrumented(args, func, *func_args):
+    """引数に従って計測を有効化し、func を（必要なら cProfile 下で）実行する"""
+    instrument = getattr(args, 'instrument', False) or getattr(args, 'spans_out', None)
+    if instrument:
+        recorder.enable(args.spans_capacity)
+        install_dump_signal(args.spans_out)
+    try:
+        if getattr(args, 'profile', None):
+            return profile_call(args.profile, func, *func_args)
+        return func(*func_args)
+    finally:
+        if instrument:
+            recorder.dump(folded_path=args.spans_out)
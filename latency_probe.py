@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""高頻度のレイテンシ・ジッター・パケットロス測定
+
+帯域測定は重いので 10 秒ごとの測定では短い劣化を取りこぼす。
+ここでは軽いプローブを 1 秒未満の間隔で送り、batch 秒ごとに1件へまとめて保存する。
+
+- tcp://host:port   TCP 接続の確立時間
+- http://host[:port]/path   同じ接続で HEAD を送ってから応答までの時間（https も可）
+- udp://host:port   UDP エコー（送った内容がそのまま返ってくるまでの時間。返らなければ損失）
+- loopback          内蔵の UDP エコーサーバー（loopback_server.py）を起動して測定
+
+バッチは履歴ファイルと同じ場所の <名前>.latency.jsonl（JsonlHistoryStore）に1行1件で追記する:
+    {"timestamp": "...", "probe": "udp://...", "interval": 0.2, "count": 25, "lost": 1,
+     "min": 0.21, "avg": 0.35, "max": 1.9, "jitter": 0.12, "loss": 0.04,
+     "rtt_us": [210, 350, -1, ...]}
+rtt_us は各プローブの RTT（マイクロ秒の整数、-1 は損失）。
+"""
+import argparse
+import os
+import socket
+import struct
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from history_store import DEFAULT_HISTORY_FILE, JsonlHistoryStore
+from instrumentation import span
+from scheduler import FixedRateScheduler
+
+DEFAULT_INTERVAL = 0.2
+DEFAULT_BATCH = 5.0
+DEFAULT_TIMEOUT = 1.0
+
+
+def latency_path(history_path):
+    """履歴ファイルに対応するレイテンシバッチのファイル名"""
+    base, _ = os.path.splitext(history_path)
+    return base + '.latency.jsonl'
+
+
+class TcpProbe:
+    """TCP 接続の確立時間（ms）"""
+
+    def __init__(self, host, port, timeout=DEFAULT_TIMEOUT):
+        self.address = (host, port)
+        self.timeout = timeout
+
+    def probe(self):
+        start = time.perf_counter()
+        try:
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+        except OSError:
+            return None
+        elapsed = (time.perf_counter() - start) * 1000
+        sock.close()
+        return elapsed
+
+    def close(self):
+        pass
+
+
+class HttpHeadProbe:
+    """HEAD リクエストの応答時間（ms）。接続は使い回し、失敗したら次回つなぎ直す"""
+
+    def __init__(self, url, timeout=DEFAULT_TIMEOUT):
+        import http.client
+        parts = urlsplit(url)
+        connection_class = (http.client.HTTPSConnection if parts.scheme == 'https'
+                            else http.client.HTTPConnection)
+        self._connect = lambda: connection_class(parts.hostname, parts.port, timeout=timeout)
+        # http.client.HTTPException（応答の形式エラーなど）は OSError ではない
+        self._errors = (OSError, http.client.HTTPException)
+        self.timeout = timeout
+        self.path = parts.path or '/'
+        self._conn = None
+
+    def probe(self):
+        if self._conn is None:
+            self._conn = self._connect()
+        start = time.perf_counter()
+        try:
+            self._conn.request('HEAD', self.path)
+            response = self._conn.getresponse()
+            response.read()
+        except self._errors:
+            self.close()
+            return None
+        elapsed = (time.perf_counter() - start) * 1000
+        if response.will_close:
+            self.close()
+        return elapsed
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class UdpEchoProbe:
+    """UDP エコーの往復時間（ms）。timeout 以内に同じ番号の応答がなければ損失"""
+
+    _HEADER = struct.Struct('!Iq')  # 通し番号, 送信時刻[ns]
+
+    def __init__(self, host, port, timeout=DEFAULT_TIMEOUT):
+        self.address = (host, port)
+        self.timeout = timeout
+        self._seq = 0
+        self._sock = None
+
+    def probe(self):
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.connect(self.address)
+        self._seq = (self._seq + 1) & 0xFFFFFFFF
+        start = time.perf_counter()
+        deadline = start + self.timeout
+        try:
+            self._sock.send(self._HEADER.pack(self._seq, time.monotonic_ns()))
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self._sock.settimeout(remaining)
+                data = self._sock.recv(64)
+                # 前のプローブの遅れた応答は読み捨てる
+                if len(data) >= self._HEADER.size and self._HEADER.unpack_from(data)[0] == self._seq:
+                    return (time.perf_counter() - start) * 1000
+        except OSError:
+            # timeout（socket.timeout は OSError）や ICMP port unreachable
+            return None
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+def probe_from_spec(spec, timeout=DEFAULT_TIMEOUT):
+    """"tcp://host:port" / "http(s)://..." / "udp://host:port" からプローブを作る"""
+    parts = urlsplit(spec)
+    if parts.scheme in ('http', 'https'):
+        return HttpHeadProbe(spec, timeout)
+    if parts.scheme in ('tcp', 'udp'):
+        if not parts.hostname or not parts.port:
+            raise ValueError(f"probe target needs host and port: {spec}")
+        probe_class = TcpProbe if parts.scheme == 'tcp' else UdpEchoProbe
+        return probe_class(parts.hostname, parts.port, timeout)
+    raise ValueError(f"unsupported probe target: {spec}")
+
+
+def summarize(rtts):
+    """RTT のリスト（None は損失）から count / lost / min / avg / max / jitter / loss を求める
+
+    ジッターは連続して成功したプローブ同士の RTT 差の絶対値の平均（multi_probe と同じ定義）。
+    """
+    ok = [rtt for rtt in rtts if rtt is not None]
+    summary = {'count': len(rtts), 'lost': len(rtts) - len(ok),
+               'loss': (len(rtts) - len(ok)) / len(rtts) if rtts else 0.0}
+    if ok:
+        diffs = [abs(b - a) for a, b in zip(ok, ok[1:])]
+        summary.update(min=min(ok), avg=sum(ok) / len(ok), max=max(ok),
+                       jitter=sum(diffs) / len(diffs) if diffs else 0.0)
+    return summary
+
+
+def batch_entry(timestamp, probe_spec, interval, rtts):
+    """1バッチ分の保存用エントリ"""
+    entry = {'timestamp': timestamp.isoformat(), 'probe': probe_spec, 'interval': interval}
+    for key, value in summarize(rtts).items():
+        entry[key] = round(value, 3) if isinstance(value, float) else value
+    entry['rtt_us'] = [-1 if rtt is None else int(round(rtt * 1000)) for rtt in rtts]
+    return entry
+
+
+def unpack_rtts(entry):
+    """バッチエントリの rtt_us を ms のリスト（損失は None）に戻す"""
+    return [None if us < 0 else us / 1000 for us in entry.get('rtt_us', ())]
+
+
+class LatencyProber:
+    """interval 秒ごとにプローブし、batch_seconds 秒ごとにバッチを保存・通知する"""
+
+    def __init__(self, probe, probe_spec, store=None, interval=DEFAULT_INTERVAL,
+                 batch_seconds=DEFAULT_BATCH, on_batch=None):
+        self.probe = probe
+        self.probe_spec = probe_spec
+        self.store = store
+        self.interval = interval
+        self.batch_seconds = batch_seconds
+        # バッチごとに呼ばれるコールバック（保存と同じ dict）
+        self.on_batch = on_batch
+        self.stop_event = threading.Event()
+        self._thread = None
+        self._rtts = []
+
+    def add_batch_callback(self, callback):
+        """on_batch にコールバックを追加する（既に設定されているものの後に呼ぶ）"""
+        previous = self.on_batch
+        if previous is None:
+            self.on_batch = callback
+            return
+
+        def chained(entry):
+            previous(entry)
+            callback(entry)
+
+        self.on_batch = chained
+
+    def _flush(self):
+        if not self._rtts:
+            return
+        entry = batch_entry(datetime.now(), self.probe_spec, self.interval, self._rtts)
+        self._rtts = []
+        if self.store is not None:
+            self.store.append(entry)
+        if self.on_batch is not None:
+            self.on_batch(entry)
+
+    def run(self):
+        """停止要求まで測定を続ける（呼び出したスレッドで実行）"""
+        scheduler = FixedRateScheduler(self.interval, stop_event=self.stop_event)
+        batch_end = time.monotonic() + self.batch_seconds
+        try:
+            while True:
+                with span('latency_probe'):
+                    self._rtts.append(self.probe.probe())
+                if time.monotonic() >= batch_end:
+                    self._flush()
+                    batch_end += self.batch_seconds
+                if not scheduler.wait_next():
+                    break
+        finally:
+            self._flush()
+            self.probe.close()
+            if self.store is not None:
+                self.store.flush()
+
+    def start(self):
+        self.stop_event.clear()
+        self._thread = threading.Thread(target=self.run, name='latency-probe', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self.stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(self.probe_timeout + 1.0)
+
+    @property
+    def probe_timeout(self):
+        return getattr(self.probe, 'timeout', DEFAULT_TIMEOUT)
+
+
+def add_probe_arguments(parser):
+    """レイテンシプローブのコマンドライン引数を追加"""
+    group = parser.add_argument_group('latency probe')
+    group.add_argument('--latency-probe', metavar='TARGET',
+                       help="probe latency/jitter/loss continuously: tcp://host:port, "
+                            "http(s)://host/path (HEAD), udp://host:port (echo) or 'loopback'")
+    group.add_argument('--latency-interval', type=float, default=DEFAULT_INTERVAL,
+                       help=f"seconds between probes (default: {DEFAULT_INTERVAL})")
+    group.add_argument('--latency-batch', type=float, default=DEFAULT_BATCH,
+                       help=f"seconds of probes stored per batch (default: {DEFAULT_BATCH:.0f})")
+    group.add_argument('--latency-timeout', type=float, default=DEFAULT_TIMEOUT,
+                       help=f"seconds before a probe counts as lost (default: {DEFAULT_TIMEOUT:.0f})")
+    return group
+
+
+def prober_from_args(args, history_path):
+    """--latency-probe が指定されていれば LatencyProber を作る（開始はしない）"""
+    spec = getattr(args, 'latency_probe', None)
+    if not spec:
+        return None
+    if spec == 'loopback':
+        from loopback_server import start_udp_echo_server
+        server = start_udp_echo_server()
+        host, port = server.server_address[:2]
+        spec = f"udp://{host}:{port}"
+        print(f"Loopback UDP echo server listening on {spec}")
+    try:
+        probe = probe_from_spec(spec, args.latency_timeout)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    store = JsonlHistoryStore(latency_path(history_path), rollups=False)
+    return LatencyProber(probe, spec, store, interval=args.latency_interval,
+                         batch_seconds=args.latency_batch)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Continuous latency / jitter / loss probe")
+    parser.add_argument('--data-file', default=DEFAULT_HISTORY_FILE,
+                        help="history file the batches belong to; they are written to "
+                             f"<name>.latency.jsonl (default: {DEFAULT_HISTORY_FILE})")
+    add_probe_arguments(parser)
+    args = parser.parse_args(argv)
+    if not args.latency_probe:
+        parser.error("--latency-probe is required")
+    prober = prober_from_args(args, args.data_file)
+
+    def report(entry):
+        avg = f"{entry['avg']:.2f} ms" if 'avg' in entry else "-"
+        jitter = f"{entry['jitter']:.2f} ms" if 'jitter' in entry else "-"
+        print(f"{entry['timestamp'][11:19]} - RTT: {avg}, Jitter: {jitter}, "
+              f"Loss: {entry['loss'] * 100:.0f}% ({entry['count']} probes)")
+
+    prober.on_batch = report
+    print(f"Probing {prober.probe_spec} every {prober.interval}s -> {prober.store.path}")
+    try:
+        prober.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        prober.store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""ローカル測定用のテストサーバー
+
+HttpEngine のエンドポイント（/ping, /download, /upload）を実装した
+HTTP サーバー。インターネットなしでループバック上の測定・ベンチマークに使う。
+latency_probe.py の udp:// プローブ用に UDP エコーサーバーも提供する。
+"""
+import argparse
+import os
+import socketserver
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+CHUNK_SIZE = 64 * 1024
+# 圧縮されないようランダムなデータを使い回す
+_PAYLOAD = os.urandom(CHUNK_SIZE)
+
+
+class SpeedTestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # 測定のたびにログを出さない
+        pass
+
+    def _send_text(self, status, text):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path.endswith('/ping'):
+            self._send_text(200, 'pong')
+        elif parts.path.endswith('/download'):
+            try:
+                size = int(parse_qs(parts.query).get('bytes', ['0'])[0])
+            except ValueError:
+                self._send_text(400, 'invalid bytes')
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            remaining = size
+            try:
+                while remaining > 0:
+                    n = min(CHUNK_SIZE, remaining)
+                    self.wfile.write(_PAYLOAD[:n])
+                    remaining -= n
+            except (BrokenPipeError, ConnectionResetError):
+                # クライアントが時間切れで切断した
+                self.close_connection = True
+        else:
+            self._send_text(404, 'not found')
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        if not urlsplit(self.path).path.endswith('/upload'):
+            self._send_text(404, 'not found')
+            return
+        remaining = int(self.headers.get('Content-Length', 0))
+        received = 0
+        try:
+            while remaining > 0:
+                chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                received += len(chunk)
+                remaining -= len(chunk)
+        except (ConnectionResetError, OSError):
+            self.close_connection = True
+            return
+        if remaining > 0:
+            # 本文の途中で切断された
+            self.close_connection = True
+            return
+        self._send_text(200, str(received))
+
+
+class LoopbackServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # レイテンシ測定（接続してすぐ切断）や時間切れによる切断は無視
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_server(host='127.0.0.1', port=0):
+    """バックグラウンドスレッドでサーバーを起動して返す（port=0 は空きポート）"""
+    server = LoopbackServer((host, port), SpeedTestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+class UdpEchoHandler(socketserver.BaseRequestHandler):
+    """受け取ったデータグラムをそのまま送り返す"""
+
+    def handle(self):
+        data, sock = self.request
+        sock.sendto(data, self.client_address)
+
+
+def start_udp_echo_server(host='127.0.0.1', port=0):
+    """バックグラウンドスレッドで UDP エコーサーバーを起動して返す（port=0 は空きポート）"""
+    server = socketserver.UDPServer((host, port), UdpEchoHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local test server for --engine http")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--udp-port', type=int,
+                        help="also serve UDP echo for latency_probe.py udp:// on this port")
+    args = parser.parse_args(argv)
+    server = LoopbackServer((args.host, args.port), SpeedTestHandler)
+    print(f"Serving speed test endpoints on {server.url}")
+    if args.udp_port is not None:
+        echo = start_udp_echo_server(args.host, args.udp_port)
+        print(f"Serving UDP echo on udp://{args.host}:{echo.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""測定エンジン
+
+SpeedCollector.test_speed はエンジンの measure() を呼ぶだけにし、
+測定方法を差し替えられるようにする。
+
+- SpeedtestEngine: speedtest.net（従来の測定）
+- HttpEngine: 自前で用意した HTTP エンドポイント（loopback_server.py 互換）へ
+  並列ストリーム・時間制限付きで転送して測定
+- --isolate を指定すると、どちらも measurement_worker.ProcessEngine で子プロセスに移す
+"""
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+from instrumentation import span
+
+from server_cache import DEFAULT_CACHE_FILE, ServerCache, SpeedtestSession
+
+
+class MeasurementEngine:
+    """測定エンジンの共通インターフェース
+
+    measure() は (download Mbps, upload Mbps, ping ms) を返し、失敗時は例外を送出する。
+    """
+
+    name = 'base'
+
+    def __init__(self, backoff_base=30.0, backoff_max=1800.0):
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failures = 0
+        self.backoff_until = 0.0
+
+    def measure(self):
+        raise NotImplementedError
+
+    def record_success(self):
+        self.failures = 0
+        self.backoff_until = 0.0
+
+    def record_failure(self):
+        """失敗を記録し、次の試行までの待ち時間（秒）を返す"""
+        self.failures += 1
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (self.failures - 1))
+        self.backoff_until = time.monotonic() + delay
+        return delay
+
+    def backoff_remaining(self):
+        return max(0.0, self.backoff_until - time.monotonic())
+
+    def probe_address(self):
+        """軽いレイテンシ測定の接続先 (host, port)。不明なら None"""
+        return None
+
+    def close(self):
+        """測定を終えるときに呼ばれる（子プロセスなどを持つエンジン用）"""
+
+    def probe_latency(self, timeout=2.0):
+        """TCP 接続時間（ms）。接続先が不明・失敗時は None"""
+        address = self.probe_address()
+        if address is None:
+            return None
+        start = time.perf_counter()
+        try:
+            sock = socket.create_connection(address, timeout=timeout)
+        except OSError:
+            return None
+        elapsed = (time.perf_counter() - start) * 1000
+        sock.close()
+        return elapsed
+
+
+class SpeedtestEngine(MeasurementEngine):
+    """speedtest.net で測定（設定・サーバー選択はキャッシュを使う）"""
+
+    name = 'speedtest'
+
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE, session=None):
+        super().__init__()
+        self.session = session if session is not None else SpeedtestSession(ServerCache(cache_file))
+
+    def measure(self):
+        return self.session.measure()
+
+    def record_success(self):
+        pass
+
+    def record_failure(self):
+        return self.session.record_failure()
+
+    def backoff_remaining(self):
+        return self.session.backoff_remaining()
+
+    def probe_address(self):
+        # キャッシュ済みの最速サーバー（'host' は "name:port" 形式）
+        best = self.session.cache.get('best')
+        if not best or ':' not in best.get('host', ''):
+            return None
+        host, _, port = best['host'].rpartition(':')
+        return host, int(port)
+
+
+class HttpEngine(MeasurementEngine):
+    """HTTP エンドポイントへの並列転送で測定
+
+    エンドポイント（base_url 配下）:
+        GET  /ping              レイテンシ測定
+        GET  /download?bytes=N  N バイトを返す
+        POST /upload            本文を読み捨てる
+    各方向とも streams 本の接続で duration 秒だけ転送し、転送量から速度を求める。
+    """
+
+    name = 'http'
+
+    def __init__(self, base_url, streams=4, chunk_size=64 * 1024, duration=5.0,
+                 request_bytes=256 * 1024 * 1024, timeout=10.0, ping_count=3, **kwargs):
+        super().__init__(**kwargs)
+        parts = urlsplit(base_url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f"unsupported URL scheme: {base_url}")
+        self.base_url = base_url
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.streams = streams
+        self.chunk_size = chunk_size
+        self.duration = duration
+        self.request_bytes = request_bytes
+        self.timeout = timeout
+        self.ping_count = ping_count
+        self._payload = b'\0' * chunk_size
+        self._address = (parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+
+    def probe_address(self):
+        return self._address
+
+    def _connect(self):
+        # http.client は読み込みが重いので HTTP で測定するときだけ読み込む
+        import http.client
+        cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        return cls(self.netloc, timeout=self.timeout)
+
+    def ping(self):
+        """同一接続での往復時間の最小値（ms）"""
+        conn = self._connect()
+        try:
+            best = None
+            for _ in range(self.ping_count):
+                start = time.perf_counter()
+                conn.request('GET', f"{self.prefix}/ping")
+                resp = conn.getresponse()
+                resp.read()
+                elapsed = (time.perf_counter() - start) * 1000
+                if resp.status != 200:
+                    raise RuntimeError(f"ping failed: HTTP {resp.status}")
+                best = elapsed if best is None else min(best, elapsed)
+            return best
+        finally:
+            conn.close()
+
+    def _download_stream(self, deadline, counts, index, errors):
+        conn = self._connect()
+        try:
+            while time.monotonic() < deadline:
+                conn.request('GET', f"{self.prefix}/download?bytes={self.request_bytes}")
+                resp = conn.getresponse()
+                if resp.status != 200:
+                    raise RuntimeError(f"download failed: HTTP {resp.status}")
+                while time.monotonic() < deadline:
+                    chunk = resp.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    counts[index] += len(chunk)
+                else:
+                    # 時間切れ：読み残しがあるので接続ごと捨てる
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            conn.close()
+
+    def _upload_stream(self, deadline, counts, index, errors):
+        conn = self._connect()
+        try:
+            while time.monotonic() < deadline:
+                conn.putrequest('POST', f"{self.prefix}/upload")
+                conn.putheader('Content-Type', 'application/octet-stream')
+                conn.putheader('Content-Length', str(self.request_bytes))
+                conn.endheaders()
+                sent = 0
+                while sent < self.request_bytes:
+                    if time.monotonic() >= deadline:
+                        # 時間切れ：本文の途中なので接続ごと捨てる
+                        return
+                    chunk = self._payload[:min(self.chunk_size, self.request_bytes - sent)]
+                    conn.send(chunk)
+                    sent += len(chunk)
+                    counts[index] += len(chunk)
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status != 200:
+                    raise RuntimeError(f"upload failed: HTTP {resp.status}")
+        except Exception as e:
+            errors.append(e)
+        finally:
+            conn.close()
+
+    def _transfer(self, target):
+        """streams 本のスレッドで duration 秒転送し、Mbps を返す"""
+        counts = [0] * self.streams
+        errors = []
+        start = time.monotonic()
+        deadline = start + self.duration
+        threads = [threading.Thread(target=target, args=(deadline, counts, i, errors), daemon=True)
+                   for i in range(self.streams)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(self.duration + self.timeout)
+        elapsed = time.monotonic() - start
+        total = sum(counts)
+        if errors and total == 0:
+            raise errors[0]
+        return total * 8 / elapsed / 1_000_000
+
+    def measure(self):
+        with span('ping'):
+            ping = self.ping()
+        with span('download'):
+            download = self._transfer(self._download_stream)
+        with span('upload'):
+            upload = self._transfer(self._upload_stream)
+        self.record_success()
+        return download, upload, ping
+
+
+def add_engine_arguments(parser):
+    """測定エンジン関連のコマンドライン引数を追加"""
+    group = parser.add_argument_group('measurement engine')
+    group.add_argument('--engine', choices=('speedtest', 'http'), default='speedtest',
+                       help="measurement engine (default: speedtest)")
+    group.add_argument('--url',
+                       help="base URL of the HTTP test endpoint (for --engine http)")
+    group.add_argument('--loopback', action='store_true',
+                       help="start the built-in local test server and measure against it")
+    group.add_argument('--streams', type=int, default=4,
+                       help="parallel streams for --engine http (default: 4)")
+    group.add_argument('--chunk-size', type=int, default=64 * 1024,
+                       help="read/write chunk size in bytes for --engine http (default: 65536)")
+    group.add_argument('--duration', type=float, default=5.0,
+                       help="seconds per direction for --engine http (default: 5)")
+    group.add_argument('--isolate', action='store_true',
+                       help="run measurements in a separate worker process, restarted when it "
+                            "hangs or crashes")
+    group.add_argument('--worker-timeout', type=float, default=180.0,
+                       help="seconds before a hung --isolate worker is killed (default: 180)")
+    return group
+
+
+def engine_from_args(args, cache_file=DEFAULT_CACHE_FILE):
+    """引数からエンジンを作る（--loopback ならローカルサーバーも起動）"""
+    url = args.url
+    if args.loopback:
+        from loopback_server import start_server
+        server = start_server()
+        url = server.url
+        print(f"Loopback test server listening on {url}")
+    if args.engine == 'http' or args.loopback:
+        if not url:
+            raise SystemExit("--engine http requires --url (or use --loopback)")
+        engine_class = HttpEngine
+        kwargs = {'base_url': url, 'streams': args.streams, 'chunk_size': args.chunk_size,
+                  'duration': args.duration}
+    else:
+        engine_class = SpeedtestEngine
+        kwargs = {'cache_file': cache_file}
+    if args.isolate:
+        # multiprocessing は子プロセスで測定するときだけ読み込む
+        from measurement_worker import ProcessEngine
+        return ProcessEngine(engine_class, kwargs, hard_timeout=args.worker_timeout)
+    return engine_class(**kwargs)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""別プロセスで測定するエンジン（--isolate）
+
+speedtest の測定（多数の HTTP スレッドとバッファ処理）を GUI と同じインタプリタで動かすと、
+update_graph と GIL を取り合って速い回線では測定値が下がり、描画も止まる。
+ProcessEngine は測定だけを子プロセス（spawn）で実行し、結果をパイプで受け取る。
+
+- 子プロセスは使い回し、測定ごとに 'measure' を送って (download, upload, ping) を受け取る
+- hard_timeout 秒以内に応答がなければ子プロセスを強制終了し、次の測定で起動し直す
+- 子プロセスが落ちた（パイプが閉じた）場合も同様に起動し直す
+- 失敗はどちらも例外として返すので、SpeedCollector.test_speed の通常の失敗処理
+  （record_failure による指数バックオフ）がそのまま使われる
+"""
+import multiprocessing
+import signal
+
+from instrumentation import recorder
+from measurement_engines import MeasurementEngine
+
+DEFAULT_HARD_TIMEOUT = 180.0
+
+
+class WorkerError(Exception):
+    """子プロセスでの測定失敗"""
+
+
+class WorkerTimeout(WorkerError):
+    """子プロセスが hard_timeout 以内に応答しなかった（強制終了済み）"""
+
+
+class WorkerCrashed(WorkerError):
+    """子プロセスが測定中に終了した"""
+
+
+def _worker_main(conn, engine_class, engine_kwargs, instrument):
+    """子プロセスの本体：エンジンを作り、要求ごとに1回測定して結果を返す"""
+    # Ctrl+C は親がまとめて処理する（子は親に止められるまで待つ）
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if instrument:
+        recorder.enable()
+    engine = engine_class(**engine_kwargs)
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request != 'measure':
+            break
+        try:
+            result = engine.measure()
+            reply = ('ok', result)
+        except Exception as e:
+            # 子側のセッション状態（サーバー選択など）だけリセットし、待ち時間は親が決める
+            engine.record_failure()
+            reply = ('error', f"{type(e).__name__}: {e}")
+        spans = recorder.spans() if instrument else []
+        recorder.reset()
+        conn.send(reply + (engine.probe_address(), spans))
+
+
+class ProcessEngine(MeasurementEngine):
+    """engine_class(**engine_kwargs) を子プロセスで動かすエンジン
+
+    engine_class は子プロセスで import できるクラス（SpeedtestEngine / HttpEngine など）。
+    """
+
+    def __init__(self, engine_class, engine_kwargs=None, hard_timeout=DEFAULT_HARD_TIMEOUT,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.engine_class = engine_class
+        self.engine_kwargs = dict(engine_kwargs or {})
+        self.name = engine_class.name
+        self.hard_timeout = hard_timeout
+        # fork だと matplotlib やスレッドの状態まで複製されるので spawn で起動する
+        self._context = multiprocessing.get_context('spawn')
+        self._process = None
+        self._conn = None
+        self._address = None
+        self.restarts = 0
+
+    def _start(self):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main, name=f"{self.name}-worker", daemon=True,
+            args=(child_conn, self.engine_class, self.engine_kwargs, recorder.enabled))
+        process.start()
+        child_conn.close()
+        self._process, self._conn = process, parent_conn
+
+    def _stop(self):
+        """子プロセスを止める（応答しなければ SIGKILL）"""
+        process, conn = self._process, self._conn
+        self._process = self._conn = None
+        if conn is not None:
+            conn.close()
+        if process is None:
+            return
+        process.terminate()
+        process.join(2.0)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    def _ensure_worker(self):
+        if self._process is not None and self._process.is_alive():
+            return
+        if self._process is not None:
+            print(f"Measurement worker exited (code {self._process.exitcode}), restarting")
+            self._stop()
+            self.restarts += 1
+        self._start()
+
+    def measure(self):
+        self._ensure_worker()
+        try:
+            self._conn.send('measure')
+            if not self._conn.poll(self.hard_timeout):
+                self._stop()
+                self.restarts += 1
+                raise WorkerTimeout(f"no result within {self.hard_timeout:.0f}s, worker killed")
+            status, payload, address, spans = self._conn.recv()
+        except (EOFError, OSError):
+            process = self._process
+            exitcode = None
+            if process is not None:
+                process.join(1.0)
+                exitcode = process.exitcode
+            self._stop()
+            self.restarts += 1
+            raise WorkerCrashed(f"worker exited during measurement (code {exitcode})")
+        if address is not None:
+            self._address = tuple(address)
+        # 子プロセスのスパンは 'worker' の下にまとめて記録する
+        for path, start, duration, _, error in spans:
+            recorder.record(('worker',) + tuple(path), start, duration, error)
+        if status != 'ok':
+            raise WorkerError(payload)
+        self.record_success()
+        return payload
+
+    def probe_address(self):
+        # 子プロセスが最後に報告した接続先（adaptive のレイテンシ測定は親で行う）
+        return self._address
+
+    def close(self):
+        # 測定中でも待たずに止める（測定スレッド側は WorkerCrashed で抜ける）
+        self._stop()
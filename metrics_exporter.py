@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""Prometheus / OpenMetrics エクスポーター
+
+測定結果をメモリ上のメトリクスとして保持し、組み込みの HTTP サーバーで /metrics に公開する。
+スクレイプはメモリ上の値（変更がなければ前回の出力）を返すだけで、
+測定の完了や履歴ファイルの読み込みを待たない。
+
+公開するメトリクス（ラベル target）:
+    netspeed_last_download_mbps / netspeed_last_upload_mbps   直近の測定値
+    netspeed_last_ping_ms / netspeed_jitter_ms                直近のレイテンシ・ジッター
+    netspeed_probe_loss_ratio                                 レイテンシ測定の損失率
+    netspeed_download_mbps / netspeed_upload_mbps             速度のヒストグラム
+    netspeed_test_duration_seconds                            帯域測定の所要時間のヒストグラム
+    netspeed_tests_total / netspeed_test_failures_total       測定回数・失敗回数
+    netspeed_probes_total / netspeed_probe_failures_total     レイテンシ測定の回数・失敗回数
+    netspeed_last_success_timestamp_seconds                   直近の成功時刻（UNIX 時間）
+    netspeed_scheduler_lag_seconds                            予定時刻からの遅れ
+"""
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+DEFAULT_METRICS_HOST = '0.0.0.0'
+SPEED_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+DURATION_BUCKETS = (1, 2.5, 5, 10, 20, 30, 60, 120)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# (名前, 種類, 説明)。counter は OpenMetrics の慣例どおり _total なしのファミリー名
+FAMILIES = (
+    ('netspeed_last_download_mbps', 'gauge', 'Download speed of the latest test in Mbps'),
+    ('netspeed_last_upload_mbps', 'gauge', 'Upload speed of the latest test in Mbps'),
+    ('netspeed_last_ping_ms', 'gauge', 'Latest latency in milliseconds'),
+    ('netspeed_jitter_ms', 'gauge', 'Mean absolute difference of consecutive latencies in milliseconds'),
+    ('netspeed_probe_loss_ratio', 'gauge', 'Share of failed latency probes in the recent window'),
+    ('netspeed_download_mbps', 'histogram', 'Download speed in Mbps'),
+    ('netspeed_upload_mbps', 'histogram', 'Upload speed in Mbps'),
+    ('netspeed_test_duration_seconds', 'histogram', 'Wall time of a bandwidth test in seconds'),
+    ('netspeed_tests', 'counter', 'Bandwidth tests attempted'),
+    ('netspeed_test_failures', 'counter', 'Bandwidth tests that raised an error'),
+    ('netspeed_probes', 'counter', 'Latency probes attempted'),
+    ('netspeed_probe_failures', 'counter', 'Latency probes that failed'),
+    ('netspeed_last_success_timestamp_seconds', 'gauge', 'Unix time of the latest successful test'),
+    ('netspeed_scheduler_lag_seconds', 'gauge', 'Delay of the latest tick behind its scheduled time'),
+)
+
+
+class Histogram:
+    """累積バケット付きのヒストグラム"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最後は +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(le の文字列, 累積件数) を返す
+
+        le は OpenMetrics の正規形（整数の境界も "1.0" のような浮動小数点の表記）。
+        """
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield ('+Inf' if bound == float('inf') else repr(float(bound))), total
+
+
+def _format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def _escape_label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class SpeedMetrics:
+    """スレッドセーフなメトリクスの保持と出力
+
+    更新はロック内で値を書き換えてバージョンを進めるだけ。
+    出力テキストはバージョンが変わったときだけ作り直してキャッシュする。
+    """
+
+    def __init__(self, speed_buckets=SPEED_BUCKETS, duration_buckets=DURATION_BUCKETS):
+        self.speed_buckets = speed_buckets
+        self.duration_buckets = duration_buckets
+        self._lock = threading.Lock()
+        self._version = 0
+        self._cache = {}  # openmetrics(bool) -> (version, bytes)
+        self._values = {name: {} for name, _, _ in FAMILIES}
+
+    def _set(self, name, target, value):
+        self._values[name][target] = value
+
+    def _inc(self, name, target, amount=1):
+        series = self._values[name]
+        series[target] = series.get(target, 0) + amount
+
+    def _observe(self, name, target, value, buckets):
+        series = self._values[name]
+        if target not in series:
+            series[target] = Histogram(buckets)
+        series[target].observe(value)
+
+    def _touch(self):
+        self._version += 1
+
+    def observe_test(self, target, download, upload, ping=None, duration=None):
+        """成功した帯域測定を記録"""
+        with self._lock:
+            self._inc('netspeed_tests', target)
+            self._set('netspeed_last_download_mbps', target, download)
+            self._set('netspeed_last_upload_mbps', target, upload)
+            self._observe('netspeed_download_mbps', target, download, self.speed_buckets)
+            self._observe('netspeed_upload_mbps', target, upload, self.speed_buckets)
+            if ping is not None:
+                self._set('netspeed_last_ping_ms', target, ping)
+            if duration is not None:
+                self._observe('netspeed_test_duration_seconds', target, duration,
+                              self.duration_buckets)
+            self._set('netspeed_last_success_timestamp_seconds', target, time.time())
+            self._touch()
+
+    def observe_failure(self, target, duration=None):
+        """失敗した帯域測定を記録"""
+        with self._lock:
+            self._inc('netspeed_tests', target)
+            self._inc('netspeed_test_failures', target)
+            if duration is not None:
+                self._observe('netspeed_test_duration_seconds', target, duration,
+                              self.duration_buckets)
+            self._touch()
+
+    def observe_probe(self, target, rtt_ms, jitter_ms=None, loss=None):
+        """レイテンシ測定を記録（rtt_ms が None なら失敗）"""
+        with self._lock:
+            self._inc('netspeed_probes', target)
+            if rtt_ms is None:
+                self._inc('netspeed_probe_failures', target)
+            else:
+                self._set('netspeed_last_ping_ms', target, rtt_ms)
+            if jitter_ms is not None:
+                self._set('netspeed_jitter_ms', target, jitter_ms)
+            if loss is not None:
+                self._set('netspeed_probe_loss_ratio', target, loss)
+            self._touch()
+
+    def set_scheduler_lag(self, target, seconds):
+        with self._lock:
+            self._set('netspeed_scheduler_lag_seconds', target, seconds)
+            self._touch()
+
+    def render(self, openmetrics=False):
+        """テキスト形式の出力（bytes）。変更がなければキャッシュを返す"""
+        with self._lock:
+            cached = self._cache.get(openmetrics)
+            if cached is not None and cached[0] == self._version:
+                return cached[1]
+            body = self._render(openmetrics).encode('utf-8')
+            self._cache[openmetrics] = (self._version, body)
+            return body
+
+    def _render(self, openmetrics):
+        lines = []
+        for name, kind, help_text in FAMILIES:
+            series = self._values[name]
+            if not series:
+                continue
+            # Prometheus 形式では counter のファミリー名にも _total を付ける
+            family = name if openmetrics or kind != 'counter' else f"{name}_total"
+            lines.append(f"# HELP {family} {help_text}")
+            lines.append(f"# TYPE {family} {kind}")
+            for target in sorted(series):
+                label = f'target="{_escape_label(target)}"'
+                value = series[target]
+                if kind == 'histogram':
+                    for le, count in value.cumulative():
+                        lines.append(f'{name}_bucket{{{label},le="{le}"}} {count}')
+                    lines.append(f"{name}_sum{{{label}}} {_format_value(value.sum)}")
+                    lines.append(f"{name}_count{{{label}}} {value.count}")
+                elif kind == 'counter':
+                    lines.append(f"{name}_total{{{label}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{name}{{{label}}} {_format_value(value)}")
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # スクレイプのたびにログを出さない
+        pass
+
+    def do_GET(self):
+        if urlsplit(self.path).path not in ('/', '/metrics'):
+            body = b'not found\n'
+            self.send_response(404)
+            self.send_header('Content-Type', 'text/plain')
+        else:
+            openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+            body = self.server.metrics.render(openmetrics)
+            self.send_response(200)
+            self.send_header('Content-Type',
+                             OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, metrics):
+        super().__init__(address, MetricsHandler)
+        self.metrics = metrics
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+
+def start_metrics_server(metrics, port, host=DEFAULT_METRICS_HOST):
+    """バックグラウンドスレッドで /metrics を公開して返す（port=0 は空きポート）"""
+    server = MetricsServer((host, port), metrics)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
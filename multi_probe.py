@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""asyncio による複数ターゲットの同時測定
+
+ISP・VPN・社内 DC など複数のリンクを1プロセスで監視する。
+
+- レイテンシ / ジッター: 全ターゲットに対して TCP 接続時間を高頻度で同時に測定
+- 帯域: 重い測定同士が干渉しないよう、同時実行数をセマフォで制限
+- 結果は 'target' 付きで1つの履歴ストアに保存（ビューアは --target で系列を選ぶ）
+
+ターゲット定義（JSON）の例:
+    [
+      {"name": "isp", "engine": "speedtest", "probe": "1.1.1.1:443"},
+      {"name": "dc1", "engine": "http", "url": "http://10.0.0.5:8765"},
+      {"name": "v6", "engine": "http", "url": "http://[fd00::5]:8765", "probe": "[fd00::5]:22"}
+    ]
+
+speedtest のターゲットはそれぞれ別のキャッシュファイル（<cache>.<name>.json）を使う。
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import signal
+import time
+from collections import deque
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from collector import add_metrics_arguments, metrics_from_args
+from history_store import DEFAULT_HISTORY_FILE, open_history_store
+from instrumentation import add_instrument_arguments, run_instrumented
+from measurement_engines import HttpEngine, SpeedtestEngine
+from server_cache import DEFAULT_CACHE_FILE
+
+
+class ProbeTarget:
+    """測定対象1件分の設定と直近のレイテンシ統計"""
+
+    def __init__(self, name, engine='speedtest', url=None, probe=None,
+                 bandwidth_interval=None, streams=4, duration=5.0, window=20):
+        self.name = name
+        self.engine_kind = engine
+        self.url = url
+        self.bandwidth_interval = bandwidth_interval
+        self.streams = streams
+        self.duration = duration
+        self.probe_address = self._parse_probe(probe, url)
+        self.rtts = deque(maxlen=window)
+        self.attempts = deque(maxlen=window)  # True=成功 / False=失敗
+        self._engine = None
+
+    @staticmethod
+    def _parse_probe(probe, url):
+        """"host:port"（IPv6 は "[::1]:443"）または URL のホスト・ポートをレイテンシ測定先にする"""
+        if probe:
+            parts = urlsplit('//' + probe)
+            if not parts.hostname or not parts.port:
+                raise ValueError(f"probe needs host and port: {probe}")
+            return parts.hostname, parts.port
+        if url:
+            parts = urlsplit(url)
+            return parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80)
+        return None
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def cache_path(self, cache_file=DEFAULT_CACHE_FILE):
+        """このターゲット専用のキャッシュファイル（サーバー選択をターゲット間で共有しない）"""
+        root, ext = os.path.splitext(cache_file)
+        name = re.sub(r'[^\w.-]', '_', self.name)
+        return f"{root}.{name}{ext or '.json'}"
+
+    def engine(self, cache_file=DEFAULT_CACHE_FILE):
+        if self._engine is None:
+            if self.engine_kind == 'http':
+                self._engine = HttpEngine(self.url, streams=self.streams, duration=self.duration)
+            else:
+                self._engine = SpeedtestEngine(self.cache_path(cache_file))
+        return self._engine
+
+    def record_rtt(self, rtt_ms):
+        self.attempts.append(rtt_ms is not None)
+        if rtt_ms is not None:
+            self.rtts.append(rtt_ms)
+
+    def latency_stats(self):
+        """(ping 平均, ジッター, 損失率) を返す。ジッターは連続する RTT 差の絶対値の平均"""
+        if not self.rtts:
+            return None, None, 1.0 if self.attempts else None
+        rtts = list(self.rtts)
+        ping = sum(rtts) / len(rtts)
+        diffs = [abs(b - a) for a, b in zip(rtts, rtts[1:])]
+        jitter = sum(diffs) / len(diffs) if diffs else 0.0
+        loss = self.attempts.count(False) / len(self.attempts)
+        return ping, jitter, loss
+
+
+async def tcp_connect_rtt(host, port, timeout=2.0):
+    """TCP 接続の確立にかかった時間（ms）。失敗時は None"""
+    start = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    elapsed = (time.perf_counter() - start) * 1000
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return elapsed
+
+
+class MultiTargetScheduler:
+    """複数ターゲットのレイテンシ測定と帯域測定を1つのイベントループで回す"""
+
+    def __init__(self, targets, store, probe_interval=1.0, bandwidth_interval=60.0,
+                 max_concurrent_tests=1, cache_file=DEFAULT_CACHE_FILE, metrics=None):
+        self.targets = targets
+        self.store = store
+        self.probe_interval = probe_interval
+        self.bandwidth_interval = bandwidth_interval
+        self.max_concurrent_tests = max_concurrent_tests
+        self.cache_file = cache_file
+        self.metrics = metrics  # metrics_exporter.SpeedMetrics
+        self.stop_event = None
+        self._semaphore = None
+        self._store_lock = None
+
+    async def _sleep(self, seconds):
+        """停止要求があればすぐに戻る。停止なら True"""
+        try:
+            await asyncio.wait_for(self.stop_event.wait(), seconds)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _latency_loop(self, target):
+        host, port = target.probe_address
+        loop = asyncio.get_running_loop()
+        next_probe = loop.time()
+        while not self.stop_event.is_set():
+            if self.metrics is not None:
+                # イベントループが混んでいると予定時刻から遅れる
+                self.metrics.set_scheduler_lag(target.name, max(0.0, loop.time() - next_probe))
+            rtt = await tcp_connect_rtt(host, port)
+            target.record_rtt(rtt)
+            if self.metrics is not None:
+                _, jitter, loss = target.latency_stats()
+                self.metrics.observe_probe(target.name, rtt, jitter, loss)
+            next_probe = loop.time() + self.probe_interval
+            if await self._sleep(self.probe_interval):
+                return
+
+    async def _bandwidth_loop(self, target):
+        engine = target.engine(self.cache_file)
+        interval = target.bandwidth_interval or self.bandwidth_interval
+        while not self.stop_event.is_set():
+            async with self._semaphore:
+                if self.stop_event.is_set():
+                    return
+                start = time.perf_counter()
+                try:
+                    download, upload, engine_ping = await asyncio.to_thread(engine.measure)
+                    wait = interval
+                except Exception as e:
+                    if self.metrics is not None:
+                        self.metrics.observe_failure(target.name, time.perf_counter() - start)
+                    wait = max(interval, engine.record_failure())
+                    print(f"[{target.name}] Speed test error: {e} (retrying in {wait:.0f}s)")
+                else:
+                    if self.metrics is not None:
+                        self.metrics.observe_test(target.name, download, upload, engine_ping,
+                                                  time.perf_counter() - start)
+                    await self._save(target, download, upload, engine_ping)
+            if await self._sleep(wait):
+                return
+
+    async def _save(self, target, download, upload, engine_ping):
+        ping, jitter, loss = target.latency_stats()
+        if ping is None:
+            ping = engine_ping
+        timestamp = datetime.now()
+        entry = {
+            'timestamp': timestamp.isoformat(),
+            'download': download,
+            'upload': upload,
+            'target': target.name,
+        }
+        if ping is not None:
+            entry['ping'] = ping
+        if jitter is not None:
+            entry['jitter'] = jitter
+        # ファイルへの書き込み（fsync を含む）でイベントループを止めない。
+        # 同時に終わった測定の書き込みは1本ずつにする
+        async with self._store_lock:
+            await asyncio.to_thread(self.store.append, entry)
+        loss_text = f", Loss: {loss * 100:.0f}%" if loss is not None else ""
+        ping_text = f", Ping: {ping:.1f} ms" if ping is not None else ""
+        print(f"{timestamp.strftime('%H:%M:%S')} [{target.name}] - Down: {download:.2f} Mbps, "
+              f"Up: {upload:.2f} Mbps{ping_text}{loss_text}")
+
+    def stop(self):
+        if self.stop_event is not None:
+            self.stop_event.set()
+
+    async def run(self):
+        self.stop_event = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self.max_concurrent_tests)
+        self._store_lock = asyncio.Lock()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+        tasks = []
+        for target in self.targets:
+            if target.probe_address is not None:
+                tasks.append(asyncio.create_task(self._latency_loop(target)))
+            tasks.append(asyncio.create_task(self._bandwidth_loop(target)))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            self.store.flush()
+
+
+def load_targets(path):
+    with open(path, 'r') as f:
+        return [ProbeTarget.from_dict(item) for item in json.load(f)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Probe several network targets concurrently")
+    parser.add_argument('--targets', help="JSON file with target definitions")
+    parser.add_argument('--loopback', action='store_true',
+                        help="add two demo targets served by the built-in loopback server")
+    parser.add_argument('--data-file', default=DEFAULT_HISTORY_FILE,
+                        help=f"history store path, .jsonl, .db or .bin (default: {DEFAULT_HISTORY_FILE})")
+    parser.add_argument('--cache-file', default=DEFAULT_CACHE_FILE,
+                        help=f"speedtest server cache path (default: {DEFAULT_CACHE_FILE})")
+    parser.add_argument('--probe-interval', type=float, default=1.0,
+                        help="seconds between latency probes per target (default: 1)")
+    parser.add_argument('--bandwidth-interval', type=float, default=60.0,
+                        help="seconds between bandwidth tests per target (default: 60)")
+    parser.add_argument('--max-concurrent-tests', type=int, default=1,
+                        help="bandwidth tests allowed to run at the same time (default: 1)")
+    add_metrics_arguments(parser)
+    add_instrument_arguments(parser)
+    args = parser.parse_args(argv)
+
+    targets = load_targets(args.targets) if args.targets else []
+    if args.loopback:
+        from loopback_server import start_server
+        for name in ('loopback-a', 'loopback-b'):
+            server = start_server()
+            targets.append(ProbeTarget(name, engine='http', url=server.url, duration=1.0))
+    if not targets:
+        parser.error("no targets: use --targets FILE and/or --loopback")
+
+    print(f"Probing {len(targets)} targets: {', '.join(t.name for t in targets)}")
+    with open_history_store(args.data_file) as store:
+        scheduler = MultiTargetScheduler(
+            targets, store, probe_interval=args.probe_interval,
+            bandwidth_interval=args.bandwidth_interval,
+            max_concurrent_tests=args.max_concurrent_tests, cache_file=args.cache_file,
+            metrics=metrics_from_args(args))
+        run_instrumented(args, asyncio.run, scheduler.run())
+    print("Probe stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""複数拠点（target）を並べて表示するビューア（network_speed_monitor.py --compare）
+
+集約サービスの URL（aggregator.py）または target 付きの履歴ストアを読み、
+拠点ごとの SampleBuffer に溜めて次の2つのレイアウトで表示する（l キーで切り替え）。
+
+- grid    : 拠点ごとに小さなグラフを格子状に並べる（下り・上りを同じ軸に描く）
+- overlay : 下り・上りの2段に全拠点の折れ線を色分けして重ねる
+
+拠点ごとに描画幅（ピクセル）まで間引き、データが変わった拠点だけ間引き直す。
+折れ線と現在値だけをブリットで描き直し、軸範囲が変わったときだけ全体を描き直す。
+"""
+import math
+import time
+from datetime import datetime
+
+import numpy as np
+
+from downsample import decimate_for_width
+from history_store import is_remote_path, list_targets, open_history_reader
+from instrumentation import span
+from network_speed_monitor import (BG_COLOR, DOWNLOAD_COLOR, GRID_COLOR, UPLOAD_COLOR,
+                                   BlitManager, _nice_ceiling)
+from sample_buffer import SampleBuffer
+
+LAYOUTS = ('grid', 'overlay')
+STALE_COLOR = '#FF5555'
+# overlay で凡例を出す拠点数の上限（それ以上は凡例が表示領域を覆う）
+MAX_LEGEND_TARGETS = 20
+
+
+def _grid_shape(n, aspect_ratio):
+    """n 個のセルを画面の縦横比に合わせて並べる (行数, 列数)"""
+    ncols = max(1, min(n, math.ceil(math.sqrt(n * aspect_ratio))))
+    return math.ceil(n / ncols), ncols
+
+
+def _format_clock(value, pos=None):
+    return datetime.fromtimestamp(value).strftime('%H:%M')
+
+
+class MultiTargetView:
+    def __init__(self, data_file, targets=None, max_data_points=8640, layout='grid',
+                 window_hours=None, poll_interval=5.0):
+        self.data_file = data_file
+        self.max_data_points = max_data_points
+        self.layout = layout
+        # 表示する時間幅（None はバッファ全体）
+        self.window = window_hours * 3600 if window_hours else None
+        self.poll_interval = poll_interval
+        # 拠点を指定しなければ、後から現れた拠点も追加する
+        self.fixed_targets = bool(targets)
+        self.reader = open_history_reader(data_file)
+        if not targets:
+            targets = (self.reader.targets() if is_remote_path(data_file)
+                       else list_targets(data_file))
+        self.buffers = {}
+        self.fig = None
+        self.blit_manager = None
+        self.animated_artists = []
+        self._layout_dirty = True
+        with span('load_history'):
+            for target in targets:
+                self._add_target(target)
+                self._load(target)
+
+    def _add_target(self, target):
+        self.buffers[target] = SampleBuffer(self.max_data_points, columns=('download', 'upload'))
+        self._layout_dirty = True
+
+    def _load(self, target):
+        buffer = self.buffers[target]
+        try:
+            if hasattr(self.reader, 'tail_arrays'):
+                buffer.extend(*self.reader.tail_arrays(self.max_data_points, target=target))
+            else:
+                self._extend(buffer, self.reader.tail(self.max_data_points, target=target))
+        except (OSError, ValueError) as e:
+            print(f"History load error ({target}): {e}")
+
+    @staticmethod
+    def _extend(buffer, entries):
+        timestamps, downloads, uploads = [], [], []
+        for entry in entries:
+            try:
+                timestamp = datetime.fromisoformat(entry['timestamp']).timestamp()
+                download, upload = float(entry['download']), float(entry['upload'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            timestamps.append(timestamp)
+            downloads.append(download)
+            uploads.append(upload)
+        if timestamps:
+            buffer.extend(timestamps, downloads, uploads)
+
+    def poll_history(self):
+        """追記分を拠点ごとに振り分けてバッファへ追加"""
+        try:
+            entries = self.reader.poll()
+        except (OSError, ValueError) as e:
+            print(f"History poll error: {e}")
+            return
+        by_target = {}
+        for entry in entries:
+            target = entry.get('target')
+            if target is None:
+                continue
+            if target not in self.buffers:
+                if self.fixed_targets:
+                    continue
+                self._add_target(target)
+            by_target.setdefault(target, []).append(entry)
+        for target, target_entries in by_target.items():
+            self._extend(self.buffers[target], target_entries)
+
+    # --- レイアウト ---
+
+    def setup_layout(self):
+        """レイアウトに応じて軸と描画用アーティストを生成"""
+        from matplotlib.ticker import FuncFormatter
+
+        self.fig.clear()
+        self.fig.patch.set_facecolor(BG_COLOR)
+        targets = list(self.buffers)
+        self.target_axes = {}
+        self.lines = {}
+        self.value_texts = {}
+        formatter = FuncFormatter(_format_clock)
+        if self.layout == 'grid' and targets:
+            aspect_ratio = self.fig.get_figwidth() / self.fig.get_figheight()
+            nrows, ncols = _grid_shape(len(targets), aspect_ratio)
+            gs = self.fig.add_gridspec(nrows, ncols, hspace=0.35, wspace=0.25,
+                                       top=0.97, bottom=0.04, left=0.04, right=0.99)
+            first = None
+            for i, target in enumerate(targets):
+                ax = self.fig.add_subplot(gs[i // ncols, i % ncols], sharex=first)
+                first = first or ax
+                self._style_axes(ax, labelsize=6)
+                ax.tick_params(axis='x', labelbottom=i + ncols >= len(targets))
+                ax.set_title(target, fontsize=7, color='#58A6FF', family='monospace', pad=2)
+                down, = ax.plot([], [], color=DOWNLOAD_COLOR, linewidth=1)
+                up, = ax.plot([], [], color=UPLOAD_COLOR, linewidth=1)
+                self.lines[target] = (down, up)
+                self.target_axes[target] = (ax, ax)
+                self.value_texts[target] = ax.text(
+                    0.98, 0.95, '', transform=ax.transAxes, fontsize=6, fontweight='bold',
+                    verticalalignment='top', horizontalalignment='right',
+                    color=DOWNLOAD_COLOR, family='monospace')
+            self.value_axes = [self.target_axes[t][0] for t in targets]
+        else:
+            gs = self.fig.add_gridspec(2, 1, hspace=0.1, top=0.95, bottom=0.06,
+                                       left=0.06, right=0.98)
+            ax_down = self.fig.add_subplot(gs[0])
+            ax_up = self.fig.add_subplot(gs[1], sharex=ax_down)
+            for ax, label, color in ((ax_down, 'Download (Mbps)', DOWNLOAD_COLOR),
+                                     (ax_up, 'Upload (Mbps)', UPLOAD_COLOR)):
+                self._style_axes(ax, labelsize=8)
+                ax.set_ylabel(label, color=color, fontsize=10, fontweight='bold')
+            ax_down.tick_params(axis='x', labelbottom=False)
+            ax_down.set_title('>>> NETWORK_SPEED_MONITOR [compare]', fontsize=12,
+                              fontweight='bold', color='#58A6FF', family='monospace')
+            colors = self._overlay_colors(len(targets))
+            for target, color in zip(targets, colors):
+                down, = ax_down.plot([], [], color=color, linewidth=1, label=target)
+                up, = ax_up.plot([], [], color=color, linewidth=1)
+                self.lines[target] = (down, up)
+                self.target_axes[target] = (ax_down, ax_up)
+            if 0 < len(targets) <= MAX_LEGEND_TARGETS:
+                ax_down.legend(loc='upper left', fontsize=7, ncol=4, facecolor=BG_COLOR,
+                               edgecolor=GRID_COLOR, labelcolor='#C9D1D9')
+            self.value_axes = [ax_down, ax_up]
+        for ax in self.value_axes:
+            ax.xaxis.set_major_formatter(formatter)
+
+        self.animated_artists = [line for pair in self.lines.values() for line in pair]
+        self.animated_artists += list(self.value_texts.values())
+        if self.blit_manager is not None:
+            self.blit_manager.set_artists(self.animated_artists)
+        # 間引き結果・軸範囲は次の更新で作り直す
+        self._decimated = {}
+        self._xlim = None
+        self._ylims = {}
+        self._layout_dirty = False
+
+    @staticmethod
+    def _style_axes(ax, labelsize):
+        ax.set_facecolor(BG_COLOR)
+        ax.tick_params(labelsize=labelsize, colors='#58A6FF', labelcolor='#58A6FF')
+        ax.grid(True, alpha=0.4, linestyle='-', linewidth=0.6, color='#30363D')
+        for spine in ax.spines.values():
+            spine.set_color('#30363D')
+
+    @staticmethod
+    def _overlay_colors(n):
+        from matplotlib import colormaps
+        cmap = colormaps['tab20']
+        return [cmap(i % cmap.N) for i in range(n)]
+
+    # --- 更新 ---
+
+    def _x_range(self):
+        """全拠点で共通の表示範囲（窓の右端に余白を取り、はみ出したら進める）"""
+        latest = [b.latest_timestamp() for b in self.buffers.values() if len(b)]
+        if not latest:
+            return None
+        end = max(latest)
+        if self.window is not None:
+            start = end - self.window
+        else:
+            start = min(float(b.timestamps[0]) for b in self.buffers.values() if len(b))
+        if self._xlim is not None and self._xlim[0] <= start and end <= self._xlim[1]:
+            return self._xlim
+        # 右端に幅の 1/10 の余白を取り、それを使い切るまで軸を動かさない
+        return (start, end + max(end - start, 60.0) / 10)
+
+    def _decimate_target(self, target, xlim, width_px):
+        """拠点の表示範囲を描画幅まで間引く（前回とデータ・範囲が同じなら使い回す）"""
+        buffer = self.buffers[target]
+        key = (buffer.version, xlim, width_px)
+        cached = self._decimated.get(target)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        snap = buffer.snapshot()
+        ts = snap.timestamps
+        lo = int(np.searchsorted(ts, xlim[0]))
+        x = ts[lo:]
+        result = tuple(decimate_for_width(x, snap.column(name)[lo:], width_px)
+                       for name in ('download', 'upload'))
+        self._decimated[target] = (key, result)
+        return result
+
+    def _stale_after(self, buffer):
+        """最新サンプルからこの秒数を過ぎたら止まっているとみなす（測定間隔の3倍、最短60秒）"""
+        ts = buffer.timestamps[-10:]
+        if len(ts) < 2:
+            return 600.0
+        return max(60.0, 3 * float(np.median(np.diff(ts))))
+
+    def update_graph(self, frame=None):
+        with span('update_graph'):
+            return self._update_graph()
+
+    def _update_graph(self):
+        with span('poll_history'):
+            self.poll_history()
+        if self._layout_dirty:
+            self.setup_layout()
+            full_draw = True
+        else:
+            full_draw = False
+        xlim = self._x_range()
+        if xlim is None:
+            return self.animated_artists
+        if xlim != self._xlim:
+            self._xlim = xlim
+            self.value_axes[0].set_xlim(*xlim)
+            full_draw = True
+
+        now = time.time()
+        peaks = {}
+        for target, buffer in self.buffers.items():
+            (x_down, y_down), (x_up, y_up) = self._decimate_target(
+                target, xlim, self._width_px(target))
+            down_line, up_line = self.lines[target]
+            down_line.set_data(x_down, y_down)
+            up_line.set_data(x_up, y_up)
+            stale = len(buffer) == 0 or now - buffer.latest_timestamp() > self._stale_after(buffer)
+            for line in (down_line, up_line):
+                line.set_alpha(0.35 if stale else 0.9)
+            ax_down, ax_up = self.target_axes[target]
+            for ax, y in ((ax_down, y_down), (ax_up, y_up)):
+                if len(y):
+                    peaks[ax] = max(peaks.get(ax, 0.0), float(np.max(y)))
+            text = self.value_texts.get(target)
+            if text is not None:
+                self._set_value_text(text, buffer, stale, now)
+
+        # 軸の上限は 1 / 2 / 5 × 10^k に丸め、段が変わったときだけ全体を描き直す
+        for ax, peak in peaks.items():
+            top = _nice_ceiling(peak * 1.1)
+            if self._ylims.get(ax) != top:
+                self._ylims[ax] = top
+                ax.set_ylim(0, top)
+                full_draw = True
+
+        if self.blit_manager is not None:
+            if full_draw:
+                self.fig.canvas.draw()
+            else:
+                self.blit_manager.update()
+        return self.animated_artists
+
+    def _width_px(self, target):
+        ax = self.target_axes[target][0]
+        return max(2, int(ax.bbox.width))
+
+    @staticmethod
+    def _set_value_text(text, buffer, stale, now):
+        if not len(buffer):
+            text.set_text('NO DATA')
+            text.set_color(STALE_COLOR)
+            return
+        if stale:
+            minutes = (now - buffer.latest_timestamp()) / 60
+            text.set_text(f"STALE {minutes:.0f}m")
+            text.set_color(STALE_COLOR)
+            return
+        text.set_text(f"↓{buffer.latest('download'):.0f} ↑{buffer.latest('upload'):.0f}")
+        text.set_color(DOWNLOAD_COLOR)
+
+    # --- ウィンドウ ---
+
+    def on_resize(self, event):
+        self._layout_dirty = True
+        self.update_graph()
+
+    def on_key(self, event):
+        """l キーで grid / overlay を切り替え"""
+        if event.key == 'l':
+            self.layout = LAYOUTS[(LAYOUTS.index(self.layout) + 1) % len(LAYOUTS)]
+            print(f"Layout: {self.layout}")
+            self._layout_dirty = True
+            self.update_graph()
+
+    def render(self, fig):
+        """ウィンドウを開かずに fig（Agg などの Figure）へ現在のデータを描画"""
+        self.fig = fig
+        self.blit_manager = None
+        self._layout_dirty = True
+        self.update_graph()
+        return fig
+
+    def start_monitoring(self):
+        import matplotlib.pyplot as plt
+
+        plt.rcParams['toolbar'] = 'None'
+        self.fig = plt.figure(figsize=(14, 8))
+        self.blit_manager = BlitManager(self.fig.canvas)
+        self.fig.canvas.manager.set_window_title(
+            f'>>> NETWORK_SPEED_MONITOR [{len(self.buffers)} targets]')
+        self.fig.canvas.mpl_connect('resize_event', self.on_resize)
+        self.fig.canvas.mpl_connect('key_press_event', self.on_key)
+        self.update_graph()
+        self.timer = self.fig.canvas.new_timer(interval=int(self.poll_interval * 1000))
+        self.timer.add_callback(self.update_graph)
+        self.timer.start()
+        plt.show()
+
+    def stop_monitoring(self):
+        self.reader.close()
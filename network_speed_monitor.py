@@ -1,345 +1,601 @@
 #!/usr/bin/env python3
-import speedtest
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-from datetime import datetime
+# 起動を速くするため、重いモジュールは必要になった時点で読み込む
+#   speedtest   : speedtest.net で測定するとき（server_cache.SpeedtestSession）
+#   numpy       : グラフ用バッファ・劣化検知を作るとき（NetworkSpeedMonitor.__init__）
+#   matplotlib  : ウィンドウを開くとき（start_monitoring）
+import argparse
+import math
 import threading
-import time
-import json
-import os
-from collections import deque
+from datetime import datetime
+from history_store import (DEFAULT_HISTORY_FILE, entry_matches, is_remote_path,
+                           open_history_reader)
+from instrumentation import add_instrument_arguments, recorder, run_instrumented, span
+from latency_probe import add_probe_arguments, latency_path, prober_from_args
+from measurement_engines import add_engine_arguments, engine_from_args
+from server_cache import DEFAULT_CACHE_FILE
+
+
+def _tick_range(stop, step):
+    """0 から stop 未満まで step 間隔の目盛り位置"""
+    return list(range(0, math.ceil(stop), step))
+
+
+def _nice_ceiling(value):
+    """value 以上で 1 / 2 / 5 × 10^k の最小値（RTT 軸の上限を段階的に変えるため）"""
+    if value <= 0:
+        return 1.0
+    scale = 10 ** math.floor(math.log10(value))
+    for step in (1, 2, 5, 10):
+        if value <= step * scale:
+            return step * scale
+    return 10 * scale
+
+# カラーパレット
+DOWNLOAD_COLOR = '#00FF41'  # Matrix green
+UPLOAD_COLOR = '#FF0080'    # Neon pink
+BG_COLOR = '#0D1117'        # Dark background
+GRID_COLOR = '#21262D'      # Dark grid
+LATENCY_COLOR = '#F0B429'   # Amber
+# ステータス表示の色（speed_stats の状態コード別: OK / WARN / DEGRADED / DOWN）
+STATUS_COLORS = {0: '#58A6FF', 1: '#F0B429', 2: '#FF5555', 3: '#FF5555'}
+
+
+class BlitManager:
+    """背景をキャッシュし、動的アーティストだけを再描画する
+
+    動的レイヤーは2つ。グラフ（折れ線・現在値）は update() のたびにグラフの軸の領域だけ、
+    ステータスのテキストは update_texts() で文字列か色が変わったものだけ、その行の領域を
+    描き直す（テキストのラスタライズが1フレームの大半を占めるため）。
+    """
+    
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self._background = None
+        self._bbox = None
+        self._artists = []
+        self._texts = []
+        # テキスト -> (行の領域, その背景, 描いた文字列と色)
+        self._slots = {}
+        self.cid = canvas.mpl_connect('draw_event', self.on_draw)
+        
+    def set_artists(self, artists, texts=()):
+        """動的レイヤーのアーティストを登録（通常の描画からは除外される）
+
+        texts は他の動的アーティストと重ならない位置の1行テキスト。
+        """
+        for artist in (*artists, *texts):
+            artist.set_animated(True)
+        self._artists = list(artists)
+        self._texts = list(texts)
+        self._background = None
+        self._slots = {}
+        
+    def on_draw(self, event):
+        """全体描画のたびに背景を取り直す"""
+        from matplotlib.transforms import Bbox
+        
+        figure = self.canvas.figure
+        axes_boxes = [artist.axes.bbox for artist in self._artists if artist.axes is not None]
+        bbox = Bbox.union(axes_boxes).padded(2) if axes_boxes else figure.bbox
+        self._bbox = Bbox.intersection(bbox, figure.bbox) or figure.bbox
+        self._background = self.canvas.copy_from_bbox(self._bbox)
+        renderer = self.canvas.get_renderer()
+        self._slots = {}
+        for text in self._texts:
+            slot = self._text_slot(text, renderer)
+            if slot is not None:
+                self._slots[text] = [slot, self.canvas.copy_from_bbox(slot), None]
+        self._draw_texts(self._texts)
+        self._draw_animated()
+        
+    @staticmethod
+    def _text_slot(text, renderer):
+        """テキストの行の領域（軸の幅いっぱい、高さはフォントの行の高さ）"""
+        from matplotlib.transforms import Bbox
+        
+        extent = text.get_window_extent(renderer)
+        if extent.height <= 0:
+            return None
+        x0, x1 = text.axes.bbox.intervalx if text.axes is not None else (extent.x0, extent.x1)
+        return Bbox.from_extents(min(x0, extent.x0), extent.y0 - 1,
+                                 max(x1, extent.x1), extent.y1 + 1)
+        
+    def _draw_animated(self):
+        for artist in self._artists:
+            self.canvas.figure.draw_artist(artist)
+            
+    def _draw_texts(self, texts):
+        for text in texts:
+            self.canvas.figure.draw_artist(text)
+            if text in self._slots:
+                self._slots[text][2] = (text.get_text(), text.get_color())
+            
+    def update(self):
+        """背景を復元してグラフの動的アーティストだけを描き、その領域を画面へ転送"""
+        if self._background is None:
+            self.canvas.draw()
+            return
+        self.canvas.restore_region(self._background)
+        self._draw_animated()
+        self.canvas.blit(self._bbox)
+        self.canvas.flush_events()
+        
+    def update_texts(self):
+        """文字列か色が変わったテキストだけ、その行を描き直して転送（描き直した数を返す）"""
+        if self._background is None or len(self._slots) < len(self._texts):
+            # 空のテキストで背景を取ったときは行の高さが分からないので全体を描く
+            self.canvas.draw()
+            return len(self._texts)
+        changed = [text for text in self._texts
+                   if self._slots[text][2] != (text.get_text(), text.get_color())]
+        for text in changed:
+            slot, background, _ = self._slots[text]
+            self.canvas.restore_region(background)
+            self._draw_texts([text])
+            self.canvas.blit(slot)
+        if changed:
+            self.canvas.flush_events()
+        return len(changed)
+
+
+class DisplaySnapshot:
+    """描画に渡す不変のスナップショット（バッファ・集約ティア・接続状態・レイテンシ）"""
+    __slots__ = ('version', 'samples', 'tiers', 'status', 'latency')
+
+    def __init__(self, version, samples, tiers, status, latency):
+        self.version = version
+        self.samples = samples
+        self.tiers = tiers
+        self.status = status
+        self.latency = latency
+
 
 class NetworkSpeedMonitor:
-    def __init__(self, max_data_points=100, test_interval=60):
+    def __init__(self, max_data_points=100, test_interval=60, data_file=DEFAULT_HISTORY_FILE,
+                 view_only=False, engine=None, target=None, collector_options=None,
+                 entries=None):
+        import numpy as np
+        from sample_buffer import SampleBuffer
+        from downsample import TieredAggregator, decimate_for_width
+        from speed_stats import DegradationDetector
+        self._decimate = decimate_for_width
+        
         self.max_data_points = max_data_points
         self.test_interval = test_interval
-        self.download_speeds = deque(maxlen=max_data_points)
-        self.upload_speeds = deque(maxlen=max_data_points)
-        self.timestamps = deque(maxlen=max_data_points)
-        self.data_file = "speed_history.json"
-        self.running = False
-        self.st = None  # 遅延初期化
+        # タイムスタンプ（epoch 秒）と速度列を持つ固定容量バッファ
+        self.samples = SampleBuffer(max_data_points, columns=('download', 'upload'))
+        # 長時間表示用の集約ティア（1分 / 10分 / 1時間）
+        self.tiers = TieredAggregator(max_data_points, columns=('download', 'upload'))
+        # レイテンシプローブのバッチ（RTT 平均・ジッターは ms、全損失のバッチは NaN、loss は 0〜1）
+        self.latency = SampleBuffer(max_data_points, columns=('rtt', 'jitter', 'loss'))
+        self.zoom_tier = 'raw'
+        # p キーで表示するスパン集計パネル（instrumentation）
+        self.show_profile = False
+        # 列ごとの劣化検知（ステータス表示の STATUS / CONN に使う）
+        self.detectors = {name: DegradationDetector() for name in ('download', 'upload')}
+        # X 座標（インデックス）は毎フレーム作らずスライスで使い回す（集計中のバケット分 +1）
+        self._x_index = np.arange(max_data_points + 1)
+        self.data_file = data_file
+        self.view_only = view_only
+        # 複数ターゲットの履歴から表示する系列（None は全件）
+        self.target = target
+        self.blit_manager = None
+        self.animated_artists = []
+        # 測定スレッド（書き込み）と描画（読み取り）の受け渡し。書き込み側はロック下で
+        # バッファを更新して DisplaySnapshot を差し替え、描画側はその参照を1回読むだけ
+        self._write_lock = threading.Lock()
+        self._snapshot = None
+        self._version = 0
+        self._drawn_key = None
+        self.latency_reader = None
+        self.ax_lat = None
+        
+        if entries is not None:
+            # 書き出し用：渡されたエントリだけを表示（履歴ストアは読まない）
+            self.collector = None
+            self.reader = None
+            self.view_only = True
+            self.record_entries(entries)
+            return
+        if view_only:
+            # 表示専用：別プロセスのコレクターが書く履歴ストアを追跡
+            self.collector = None
+            self.reader = open_history_reader(data_file)
+            if not is_remote_path(data_file):
+                # 集約サービスはレイテンシのバッチを持たない
+                self.latency_reader = open_history_reader(latency_path(data_file))
+        else:
+            from collector import SpeedCollector
+            self.collector = SpeedCollector(test_interval=test_interval, data_file=data_file,
+                                            engine=engine, **(collector_options or {}))
+            self.collector.on_sample = self.record_sample
+            if self.collector.prober is not None:
+                self.collector.prober.add_batch_callback(lambda entry: self.record_latency([entry]))
+            self.reader = None
         
         self.load_history()
         
     def load_history(self):
-        """過去のデータを読み込み"""
-        if os.path.exists(self.data_file):
+        """過去のデータを読み込み（末尾から必要な件数だけ読む）"""
+        source = self.reader if self.view_only else self.collector.history
+        with span('load_history'):
             try:
-                with open(self.data_file, 'r') as f:
-                    data = json.load(f)
-                    for entry in data[-self.max_data_points:]:
-                        self.timestamps.append(datetime.fromisoformat(entry['timestamp']))
-                        self.download_speeds.append(entry['download'])
-                        self.upload_speeds.append(entry['upload'])
-            except:
-                pass
-                
-    def save_data(self, timestamp, download, upload):
-        """データを保存"""
-        entry = {
-            'timestamp': timestamp.isoformat(),
-            'download': download,
-            'upload': upload
-        }
-        
-        data = []
-        if os.path.exists(self.data_file):
+                if hasattr(source, 'tail_arrays'):
+                    # .bin は memmap の列をそのまま渡す（エントリの dict を作らない）
+                    self.record_arrays(*source.tail_arrays(self.max_data_points, target=self.target))
+                else:
+                    self.record_entries(source.tail(self.max_data_points, target=self.target))
+            except (OSError, ValueError) as e:
+                print(f"History load error: {e}")
+                return
+            self._load_latency()
+    
+    def _load_latency(self):
+        """レイテンシバッチの末尾を読み込む（表示専用ならリーダー、測定中ならプローブのストア）"""
+        source = self.latency_reader
+        if source is None and self.collector is not None and self.collector.prober is not None:
+            source = self.collector.prober.store
+        if source is None:
+            return
+        try:
+            self.record_latency(source.tail(self.max_data_points))
+        except (OSError, ValueError) as e:
+            print(f"Latency history load error: {e}")
+    
+    def record_entries(self, entries):
+        """履歴エントリ（dict）をバッファへ追加（劣化検知・スナップショットはまとめて更新）"""
+        timestamps, downloads, uploads = [], [], []
+        for entry in entries:
+            if not entry_matches(entry, self.target):
+                continue
             try:
-                with open(self.data_file, 'r') as f:
-                    data = json.load(f)
-            except:
-                data = []
-        
-        data.append(entry)
-        
-        with open(self.data_file, 'w') as f:
-            json.dump(data[-1000:], f, indent=2)
-            
-    def test_speed(self):
-        """速度テストを実行"""
+                timestamp = datetime.fromisoformat(entry['timestamp']).timestamp()
+                download, upload = float(entry['download']), float(entry['upload'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            timestamps.append(timestamp)
+            downloads.append(download)
+            uploads.append(upload)
+        self.record_arrays(timestamps, downloads, uploads)
+    
+    def record_arrays(self, timestamps, downloads, uploads):
+        """列の配列（timestamps は epoch 秒）をバッファ・集約ティア・劣化検知へまとめて追加"""
+        if not len(timestamps) and self._snapshot is not None:
+            return
+        with self._write_lock:
+            self.samples.extend(timestamps, downloads, uploads)
+            self.tiers.extend(timestamps, downloads, uploads)
+            self.detectors['download'].extend(downloads)
+            self.detectors['upload'].extend(uploads)
+            self._publish()
+    
+    def poll_history(self):
+        """表示専用モードで、コレクターが追記した分を取り込む"""
         try:
-            # 初回実行時にspeedtestを初期化
-            if self.st is None:
-                print("Initializing speedtest...")
-                self.st = speedtest.Speedtest()
+            self.record_entries(self.reader.poll())
+            if self.latency_reader is not None:
+                self.record_latency(self.latency_reader.poll())
+        except (OSError, ValueError) as e:
+            print(f"History poll error: {e}")
                 
-            self.st.get_best_server()
-            download_speed = self.st.download() / 1_000_000  # Mbps
-            upload_speed = self.st.upload() / 1_000_000      # Mbps
-            return download_speed, upload_speed
-        except Exception as e:
-            print(f"Speed test error: {e}")
-            # エラー時は再初期化を試行
+    def record_sample(self, timestamp, download, upload):
+        """サンプルをバッファと集約ティアへ追加（測定スレッドから呼ばれる）"""
+        with self._write_lock:
+            self.samples.append(timestamp, download, upload)
+            self.tiers.append(timestamp.timestamp(), download, upload)
+            self.detectors['download'].update(download)
+            self.detectors['upload'].update(upload)
+            self._publish()
+    
+    def record_latency(self, entries):
+        """レイテンシバッチ（latency_probe.batch_entry）を追加（プローブのスレッドからも呼ばれる）"""
+        rows = []
+        for entry in entries:
             try:
-                print("Retrying with new speedtest instance...")
-                self.st = speedtest.Speedtest()
-                self.st.get_best_server()
-                download_speed = self.st.download() / 1_000_000
-                upload_speed = self.st.upload() / 1_000_000
-                return download_speed, upload_speed
-            except Exception as e2:
-                print(f"Retry failed: {e2}")
-                return None, None
-            
-    def speed_test_worker(self):
-        """バックグラウンドで速度テストを実行"""
-        while self.running:
-            download, upload = self.test_speed()
-            if download is not None and upload is not None:
-                timestamp = datetime.now()
-                self.timestamps.append(timestamp)
-                self.download_speeds.append(download)
-                self.upload_speeds.append(upload)
-                self.save_data(timestamp, download, upload)
-                print(f"{timestamp.strftime('%H:%M:%S')} - Down: {download:.2f} Mbps, Up: {upload:.2f} Mbps")
-            
-            time.sleep(self.test_interval)
-            
-    def update_graph(self, frame):
-        """グラフを更新"""
-        if len(self.timestamps) == 0:
+                timestamp = datetime.fromisoformat(entry['timestamp']).timestamp()
+                rows.append((timestamp, float(entry.get('avg', 'nan')),
+                             float(entry.get('jitter', 'nan')), float(entry['loss'])))
+            except (KeyError, TypeError, ValueError):
+                continue
+        if not rows:
             return
+        with self._write_lock:
+            for row in rows:
+                self.latency.append(*row)
+            self._publish()
+    
+    def _publish(self):
+        """現在の内容を DisplaySnapshot として公開（書き込みロック下で呼ぶ）"""
+        self._version += 1
+        # 参照の差し替えは1回の代入なので、描画側は途中の状態を見ない
+        self._snapshot = DisplaySnapshot(self._version, self.samples.snapshot(),
+                                         self.tiers.snapshot(), self.connection_status(),
+                                         self.latency.snapshot())
+    
+    def snapshot(self):
+        """最新の DisplaySnapshot（O(1)、まだ何も記録していなければ None）"""
+        return self._snapshot
+                
+    def connection_status(self):
+        """劣化検知の結果から (STATUS, CONN, 状態コード) を返す"""
+        from speed_stats import DEGRADED, DOWN, STATUS_NAMES, WARMUP, WARN
+        
+        # 下り・上りのうち悪い方の状態を表示
+        worst = max(self.detectors.values(), key=lambda d: d.status)
+        status = worst.status
+        if status == WARMUP:
+            return 'WARMUP', 'CALIBRATING', status
+        label = STATUS_NAMES[status]
+        if status in (WARN, DEGRADED):
+            direction = 'DL' if worst is self.detectors['download'] else 'UP'
+            label = f"{label} {direction}"
+        if status == DOWN:
+            return label, 'LOST', status
+        
+        # 変動係数（EWMA の標準偏差 / EWMA）で接続の安定度を判定
+        variation = max(d.variation or 0.0 for d in self.detectors.values())
+        if variation < 0.15:
+            conn = 'STABLE'
+        elif variation < 0.35:
+            conn = 'VARIABLE'
+        else:
+            conn = 'UNSTABLE'
+        return label, conn, status
+    
+    def update_graph(self, frame=None):
+        """グラフを更新（アーティストは再生成せず、データとテキストだけ差し替える）"""
+        with span('update_graph'):
+            return self._update_graph()
+
+    def _update_graph(self):
+        if self.reader is not None:
+            with span('poll_history'):
+                self.poll_history()
+        snap = self._snapshot
+        if snap is None or len(snap.samples) == 0:
+            return self.animated_artists
+        
+        # データ・表示設定が前回の描画から変わっていなければグラフは描き直さない
+        # （時計の分だけが進んだときはステータスの行だけ）
+        key = (snap.version, self.zoom_tier, self.show_profile)
+        if key == self._drawn_key and not self._layout_dirty:
+            self._update_status(snap)
+            return self.animated_artists
+        self._drawn_key = key
+        # 最初のレイテンシバッチが届いたら RTT の段を追加する
+        if (self.ax_lat is not None) != self._wants_latency_strip(snap):
+            self.setup_layout()
+        
+        # 表示するティアを選択（raw は列をコピーせずビューを渡す）
+        samples = snap.samples
+        if self.zoom_tier == 'raw':
+            timestamps = samples.timestamps
+            down_speeds = samples.column('download')
+            up_speeds = samples.column('upload')
+            max_down = samples.stats('download')['max']
+            max_up = samples.stats('upload')['max']
+            first_seq = samples.first_seq
+        else:
+            timestamps, down_speeds, _, _ = snap.tiers.series(self.zoom_tier, 'download')
+            _, up_speeds, _, _ = snap.tiers.series(self.zoom_tier, 'upload')
+            max_down = float(down_speeds.max())
+            max_up = float(up_speeds.max())
+            first_seq = snap.tiers.first_seq(self.zoom_tier)
+        n = len(timestamps)
             
-        self.ax1.clear()
-        self.ax2.clear()
+        # X はサンプルの通し番号（追記で古いサンプルが消えても各点の X は動かない）。
+        # インデックスで間引いてから通し番号へずらす
+        x_values = self._x_index[:n]
+        width_px = self.ax1.bbox.width
+        with span('decimate'):
+            x_down, y_down = self._decimate(x_values, down_speeds, width_px)
+            x_up, y_up = self._decimate(x_values, up_speeds, width_px)
+        self.down_line.set_data(x_down + first_seq, y_down)
+        self.up_line.set_data(x_up + first_seq, y_up)
         
-        # 数値インデックスを使用してプロット
-        x_values = list(range(len(self.timestamps)))
-        times = [t.strftime('%H:%M:%S') for t in self.timestamps]
+        # 間引いたときはマーカーを省略（点が重なって読めないため）
+        decimated = len(x_down) < n
+        self.down_line.set_marker('None' if decimated else 'o')
+        self.up_line.set_marker('None' if decimated else 's')
         
-        # カラーパレット
-        download_color = '#00FF41'  # Matrix green
-        upload_color = '#FF0080'    # Neon pink
-        bg_color = '#0D1117'        # Dark background
-        grid_color = '#21262D'      # Dark grid
+        # 軸範囲・目盛りが変わったときだけ静的レイヤーを描き直す
+        needs_full_draw = self._update_y_axes(max_down, max_up)
+        needs_full_draw |= self._update_x_axis(timestamps, first_seq)
+        if self.ax_lat is not None:
+            needs_full_draw |= self._update_latency(snap.latency, timestamps, first_seq, width_px)
         
-        # ダウンロード速度のプロット
-        self.ax1.plot(x_values, list(self.download_speeds), 
-                     color=download_color, linewidth=2, marker='o', 
-                     markersize=5, markerfacecolor=download_color, 
-                     markeredgecolor=bg_color, markeredgewidth=1,
-                     label='Download', alpha=0.9)
+        # 現在の速度を表示
+        self.current_down_text.set_text(f'[DL] {samples.latest("download"):.1f} Mbps')
+        self.current_up_text.set_text(f'[UP] {samples.latest("upload"):.1f} Mbps')
         
-        # アップロード速度のプロット
-        self.ax2.plot(x_values, list(self.upload_speeds), 
-                     color=upload_color, linewidth=2, marker='s', 
-                     markersize=5, markerfacecolor=upload_color, 
-                     markeredgecolor=bg_color, markeredgewidth=1,
-                     label='Upload', alpha=0.9)
+        if self.show_profile:
+            self.profile_text.set_text(recorder.format_summary(limit=8, compact=True))
         
-        # Y軸ラベルを左右に分離し、色を統一
-        self.ax1.set_ylabel('Download Speed (Mbps)', color=download_color, fontsize=12, fontweight='bold')
-        self.ax2.set_ylabel('Upload Speed (Mbps)', color=upload_color, fontsize=12, fontweight='bold')
+        # 余白は setup_layout の gridspec で固定しているので、初回とリサイズ時は全体を描くだけ
+        if self._layout_dirty:
+            self._layout_dirty = False
+            needs_full_draw = True
         
-        # Y軸の目盛りラベルの色を設定
-        self.ax1.tick_params(axis='y', labelcolor=download_color, labelsize=10, colors=download_color)
-        self.ax2.tick_params(axis='y', labelcolor=upload_color, labelsize=10, colors=upload_color)
-        self.ax1.tick_params(axis='x', labelcolor='#58A6FF', labelsize=9, colors='#58A6FF')
+        if needs_full_draw:
+            # draw_event で背景が取り直され、動的アーティストも描かれる
+            self.add_hacker_status_external(snap)
+            with span('draw'):
+                self.fig.canvas.draw()
+        elif self.blit_manager is not None:
+            with span('blit'):
+                self.blit_manager.update()
+            self._update_status(snap)
+        return self.animated_artists
+    
+    def _update_status(self, snap):
+        """ステータスのテキストを更新し、変わった行だけブリットで描き直す"""
+        self.add_hacker_status_external(snap)
+        if self.blit_manager is not None:
+            with span('blit_status'):
+                self.blit_manager.update_texts()
+    
+    def _update_y_axes(self, max_down, max_up):
+        """Y軸の範囲と目盛りを更新（変化があれば True）"""
+        # 画面サイズに応じてマージンを調整
+        aspect_ratio = self.fig.get_figwidth() / self.fig.get_figheight()
         
-        # アップロードのY軸ラベルを右側に配置
-        self.ax2.yaxis.set_label_position('right')
-        self.ax2.yaxis.tick_right()
+        # ダウンロード軸を100Mbpsまで表示するように設定
+        target_max = 100
+        if max_down < target_max:
+            down_margin = target_max - max_down
+        else:
+            down_margin = max_down * 0.2
         
-        # 軸の線を明るくする（枠線として表示）
-        self.ax1.spines['bottom'].set_color('#7FBAFF')  # より濃いブルー
-        self.ax1.spines['left'].set_color('#40FF70')    # より濃いグリーン
-        self.ax1.spines['top'].set_color('#7FBAFF')
-        self.ax1.spines['right'].set_color('#FF40A0')   # より濃いピンク
+        # アップロード軸の設定
+        if aspect_ratio < 1.2:  # 縦長画面
+            up_margin = max(15, max_up * 0.8)
+        else:  # 横長画面
+            up_margin = max(8, max_up * 0.4)
         
-        # 軸の線幅を太くする
-        for spine in self.ax1.spines.values():
-            spine.set_linewidth(2)
+        # Y軸の範囲を設定
+        down_max = max_down + down_margin
+        up_max = max_up + up_margin
         
-        # Y軸の範囲を動的に設定して変動を抑える
-        if len(self.download_speeds) > 0:
-            down_speeds = list(self.download_speeds)
-            up_speeds = list(self.upload_speeds)
-            
-            # 現在の最大値から適切な範囲を計算
-            max_down = max(down_speeds) if down_speeds else 100
-            max_up = max(up_speeds) if up_speeds else 50
-            
-            # 画面サイズに応じてマージンを調整
-            fig_width = self.fig.get_figwidth()
-            fig_height = self.fig.get_figheight()
-            aspect_ratio = fig_width / fig_height
-            
-            # ダウンロード軸を100Mbpsまで表示するように設定
-            target_max = 100
-            if max_down < target_max:
-                down_margin = target_max - max_down
-            else:
-                down_margin = max_down * 0.2
-            
-            # アップロード軸の設定
-            if aspect_ratio < 1.2:  # 縦長画面
-                up_margin = max(15, max_up * 0.8)
-            else:  # 横長画面
-                up_margin = max(8, max_up * 0.4)
-            
-            # Y軸の範囲を設定
-            down_max = max_down + down_margin
-            up_max = max_up + up_margin
-            
-            self.ax1.set_ylim(0, down_max)
-            self.ax2.set_ylim(0, up_max)
-            
-            # Y軸の目盛りを細かく設定（見た目の変動を抑制）
-            import numpy as np
-            
-            # ダウンロード軸の目盛り設定
-            if down_max <= 100:
-                down_ticks = np.arange(0, down_max + 10, 10)  # 10Mbps間隔
-            elif down_max <= 200:
-                down_ticks = np.arange(0, down_max + 20, 20)  # 20Mbps間隔
-            else:
-                down_ticks = np.arange(0, down_max + 25, 25)  # 25Mbps間隔
-            
-            # アップロード軸の目盛り設定
-            if up_max <= 50:
-                up_ticks = np.arange(0, up_max + 5, 5)        # 5Mbps間隔
-            else:
-                up_ticks = np.arange(0, up_max + 10, 10)      # 10Mbps間隔
-            
-            self.ax1.set_yticks(down_ticks)
-            self.ax2.set_yticks(up_ticks)
+        key = (down_max, up_max)
+        if key == self._y_axes_key:
+            return False
+        self._y_axes_key = key
         
-        # グリッドと背景
-        self.ax1.grid(True, alpha=0.4, linestyle='-', linewidth=0.8, color='#30363D')
-        self.ax1.grid(True, which='minor', alpha=0.2, linestyle=':', linewidth=0.5, color='#21262D')
-        self.ax1.minorticks_on()
-        self.ax1.set_facecolor(bg_color)
-        self.fig.patch.set_facecolor(bg_color)
-        
-        # X軸の時刻ラベルを適切に設定（画面サイズに応じて調整）
-        if len(times) > 0:
-            # ウィンドウサイズを取得してラベル数を動的調整
-            fig_width = self.fig.get_figwidth()
-            fig_height = self.fig.get_figheight()
-            aspect_ratio = fig_width / fig_height
-            
-            # 縦長画面では時刻ラベルを減らし、横長画面では増やす
-            if aspect_ratio < 1.2:  # 縦長または正方形
-                max_labels = 4
-                rotation = 90
-                fontsize = 8
-            elif aspect_ratio < 1.8:  # 標準的な横長
-                max_labels = 6
-                rotation = 45
-                fontsize = 9
-            else:  # 超横長
-                max_labels = 8
-                rotation = 45
-                fontsize = 9
-                
-            if len(times) <= max_labels:
-                self.ax1.set_xticks(x_values)
-                self.ax1.set_xticklabels(times, rotation=rotation, ha='right', fontsize=fontsize)
-            else:
-                step = max(1, len(times) // max_labels)
-                tick_positions = list(range(0, len(times), step))
-                if tick_positions[-1] != len(times) - 1:
-                    tick_positions.append(len(times) - 1)
-                self.ax1.set_xticks(tick_positions)
-                self.ax1.set_xticklabels([times[i] for i in tick_positions], rotation=rotation, ha='right', fontsize=fontsize)
+        self.ax1.set_ylim(0, down_max)
+        self.ax2.set_ylim(0, up_max)
         
-        # タイトル
-        self.ax1.set_title('>>> NETWORK_SPEED_MONITOR', fontsize=14, fontweight='bold', 
-                          pad=20, color='#58A6FF', family='monospace')
+        # ダウンロード軸の目盛り設定（見た目の変動を抑制）
+        if down_max <= 100:
+            down_ticks = _tick_range(down_max + 10, 10)  # 10Mbps間隔
+        elif down_max <= 200:
+            down_ticks = _tick_range(down_max + 20, 20)  # 20Mbps間隔
+        else:
+            down_ticks = _tick_range(down_max + 25, 25)  # 25Mbps間隔
         
-        # 現在の速度を表示 (レスポンシブ対応)
-        if len(self.download_speeds) > 0 and len(self.upload_speeds) > 0:
-            current_down = self.download_speeds[-1]
-            current_up = self.upload_speeds[-1]
-            
-            # 画面サイズに応じてフォントサイズと位置を調整
-            fig_width = self.fig.get_figwidth()
-            fig_height = self.fig.get_figheight()
-            aspect_ratio = fig_width / fig_height
-            
-            if aspect_ratio < 1.2:  # 縦長画面
-                font_size = 9
-                # 縦長の場合は上下に配置
-                self.ax1.text(0.5, 0.98, f'[DL] {current_down:.1f} Mbps', 
-                             transform=self.ax1.transAxes, fontsize=font_size, fontweight='bold',
-                             verticalalignment='top', horizontalalignment='center', 
-                             color=download_color, family='monospace',
-                             bbox=dict(boxstyle='round,pad=0.3', facecolor=bg_color, 
-                                     edgecolor=download_color, alpha=0.8))
-                self.ax1.text(0.5, 0.02, f'[UP] {current_up:.1f} Mbps', 
-                             transform=self.ax1.transAxes, fontsize=font_size, fontweight='bold',
-                             verticalalignment='bottom', horizontalalignment='center', 
-                             color=upload_color, family='monospace',
-                             bbox=dict(boxstyle='round,pad=0.3', facecolor=bg_color, 
-                                     edgecolor=upload_color, alpha=0.8))
-                
-                # 外部領域にステータス情報を追加
-                self.add_hacker_status_external()
-            else:  # 横長画面
-                font_size = 11
-                # 横長の場合は左右に配置
-                self.ax1.text(0.02, 0.98, f'[DL] {current_down:.1f} Mbps', 
-                             transform=self.ax1.transAxes, fontsize=font_size, fontweight='bold',
-                             verticalalignment='top', color=download_color, family='monospace',
-                             bbox=dict(boxstyle='round,pad=0.3', facecolor=bg_color, 
-                                     edgecolor=download_color, alpha=0.8))
-                self.ax1.text(0.98, 0.98, f'[UP] {current_up:.1f} Mbps', 
-                             transform=self.ax1.transAxes, fontsize=font_size, fontweight='bold',
-                             verticalalignment='top', horizontalalignment='right', 
-                             color=upload_color, family='monospace',
-                             bbox=dict(boxstyle='round,pad=0.3', facecolor=bg_color, 
-                                     edgecolor=upload_color, alpha=0.8))
-                
-                # 横画面でも外部ステータス情報を表示
-                self.add_hacker_status_external()
+        # アップロード軸の目盛り設定
+        if up_max <= 50:
+            up_ticks = _tick_range(up_max + 5, 5)          # 5Mbps間隔
+        else:
+            up_ticks = _tick_range(up_max + 10, 10)        # 10Mbps間隔
         
-        plt.tight_layout()
+        self.ax1.set_yticks(down_ticks)
+        self.ax2.set_yticks(up_ticks)
+        return True
     
-    def add_hacker_status_vertical(self):
-        """縦画面用のステータス情報を表示"""
-        import datetime
-        
-        # 現在時刻とセッション情報
-        current_time = datetime.datetime.now().strftime("%H:%M:%S")
-        
-        # 統計情報を計算
-        if len(self.download_speeds) > 0:
-            avg_down = sum(self.download_speeds) / len(self.download_speeds)
-            max_down = max(self.download_speeds)
-            avg_up = sum(self.upload_speeds) / len(self.upload_speeds)
-            max_up = max(self.upload_speeds)
-            samples = len(self.download_speeds)
-        else:
-            avg_down = avg_up = max_down = max_up = samples = 0
+    def _update_x_axis(self, timestamps, first_seq):
+        """X軸の範囲と時刻ラベルを更新（変化があれば True）
+
+        範囲は右端に余白を取って固定し、最新のサンプルが余白を使い切るか、
+        最も古いサンプルが範囲より前に戻った（表示ティアの切り替えなど）ときだけ取り直す。
+        目盛りは通し番号の step ごとに置き、ラベルはその番号のサンプルが届いたときに
+        一度だけ付ける（同じ通し番号のサンプルの時刻は変わらない）。
+        それ以外のフレームでは静的レイヤーは変わらず、折れ線と現在値のブリットだけで済む。
+        """
+        n = len(timestamps)
+        last_seq = first_seq + n - 1
+        axis = self._x_axis
+        if (axis is None or axis['tier'] != self.zoom_tier
+                or first_seq < axis['first'] or last_seq > axis['right']):
+            axis = self._x_axis = self._anchor_x_axis(timestamps, first_seq)
+        # ラベルを付けられる目盛り（通し番号のサンプルがバッファにあるもの）を追加
+        labels = axis['labels']
+        for pos in axis['ticks']:
+            if pos not in labels and first_seq <= pos <= last_seq:
+                labels[pos] = datetime.fromtimestamp(
+                    timestamps[pos - first_seq]).strftime(axis['format'])
+        key = (axis['tier'], axis['left'], axis['right'], axis['format'], len(labels))
+        if key == self._x_axis_key:
+            return False
+        self._x_axis_key = key
+        # RTT の段があれば時刻ラベルはその下に付ける（X 軸は ax1 と共有）
+        x_axis = self.ax_lat if self.ax_lat is not None else self.ax1
+        self.ax1.set_xlim(axis['left'], axis['right'] + axis['margin'])
+        x_axis.set_xticks(axis['ticks'])
+        x_axis.set_xticklabels([labels.get(pos, '') for pos in axis['ticks']],
+                               rotation=axis['rotation'], ha='right', fontsize=axis['fontsize'])
+        return True
+
+    def _anchor_x_axis(self, timestamps, first_seq):
+        """現在のデータから X 軸の範囲・目盛り位置・書式を決める"""
+        n = len(timestamps)
+        margin = max(0.5, (n - 1) * 0.05)
+        # 描画中（ブリット）は右端に余白を取り、書き出しではデータの範囲に合わせる
+        slack = max(4, math.ceil(n * 0.1)) if self.blit_manager is not None else 0
+        left = first_seq - margin
+        right = first_seq + n - 1 + slack
         
-        # ステータステキスト
-        status_texts = [
-            f">>> SYS_TIME: {current_time}",
-            f">>> SAMPLES: {samples:03d}",
-            f">>> AVG_DL: {avg_down:.1f} Mbps",
-            f">>> MAX_DL: {max_down:.1f} Mbps", 
-            f">>> AVG_UP: {avg_up:.1f} Mbps",
-            f">>> MAX_UP: {max_up:.1f} Mbps",
-            ">>> STATUS: [OK]",
-            ">>> CONN: STABLE",
-            ">>> PROTO: TCP/IP",
-            ">>> MODE: ACTIVE"
-        ]
+        # ウィンドウサイズに応じてラベル数を動的調整
+        aspect_ratio = self.fig.get_figwidth() / self.fig.get_figheight()
         
-        # 右側に縦に表示（グラフと重ならないように）
-        y_positions = [0.85, 0.80, 0.75, 0.70, 0.65, 0.60, 0.45, 0.40, 0.35, 0.30]
-        colors = ['#58A6FF', '#00FF41', '#00FF41', '#00FF41', '#FF0080', '#FF0080', 
-                 '#00FF41', '#58A6FF', '#58A6FF', '#58A6FF']
+        # 縦長画面では時刻ラベルを減らし、横長画面では増やす
+        if aspect_ratio < 1.2:  # 縦長または正方形
+            max_labels = 4
+            rotation = 90
+            fontsize = 8
+        elif aspect_ratio < 1.8:  # 標準的な横長
+            max_labels = 6
+            rotation = 45
+            fontsize = 9
+        else:  # 超横長
+            max_labels = 8
+            rotation = 45
+            fontsize = 9
         
-        for text, y_pos, color in zip(status_texts, y_positions, colors):
-            self.ax1.text(0.98, y_pos, text, 
-                         transform=self.ax1.transAxes, fontsize=7, fontweight='bold',
-                         verticalalignment='center', horizontalalignment='right',
-                         color=color, family='monospace', alpha=0.8)
+        step = max(1, math.ceil((right - first_seq + 1) / max_labels))
+        ticks = list(range(math.ceil(first_seq / step) * step, math.floor(right) + 1, step))
+        # 1日を超える範囲では日付も表示
+        time_format = '%m/%d %H:%M' if timestamps[-1] - timestamps[0] > 86400 else '%H:%M:%S'
+        return {'tier': self.zoom_tier, 'first': first_seq, 'left': left, 'right': right,
+                'margin': margin, 'ticks': ticks, 'labels': {}, 'format': time_format,
+                'rotation': rotation, 'fontsize': fontsize}
+    
+    def _wants_latency_strip(self, snap):
+        """RTT の段を表示するか（バッチがあるか、プローブが動いている）"""
+        if snap is not None and len(snap.latency):
+            return True
+        return self.collector is not None and self.collector.prober is not None
+    
+    def _update_latency(self, latency, timestamps, first_seq, width_px):
+        """RTT の折れ線・損失マーカー・現在値を更新（Y 軸の範囲が変われば True）"""
+        import numpy as np
+        
+        lat_ts = latency.timestamps
+        rtt = latency.column('rtt')
+        loss = latency.column('loss')
+        # 帯域グラフの X はサンプル番号なので、バッチの時刻をサンプル番号へ補間して重ねる
+        # （最後のサンプルより新しいバッチは平均間隔で外挿、最初より古いものは表示しない）
+        n = len(timestamps)
+        spacing = (timestamps[-1] - timestamps[0]) / (n - 1) if n > 1 else self.test_interval
+        visible = lat_ts >= timestamps[0]
+        lat_ts, rtt, loss = lat_ts[visible], rtt[visible], loss[visible]
+        x = np.interp(lat_ts, timestamps, self._x_index[:n])
+        after = lat_ts > timestamps[-1]
+        x[after] = (n - 1) + (lat_ts[after] - timestamps[-1]) / max(spacing, 1e-9)
+        x += first_seq
+        
+        ok = ~np.isnan(rtt)
+        x_rtt, y_rtt = self._decimate(x[ok], rtt[ok], width_px)
+        self.latency_line.set_data(x_rtt, y_rtt)
+        lost = loss > 0
+        self.loss_markers.set_data(x[lost], np.full(int(lost.sum()), 0.85))
+        
+        if len(latency):
+            last_rtt = latency.latest('rtt')
+            last_jitter = latency.latest('jitter')
+            rtt_text = '-' if math.isnan(last_rtt) else f"{last_rtt:.1f} ms"
+            jitter_text = '-' if math.isnan(last_jitter) else f"{last_jitter:.1f} ms"
+            self.current_latency_text.set_text(
+                f"[RTT] {rtt_text}  JIT {jitter_text}  LOSS {latency.latest('loss') * 100:.0f}%")
+        
+        top = _nice_ceiling(float(y_rtt.max()) * 1.2) if len(y_rtt) else 10.0
+        if top == self._latency_ylim:
+            return False
+        self._latency_ylim = top
+        self.ax_lat.set_ylim(0, top)
+        return True
     
     def setup_layout(self):
-        """画面サイズに応じてレイアウトを設定"""
+        """画面サイズに応じてレイアウトを設定し、描画用アーティストを一度だけ生成"""
         fig_width = self.fig.get_figwidth()
         fig_height = self.fig.get_figheight()
         aspect_ratio = fig_width / fig_height
@@ -347,77 +603,202 @@ class NetworkSpeedMonitor:
         # 既存のaxesがあれば削除
         self.fig.clear()
         
+        # グラフの余白は軸ラベル・目盛り・タイトルの分をインチで取り、図の比率に直して固定する
+        # （tight_layout は twinx と組み合わせると正しく計算できず、描画のたびの計算も要らない）
+        label_w = min(0.9 / fig_width, 0.2)
+        title_h = min(0.6 / fig_height, 0.15)
+        ticks_h = min(0.8 / fig_height, 0.2)
         if aspect_ratio < 1.2:  # 縦長画面
-            # 縦画面：上部にステータス、下部にグラフ（余白なし、間隔少し開ける）
-            gs = self.fig.add_gridspec(2, 1, height_ratios=[1, 3], hspace=0.15, 
-                                     top=0.98, bottom=0.05, left=0.1, right=0.95)
-            self.status_ax = self.fig.add_subplot(gs[0])
-            self.ax1 = self.fig.add_subplot(gs[1])
+            # 縦画面：上部にステータス、下部にグラフ
+            status_gs = self.fig.add_gridspec(1, 1, top=0.98, bottom=0.76, left=0.1, right=0.95)
+            graph_box = dict(top=0.76 - title_h, bottom=ticks_h,
+                             left=label_w, right=1 - label_w)
         else:  # 横長画面
             # 横画面：左側にステータス、右側にグラフ（左端余白なし）
-            gs = self.fig.add_gridspec(1, 2, width_ratios=[1, 3], wspace=0.05,
-                                     top=0.95, bottom=0.1, left=0.02, right=0.98)
-            self.status_ax = self.fig.add_subplot(gs[0])
-            self.ax1 = self.fig.add_subplot(gs[1])
+            status_gs = self.fig.add_gridspec(1, 1, top=0.95, bottom=0.1, left=0.02, right=0.25)
+            graph_box = dict(top=1 - title_h, bottom=ticks_h,
+                             left=0.25 + label_w, right=1 - label_w)
+        self.status_ax = self.fig.add_subplot(status_gs[0])
+        
+        # レイテンシがあればグラフの下に RTT の段を追加（X 軸を共有）
+        if self._wants_latency_strip(self._snapshot):
+            graph_gs = self.fig.add_gridspec(2, 1, height_ratios=[4, 1], hspace=0.08, **graph_box)
+            self.ax1 = self.fig.add_subplot(graph_gs[0])
+            self.ax_lat = self.fig.add_subplot(graph_gs[1], sharex=self.ax1)
+            self.ax1.tick_params(axis='x', labelbottom=False)
+        else:
+            self.ax1 = self.fig.add_subplot(self.fig.add_gridspec(1, 1, **graph_box)[0])
+            self.ax_lat = None
         
         self.ax2 = self.ax1.twinx()
         
         # ステータス軸の設定
-        self.status_ax.set_facecolor('#0D1117')
+        self.status_ax.set_facecolor(BG_COLOR)
         self.status_ax.set_xticks([])
         self.status_ax.set_yticks([])
         for spine in self.status_ax.spines.values():
             spine.set_visible(False)
+        
+        self._style_graph_axes()
+        self._create_graph_artists(aspect_ratio)
+        self._create_status_artists(fig_width, fig_height)
+        
+        # 軸範囲・レイアウトは次の更新で再計算
+        self._y_axes_key = None
+        self._x_axis_key = None
+        self._x_axis = None
+        self._latency_ylim = None
+        self._layout_dirty = True
+        
+        # サンプルごとにブリットするのはグラフの軸の中だけ。ステータスのテキストは
+        # 文字列が変わった行だけ描き直す
+        graph_artists = [self.down_line, self.up_line,
+                         self.current_down_text, self.current_up_text, self.profile_text]
+        if self.ax_lat is not None:
+            graph_artists += [self.latency_line, self.loss_markers, self.current_latency_text]
+        self.animated_artists = graph_artists + self.status_texts
+        if self.blit_manager is not None:
+            self.blit_manager.set_artists(graph_artists, texts=self.status_texts)
     
-    def on_resize(self, event):
-        """ウィンドウリサイズ時の処理"""
-        self.setup_layout()
+    def _style_graph_axes(self):
+        """グラフ軸の静的なスタイルを設定"""
+        # Y軸ラベルを左右に分離し、色を統一
+        self.ax1.set_ylabel('Download Speed (Mbps)', color=DOWNLOAD_COLOR, fontsize=12, fontweight='bold')
+        self.ax2.set_ylabel('Upload Speed (Mbps)', color=UPLOAD_COLOR, fontsize=12, fontweight='bold')
+        
+        # Y軸の目盛りラベルの色を設定
+        self.ax1.tick_params(axis='y', labelcolor=DOWNLOAD_COLOR, labelsize=10, colors=DOWNLOAD_COLOR)
+        self.ax2.tick_params(axis='y', labelcolor=UPLOAD_COLOR, labelsize=10, colors=UPLOAD_COLOR)
+        self.ax1.tick_params(axis='x', labelcolor='#58A6FF', labelsize=9, colors='#58A6FF')
+        
+        # アップロードのY軸ラベルを右側に配置
+        self.ax2.yaxis.set_label_position('right')
+        self.ax2.yaxis.tick_right()
+        
+        # 軸の線を明るくする（枠線として表示）
+        self.ax1.spines['bottom'].set_color('#7FBAFF')  # より濃いブルー
+        self.ax1.spines['left'].set_color('#40FF70')    # より濃いグリーン
+        self.ax1.spines['top'].set_color('#7FBAFF')
+        self.ax1.spines['right'].set_color('#FF40A0')   # より濃いピンク
+        
+        # 軸の線幅を太くする
+        for spine in self.ax1.spines.values():
+            spine.set_linewidth(2)
+        
+        # グリッドと背景
+        self.ax1.grid(True, alpha=0.4, linestyle='-', linewidth=0.8, color='#30363D')
+        self.ax1.grid(True, which='minor', alpha=0.2, linestyle=':', linewidth=0.5, color=GRID_COLOR)
+        self.ax1.minorticks_on()
+        self.ax1.set_facecolor(BG_COLOR)
+        self.fig.patch.set_facecolor(BG_COLOR)
+        
+        # タイトル
+        title = '>>> NETWORK_SPEED_MONITOR'
+        if self.target is not None:
+            title += f' [{self.target}]'
+        self.ax1.set_title(title, fontsize=14, fontweight='bold', 
+                          pad=20, color='#58A6FF', family='monospace')
+        
+        if self.ax_lat is not None:
+            self.ax_lat.set_ylabel('RTT (ms)', color=LATENCY_COLOR, fontsize=10, fontweight='bold')
+            self.ax_lat.tick_params(axis='y', labelcolor=LATENCY_COLOR, labelsize=8,
+                                    colors=LATENCY_COLOR)
+            self.ax_lat.tick_params(axis='x', labelcolor='#58A6FF', labelsize=9, colors='#58A6FF')
+            for spine in self.ax_lat.spines.values():
+                spine.set_color('#7FBAFF')
+                spine.set_linewidth(2)
+            self.ax_lat.grid(True, alpha=0.4, linestyle='-', linewidth=0.8, color='#30363D')
+            self.ax_lat.set_facecolor(BG_COLOR)
     
-    def add_hacker_status_external(self):
-        """外部領域にステータス情報を表示"""
-        import datetime
+    def _create_graph_artists(self, aspect_ratio):
+        """速度の折れ線と現在値テキストを生成"""
+        # ダウンロード速度のプロット
+        self.down_line, = self.ax1.plot([], [], 
+                     color=DOWNLOAD_COLOR, linewidth=2, marker='o', 
+                     markersize=5, markerfacecolor=DOWNLOAD_COLOR, 
+                     markeredgecolor=BG_COLOR, markeredgewidth=1,
+                     label='Download', alpha=0.9)
         
-        # ステータス軸をクリア
-        self.status_ax.clear()
-        self.status_ax.set_facecolor('#0D1117')
-        self.status_ax.set_xticks([])
-        self.status_ax.set_yticks([])
-        for spine in self.status_ax.spines.values():
-            spine.set_visible(False)
+        # アップロード速度のプロット
+        self.up_line, = self.ax2.plot([], [], 
+                     color=UPLOAD_COLOR, linewidth=2, marker='s', 
+                     markersize=5, markerfacecolor=UPLOAD_COLOR, 
+                     markeredgecolor=BG_COLOR, markeredgewidth=1,
+                     label='Upload', alpha=0.9)
+        
+        # 現在の速度を表示 (レスポンシブ対応)
+        if aspect_ratio < 1.2:  # 縦長画面：上下に配置
+            font_size = 9
+            down_pos = dict(x=0.5, y=0.98, verticalalignment='top', horizontalalignment='center')
+            up_pos = dict(x=0.5, y=0.02, verticalalignment='bottom', horizontalalignment='center')
+        else:  # 横長画面：左右に配置
+            font_size = 11
+            down_pos = dict(x=0.02, y=0.98, verticalalignment='top', horizontalalignment='left')
+            up_pos = dict(x=0.98, y=0.98, verticalalignment='top', horizontalalignment='right')
+        
+        # twinx の上に重ねるため、テキストは ax2 に置く
+        self.current_down_text = self.ax2.text(
+            s='', transform=self.ax1.transAxes, fontsize=font_size, fontweight='bold',
+            color=DOWNLOAD_COLOR, family='monospace',
+            bbox=dict(boxstyle='round,pad=0.3', facecolor=BG_COLOR,
+                      edgecolor=DOWNLOAD_COLOR, alpha=0.8),
+            **down_pos)
+        self.current_up_text = self.ax2.text(
+            s='', transform=self.ax1.transAxes, fontsize=font_size, fontweight='bold',
+            color=UPLOAD_COLOR, family='monospace',
+            bbox=dict(boxstyle='round,pad=0.3', facecolor=BG_COLOR,
+                      edgecolor=UPLOAD_COLOR, alpha=0.8),
+            **up_pos)
         
-        # 現在時刻とセッション情報
-        current_time = datetime.datetime.now().strftime("%H:%M:%S")
+        # スパン集計パネル（p キーで表示切り替え）
+        self.profile_text = self.ax2.text(
+            0.02, 0.02, '', transform=self.ax1.transAxes, fontsize=7,
+            verticalalignment='bottom', horizontalalignment='left',
+            color='#58A6FF', family='monospace', visible=self.show_profile,
+            bbox=dict(boxstyle='round,pad=0.3', facecolor=BG_COLOR,
+                      edgecolor='#58A6FF', alpha=0.8))
         
-        # 統計情報を計算
-        if len(self.download_speeds) > 0:
-            avg_down = sum(self.download_speeds) / len(self.download_speeds)
-            max_down = max(self.download_speeds)
-            avg_up = sum(self.upload_speeds) / len(self.upload_speeds)
-            max_up = max(self.upload_speeds)
-            samples = len(self.download_speeds)
+        if self.ax_lat is not None:
+            # RTT の折れ線と損失マーカー（損失は段の上部に × を並べる）
+            self.latency_line, = self.ax_lat.plot([], [], color=LATENCY_COLOR, linewidth=1.2,
+                                                  alpha=0.9, label='RTT')
+            self.loss_markers, = self.ax_lat.plot([], [], linestyle='None', marker='x',
+                                                  color='#FF5555', markersize=5,
+                                                  transform=self.ax_lat.get_xaxis_transform())
+            self.current_latency_text = self.ax_lat.text(
+                0.01, 0.92, '', transform=self.ax_lat.transAxes, fontsize=8, fontweight='bold',
+                verticalalignment='top', horizontalalignment='left',
+                color=LATENCY_COLOR, family='monospace',
+                bbox=dict(boxstyle='round,pad=0.2', facecolor=BG_COLOR,
+                          edgecolor=LATENCY_COLOR, alpha=0.8))
+    
+    def on_resize(self, event):
+        """ウィンドウリサイズ時の処理"""
+        self.setup_layout()
+        self.update_graph()
+    
+    def on_key(self, event):
+        """z キーで表示ティア（raw → 1分 → 10分 → 1時間）、p キーでスパン集計パネルを切り替え"""
+        if event.key == 'z':
+            names = self.tiers.tier_names()
+            self.zoom_tier = names[(names.index(self.zoom_tier) + 1) % len(names)]
+            print(f"View: {self.zoom_tier}")
+        elif event.key == 'p':
+            self.show_profile = not self.show_profile
+            self.profile_text.set_visible(self.show_profile)
+            if self.show_profile and not recorder.enabled:
+                # --instrument なしで起動していても、ここから記録を始める
+                recorder.enable()
+                print("Span timers enabled")
         else:
-            avg_down = avg_up = max_down = max_up = samples = 0
+            return
+        self.update_graph()
+    
+    def _create_status_artists(self, fig_width, fig_height):
+        """ステータス領域の枠とテキストを生成（テキストは更新時に set_text のみ）"""
+        from matplotlib.patches import Rectangle
         
-        # カテゴリ別にASCIIアイコン付きステータステキスト
-        status_texts = [
-            # システム情報（青系）
-            f"[T] SYS_TIME: {current_time}",
-            f"[#] SAMPLES: {samples:03d}",
-            
-            # ダウンロード統計（緑系）
-            f"[↓] AVG_DL: {avg_down:.1f} Mbps",
-            f"[▲] MAX_DL: {max_down:.1f} Mbps",
-            
-            # アップロード統計（ピンク系）
-            f"[↑] AVG_UP: {avg_up:.1f} Mbps",
-            f"[△] MAX_UP: {max_up:.1f} Mbps",
-            
-            # 接続ステータス（青系）
-            f"[✓] STATUS: [OK]",
-            f"[~] CONN: STABLE",
-            f"[N] PROTO: TCP/IP",
-            f"[*] MODE: ACTIVE"
-        ]
+        aspect_ratio = fig_width / fig_height
         
         # カテゴリ別色分け
         colors = [
@@ -427,23 +808,11 @@ class NetworkSpeedMonitor:
             '#58A6FF', '#58A6FF', '#58A6FF', '#58A6FF'  # 接続ステータス（青）
         ]
         
-        # 画面の向きに応じて配置
-        fig_width = self.fig.get_figwidth()
-        fig_height = self.fig.get_figheight()
-        aspect_ratio = fig_width / fig_height
-        
-        if aspect_ratio < 1.2:  # 縦長画面：横に並べる
-            x_positions = [0.05, 0.55, 0.05, 0.55, 0.05, 0.55, 0.05, 0.55, 0.05, 0.55]
-            y_positions = [0.85, 0.85, 0.65, 0.65, 0.45, 0.45, 0.25, 0.25, 0.05, 0.05]
-        else:  # 横長画面：縦に並べる（左端余白を削減）
-            x_positions = [0.02] * 10
-            y_positions = [0.95 - i * 0.09 for i in range(10)]
-        
-        # カテゴリごとに枠で囲んで表示
+        # カテゴリごとに枠で囲んで表示（テキスト数, 色, 名前）
         categories = [
-            (status_texts[0:2], colors[0:2], "SYSTEM"),          # システム情報
-            (status_texts[2:6], colors[2:6], "SPEED_STATS"),     # 速度統計（ダウンロード+アップロード）
-            (status_texts[6:10], colors[6:10], "CONNECTION")     # 接続ステータス
+            (2, colors[0:2], "SYSTEM"),          # システム情報
+            (4, colors[2:6], "SPEED_STATS"),     # 速度統計（ダウンロード+アップロード）
+            (4, colors[6:10], "CONNECTION")      # 接続ステータス
         ]
         
         if aspect_ratio < 1.2:  # 縦長画面
@@ -460,11 +829,12 @@ class NetworkSpeedMonitor:
                 cat_positions = [(0.02, 0.70), (0.02, 0.40), (0.02, 0.10)]
                 box_width, box_height = 0.95, 0.25
         
-        for (cat_texts, cat_colors, cat_name), (box_x, box_y) in zip(categories, cat_positions):
+        self.status_texts = []
+        for (count, cat_colors, cat_name), (box_x, box_y) in zip(categories, cat_positions):
             # カテゴリボックスを描画
-            rect = plt.Rectangle((box_x, box_y), box_width, box_height, 
-                               linewidth=1, edgecolor=cat_colors[0], facecolor='none',
-                               transform=self.status_ax.transAxes, alpha=0.6)
+            rect = Rectangle((box_x, box_y), box_width, box_height, 
+                             linewidth=1, edgecolor=cat_colors[0], facecolor='none',
+                             transform=self.status_ax.transAxes, alpha=0.6)
             self.status_ax.add_patch(rect)
             
             # カテゴリタイトル
@@ -473,57 +843,233 @@ class NetworkSpeedMonitor:
                                color=cat_colors[0], family='monospace', alpha=0.8)
             
             # カテゴリ内のテキスト
-            for i, (text, color) in enumerate(zip(cat_texts, cat_colors)):
+            for i, color in enumerate(cat_colors):
                 if aspect_ratio < 1.2:  # 縦長画面
                     text_y = box_y + box_height - 0.08 - i * 0.06
-                    text_x = box_x + 0.02
                 else:  # 横長画面
                     text_y = box_y + box_height - 0.06 - i * 0.05
-                    text_x = box_x + 0.02
+                text_x = box_x + 0.02
                     
-                self.status_ax.text(text_x, text_y, text,
-                                   transform=self.status_ax.transAxes, fontsize=9, fontweight='bold',
-                                   verticalalignment='center', color=color, family='monospace',
-                                   alpha=0.9)
+                self.status_texts.append(
+                    self.status_ax.text(text_x, text_y, '',
+                                       transform=self.status_ax.transAxes, fontsize=9, fontweight='bold',
+                                       verticalalignment='center', color=color, family='monospace',
+                                       alpha=0.9))
+    
+    def add_hacker_status_external(self, snap=None):
+        """外部領域のステータス情報を更新（snap は描画中のスナップショット）"""
+        # 現在時刻とセッション情報（描画はデータが変わるか分が変わったときだけなので分単位）
+        current_time = datetime.now().strftime("%H:%M")
+        
+        # 統計情報・接続状態は公開済みのスナップショットを参照するだけ
+        snap = snap if snap is not None else self._snapshot
+        if snap is None:
+            return
+        down_stats = snap.samples.stats('download')
+        up_stats = snap.samples.stats('upload')
+        avg_down, max_down = down_stats['mean'], down_stats['max']
+        avg_up, max_up = up_stats['mean'], up_stats['max']
+        samples = down_stats['count']
+        status, conn, code = snap.status
+        
+        # カテゴリ別にASCIIアイコン付きステータステキスト
+        status_texts = [
+            # システム情報（青系）
+            f"[T] SYS_TIME: {current_time}",
+            f"[#] SAMPLES: {samples:03d}",
+            
+            # ダウンロード統計（緑系）
+            f"[↓] AVG_DL: {avg_down:.1f} Mbps",
+            f"[▲] MAX_DL: {max_down:.1f} Mbps",
+            
+            # アップロード統計（ピンク系）
+            f"[↑] AVG_UP: {avg_up:.1f} Mbps",
+            f"[△] MAX_UP: {max_up:.1f} Mbps",
+            
+            # 接続ステータス（青系）
+            f"[{'✓' if code <= 0 else '!'}] STATUS: [{status}]",
+            f"[~] CONN: {conn}",
+            f"[N] PROTO: TCP/IP",
+            f"[*] MODE: {'VIEW' if self.view_only else 'ACTIVE'}"
+        ]
+        
+        for artist, text in zip(self.status_texts, status_texts):
+            artist.set_text(text)
+        # 異常時は STATUS の色を変える
+        self.status_texts[6].set_color(STATUS_COLORS.get(code, STATUS_COLORS[0]))
+        
+    def render(self, fig):
+        """ウィンドウを開かずに fig（Agg などの Figure）へ現在のデータを描画"""
+        self.fig = fig
+        self.blit_manager = None
+        self.setup_layout()
+        self.update_graph()
+        return fig
         
     def start_monitoring(self):
-        """監視を開始"""
-        self.running = True
+        """監視を開始（view_only の場合は表示のみ）"""
+        import matplotlib.pyplot as plt
         
         # ナビゲーションバーを非表示にする
         plt.rcParams['toolbar'] = 'None'
         
         # 画面サイズに応じてレイアウトを決定
         self.fig = plt.figure(figsize=(12, 6))
+        self.blit_manager = BlitManager(self.fig.canvas)
         
         # レイアウトの初期化（後でリサイズ時に調整）
         self.setup_layout()
         
         # ウィンドウのタイトルを設定 
-        self.fig.canvas.manager.set_window_title('>>> NETWORK_SPEED_MONITOR')
+        title = '>>> NETWORK_SPEED_MONITOR'
+        if self.target is not None:
+            title += f' [{self.target}]'
+        self.fig.canvas.manager.set_window_title(title)
         
         # リサイズイベントを監視
         self.fig.canvas.mpl_connect('resize_event', self.on_resize)
+        self.fig.canvas.mpl_connect('key_press_event', self.on_key)
         
-        test_thread = threading.Thread(target=self.speed_test_worker, daemon=True)
-        test_thread.start()
+        if self.collector is not None:
+            self.collector.start()
         
-        ani = animation.FuncAnimation(self.fig, self.update_graph, interval=5000, cache_frame_data=False)
+        # 動的レイヤーだけをブリットで更新するタイマー
+        self.timer = self.fig.canvas.new_timer(interval=5000)
+        self.timer.add_callback(self.update_graph)
+        self.timer.start()
         
         plt.show()
         
     def stop_monitoring(self):
         """監視を停止"""
-        self.running = False
+        if self.collector is not None:
+            self.collector.stop_monitoring()
+        if self.reader is not None:
+            self.reader.close()
+        if self.latency_reader is not None:
+            self.latency_reader.close()
+
+def print_stats(data_file, max_points, target=None):
+    """履歴の統計を表示（numpy / matplotlib は読み込まない）"""
+    reader = open_history_reader(data_file)
+    try:
+        entries = reader.tail(max_points, target=target)
+    finally:
+        reader.close()
+    if not entries:
+        print(f"No history in {data_file}")
+        return
+    downloads = [entry['download'] for entry in entries]
+    uploads = [entry['upload'] for entry in entries]
+    print(f"Samples : {len(entries)} ({entries[0]['timestamp']} - {entries[-1]['timestamp']})")
+    print(f"Download: avg {sum(downloads) / len(downloads):.2f} / "
+          f"min {min(downloads):.2f} / max {max(downloads):.2f} Mbps")
+    print(f"Upload  : avg {sum(uploads) / len(uploads):.2f} / "
+          f"min {min(uploads):.2f} / max {max(uploads):.2f} Mbps")
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Network speed monitor")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--headless', action='store_true',
+                      help="measure and record without opening a window")
+    mode.add_argument('--view', action='store_true',
+                      help="only display the history written by a headless collector")
+    mode.add_argument('--once', action='store_true',
+                      help="run a single measurement, print it and exit")
+    mode.add_argument('--stats', action='store_true',
+                      help="print statistics of the recorded history and exit")
+    mode.add_argument('--export', metavar='DIR',
+                      help="render the history to PNG/SVG and an HTML report in DIR and exit")
+    parser.add_argument('--interval', type=float, default=10,
+                        help="measurement interval in seconds (default: 10)")
+    parser.add_argument('--data-file', default=DEFAULT_HISTORY_FILE,
+                        help=f"history store path, .jsonl, .db or .bin (default: {DEFAULT_HISTORY_FILE})")
+    parser.add_argument('--target',
+                        help="show only the series of this target (history written by multi_probe.py)")
+    parser.add_argument('--compare', nargs='*', metavar='TARGET',
+                        help="show several targets side by side (all targets when none are "
+                             "given); use with an aggregator URL or a multi-target history")
+    parser.add_argument('--layout', choices=('grid', 'overlay'), default='grid',
+                        help="--compare layout, toggled with the 'l' key (default: grid)")
+    parser.add_argument('--window-hours', type=float,
+                        help="--compare time window in hours (default: whole buffer)")
+    parser.add_argument('--max-points', type=int, default=8640,
+                        help="number of points kept for the graph (default: 8640)")
+    parser.add_argument('--cache-file', default=DEFAULT_CACHE_FILE,
+                        help=f"speedtest server cache path (default: {DEFAULT_CACHE_FILE})")
+    add_engine_arguments(parser)
+    # collector を読み込んでも重いモジュールは読み込まれない
+    from collector import add_metrics_arguments, add_push_arguments, add_schedule_arguments
+    add_schedule_arguments(parser)
+    add_metrics_arguments(parser)
+    add_probe_arguments(parser)
+    add_push_arguments(parser)
+    add_instrument_arguments(parser)
+    from dashboard_export import add_export_arguments
+    add_export_arguments(parser)
+    return parser
+
 
 if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    
+    if args.headless:
+        import collector
+        collector.run(args)
+        raise SystemExit(0)
+    
+    if args.stats:
+        print_stats(args.data_file, args.max_points, args.target)
+        raise SystemExit(0)
+    
+    if args.export:
+        from dashboard_export import export_from_args
+        export_from_args(args, args.export, [args.data_file], [args.target])
+        raise SystemExit(0)
+    
+    if args.once:
+        from collector import SpeedCollector
+        engine = engine_from_args(args, args.cache_file)
+        result = SpeedCollector(data_file=args.data_file, engine=engine).measure_once()
+        if result is None:
+            raise SystemExit(1)
+        timestamp, download, upload = result
+        print(f"{timestamp.strftime('%H:%M:%S')} - Down: {download:.2f} Mbps, Up: {upload:.2f} Mbps")
+        raise SystemExit(0)
+    
+    if args.compare is not None:
+        from multi_view import MultiTargetView
+        view = MultiTargetView(args.data_file, targets=args.compare,
+                               max_data_points=args.max_points, layout=args.layout,
+                               window_hours=args.window_hours)
+        print(f"Comparing {len(view.buffers)} targets from {args.data_file}")
+        try:
+            run_instrumented(args, view.start_monitoring)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            view.stop_monitoring()
+        raise SystemExit(0)
+    
     print("Network Speed Monitor starting...")
-    print("Testing initial connection...")
+    if not args.view:
+        print("Testing initial connection...")
     
-    monitor = NetworkSpeedMonitor(max_data_points=8640, test_interval=10)
+    from collector import collector_options, metrics_from_args, pusher_from_args
+    engine = None if args.view else engine_from_args(args, args.cache_file)
+    options = collector_options(args)
+    if not args.view:
+        options['metrics'] = metrics_from_args(args)
+        options['prober'] = prober_from_args(args, args.data_file)
+        options['pusher'] = pusher_from_args(args)
+    monitor = NetworkSpeedMonitor(max_data_points=args.max_points, test_interval=args.interval,
+                                  data_file=args.data_file, view_only=args.view, engine=engine,
+                                  target=args.target, collector_options=options)
     
     try:
-        monitor.start_monitoring()
+        run_instrumented(args, monitor.start_monitoring)
     except KeyboardInterrupt:
         print("\nStopping monitor...")
-        monitor.stop_monitoring()
\ No newline at end of file
+    finally:
+        monitor.stop_monitoring()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""NumPy ベースの列指向リングバッファ
+
+タイムスタンプ（epoch 秒, float64）と速度などの列（float32）を
+事前確保した配列に格納し、古い順に並んだ連続ビューをコピーなしで返す。
+snapshot() は別スレッドの描画側へ渡せる読み取り専用のビューを O(1) で作る。
+"""
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+
+class ColumnAggregates:
+    """1列分の集計値を追記・削除ごとに O(1)（償却）で更新する"""
+
+    def __init__(self, rolling_window):
+        self.rolling_window = rolling_window
+        self.count = 0
+        self.sum = 0.0
+        self.rolling_sum = 0.0
+        # (通し番号, 値) の単調キューで窓内の最大・最小を保持
+        self._max_queue = deque()
+        self._min_queue = deque()
+
+    def push(self, seq, value):
+        self.count += 1
+        self.sum += value
+        self.rolling_sum += value
+        while self._max_queue and self._max_queue[-1][1] <= value:
+            self._max_queue.pop()
+        self._max_queue.append((seq, value))
+        while self._min_queue and self._min_queue[-1][1] >= value:
+            self._min_queue.pop()
+        self._min_queue.append((seq, value))
+
+    def evict(self, seq, value):
+        """通し番号 seq の値が窓から外れた"""
+        self.count -= 1
+        self.sum -= value
+        if self._max_queue and self._max_queue[0][0] <= seq:
+            self._max_queue.popleft()
+        if self._min_queue and self._min_queue[0][0] <= seq:
+            self._min_queue.popleft()
+
+    def leave_rolling(self, value):
+        """移動平均の窓から値が外れた"""
+        self.rolling_sum -= value
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    @property
+    def max(self):
+        return self._max_queue[0][1] if self._max_queue else 0.0
+
+    @property
+    def min(self):
+        return self._min_queue[0][1] if self._min_queue else 0.0
+
+    def rolling_mean(self, count):
+        n = min(count, self.rolling_window)
+        return self.rolling_sum / n if n else 0.0
+
+    @classmethod
+    def from_values(cls, rolling_window, values, first_seq):
+        """窓内の値（古い順、先頭の通し番号 first_seq）から push を繰り返したのと同じ状態を作る"""
+        agg = cls(rolling_window)
+        n = len(values)
+        if not n:
+            return agg
+        values = np.asarray(values, dtype=np.float64)
+        agg.count = n
+        agg.sum = float(values.sum())
+        agg.rolling_sum = float(values[-rolling_window:].sum())
+        # 単調キューに残るのは、それより後のどの値よりも大きい（小さい）値だけ
+        seqs = np.arange(first_seq, first_seq + n)
+        for queue, accumulate, better in ((agg._max_queue, np.maximum, np.greater),
+                                          (agg._min_queue, np.minimum, np.less)):
+            later = accumulate.accumulate(values[::-1])[::-1]
+            keep = np.ones(n, dtype=bool)
+            keep[:-1] = better(values[:-1], later[1:])
+            queue.extend(zip(seqs[keep].tolist(), values[keep].tolist()))
+        return agg
+
+
+class BufferSnapshot:
+    """SampleBuffer のある時点の読み取り専用ビュー（version は追記ごとに増える）
+
+    first_seq は先頭（最も古い）サンプルの通し番号。i 番目のサンプルの通し番号は
+    first_seq + i で、追記や容量からの削除があっても同じサンプルの番号は変わらない。
+    """
+    __slots__ = ('version', 'first_seq', 'timestamps', '_columns', '_stats')
+
+    def __init__(self, version, timestamps, columns, stats, first_seq=0):
+        self.version = version
+        self.first_seq = first_seq
+        self.timestamps = timestamps
+        self._columns = columns
+        self._stats = stats
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def column(self, name):
+        return self._columns[name]
+
+    def latest(self, name):
+        if not len(self):
+            return None
+        return float(self._columns[name][-1])
+
+    def latest_timestamp(self):
+        if not len(self):
+            return None
+        return float(self.timestamps[-1])
+
+    def stats(self, name):
+        return self._stats[name]
+
+
+def _frozen(view):
+    view.flags.writeable = False
+    return view
+
+
+class SampleBuffer:
+    """固定容量の列指向サンプルバッファ
+
+    容量の 1/4 分の余白を持つ線形配列に追記し、末尾に達したら
+    直近 capacity 件を新しい配列の先頭へ詰め直す（償却 O(1)）。これにより
+    timestamps / column() は常に古い順の連続ビューとして返せる。
+
+    追記は常に公開済みの範囲より後ろへ書き、詰め直し・clear では配列ごと
+    取り替えるので、snapshot() が返したビューの中身はその後も変わらない。
+    書き込みは1スレッド（または呼び出し側のロック下）で行うこと。
+    """
+
+    def __init__(self, capacity, columns=('download', 'upload'), rolling_window=30):
+        self.capacity = capacity
+        self.columns = tuple(columns)
+        # 容量より長い窓は意味がない（窓から外れる前に容量から外れてしまう）
+        self.rolling_window = min(rolling_window, capacity)
+        self._size = capacity + max(1, capacity // 4)
+        self._ts = np.zeros(self._size, dtype=np.float64)
+        self._data = {name: np.zeros(self._size, dtype=np.float32) for name in self.columns}
+        self._start = 0
+        self._end = 0
+        self._seq = 0  # 追記の通し番号（最新サンプルの番号 + 1）
+        self.version = 0  # 追記・clear ごとに増える（clear でも戻らない）
+        self._aggregates = {name: ColumnAggregates(self.rolling_window) for name in self.columns}
+
+    def __len__(self):
+        return self._end - self._start
+
+    def _compact(self):
+        """直近のデータを新しい配列の先頭へ詰め直す（スナップショットが参照する古い配列は書き換えない）"""
+        n = self._end - self._start
+        ts = np.zeros(self._size, dtype=np.float64)
+        ts[:n] = self._ts[self._start:self._end]
+        self._ts = ts
+        for name, arr in self._data.items():
+            new = np.zeros(self._size, dtype=np.float32)
+            new[:n] = arr[self._start:self._end]
+            self._data[name] = new
+        self._start, self._end = 0, n
+        # 累積和の丸め誤差をここでリセット
+        for name, arr in self._data.items():
+            agg = self._aggregates[name]
+            agg.sum = float(arr[:n].sum(dtype=np.float64))
+            agg.rolling_sum = float(arr[max(0, n - self.rolling_window):n].sum(dtype=np.float64))
+
+    def append(self, timestamp, *values):
+        """1サンプル追記（timestamp は datetime または epoch 秒、values は columns の順）"""
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.timestamp()
+        if self._end == self._size:
+            self._compact()
+
+        # 移動平均の窓から外れる値があるか（容量からの削除より前の件数で判定）
+        leaving = len(self) >= self.rolling_window
+        # 容量を超える分を集計から外す
+        if len(self) == self.capacity:
+            evicted_seq = self._seq - self.capacity
+            for name in self.columns:
+                self._aggregates[name].evict(evicted_seq, float(self._data[name][self._start]))
+            self._start += 1
+
+        idx = self._end
+        self._ts[idx] = timestamp
+        for name, value in zip(self.columns, values):
+            arr = self._data[name]
+            arr[idx] = value
+            # 集計は格納後（float32 に丸めた）値で行う
+            stored = float(arr[idx])
+            agg = self._aggregates[name]
+            agg.push(self._seq, stored)
+            if leaving:
+                agg.leave_rolling(float(arr[idx - self.rolling_window]))
+        self._end += 1
+        self._seq += 1
+        self.version += 1
+
+    def extend(self, timestamps, *columns):
+        """複数サンプルをまとめて追記（timestamps は epoch 秒の配列、columns は columns の順の配列）
+
+        append を繰り返したのと同じ内容になる。直近 capacity 件を新しい配列へ詰め直し、
+        集計値は numpy でまとめて作り直す（O(capacity)、行ごとの Python の処理はない）。
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        k = len(timestamps)
+        if not k:
+            return
+        added = min(k, self.capacity)
+        kept = min(len(self), self.capacity - added)
+        n = kept + added
+        # 詰め直しと同じく配列ごと取り替える（公開済みのビューは変わらない）
+        ts = np.zeros(self._size, dtype=np.float64)
+        ts[:kept] = self._ts[self._end - kept:self._end]
+        ts[kept:n] = timestamps[k - added:]
+        data = {}
+        for name, values in zip(self.columns, columns):
+            arr = np.zeros(self._size, dtype=np.float32)
+            arr[:kept] = self._data[name][self._end - kept:self._end]
+            arr[kept:n] = np.asarray(values)[k - added:]
+            data[name] = arr
+        self._ts, self._data = ts, data
+        self._start, self._end = 0, n
+        self._seq += k
+        self.version += k
+        self._aggregates = {
+            name: ColumnAggregates.from_values(self.rolling_window, arr[:n], self._seq - n)
+            for name, arr in data.items()}
+
+    def clear(self):
+        self._ts = np.zeros(self._size, dtype=np.float64)
+        self._data = {name: np.zeros(self._size, dtype=np.float32) for name in self.columns}
+        self._start = self._end = 0
+        self._seq = 0
+        self.version += 1
+        self._aggregates = {name: ColumnAggregates(self.rolling_window) for name in self.columns}
+
+    def snapshot(self):
+        """現在の内容の読み取り専用ビューと集計値（O(列数)、データはコピーしない）"""
+        start, end = self._start, self._end
+        return BufferSnapshot(
+            self.version,
+            _frozen(self._ts[start:end]),
+            {name: _frozen(arr[start:end]) for name, arr in self._data.items()},
+            {name: self.stats(name) for name in self.columns},
+            self._seq - (end - start))
+
+    @property
+    def timestamps(self):
+        """タイムスタンプ（epoch 秒）の古い順ビュー"""
+        return self._ts[self._start:self._end]
+
+    def column(self, name):
+        """列の古い順ビュー"""
+        return self._data[name][self._start:self._end]
+
+    def latest(self, name):
+        """列の最新値"""
+        if not len(self):
+            return None
+        return float(self._data[name][self._end - 1])
+
+    def latest_timestamp(self):
+        if not len(self):
+            return None
+        return float(self._ts[self._end - 1])
+
+    def stats(self, name):
+        """列の集計値（count, mean, max, min, rolling_mean）"""
+        agg = self._aggregates[name]
+        return {
+            'count': agg.count,
+            'sum': agg.sum,
+            'mean': agg.mean,
+            'max': agg.max,
+            'min': agg.min,
+            'rolling_mean': agg.rolling_mean(agg.count),
+        }
+
+    def nbytes(self):
+        """確保済み配列のバイト数"""
+        return self._ts.nbytes + sum(arr.nbytes for arr in self._data.values())
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""測定スケジューラ
+
+- FixedRateScheduler: 単調時計で start + k * interval に揃えて実行（ドリフトしない）
+- AdaptiveScheduler: 軽いレイテンシ測定を高頻度で行い、異常時と低頻度の
+  ベースライン周期でだけ帯域測定を行う
+
+どちらも threading.Event で即座に停止できる。
+"""
+import math
+import random
+import threading
+import time
+
+
+class FixedRateScheduler:
+    """固定レートのティック
+
+    処理時間が間隔を超えた場合は取りこぼしたティックを飛ばし、
+    まとめて連続実行しない。jitter は間隔に対する割合（0.1 なら ±10%）。
+    """
+
+    def __init__(self, interval, jitter=0.0, stop_event=None, clock=time.monotonic):
+        self.interval = interval
+        self.jitter = jitter
+        self.stop_event = stop_event if stop_event is not None else threading.Event()
+        self.clock = clock
+        self._start = clock()
+        self._tick = 0
+        self.last_lag = 0.0  # 予定時刻からの遅れ（秒）
+        self.skipped = 0
+
+    def _scheduled(self, tick):
+        return self._start + tick * self.interval
+
+    def wait_next(self, min_delay=0.0):
+        """次のティックまで待つ。停止要求があれば False
+
+        min_delay（バックオフなど）があれば、その時間が経つまでのティックは飛ばす。
+        """
+        now = self.clock()
+        earliest = now + min_delay
+        self._tick += 1
+        if self.interval <= 0:
+            # 間隔 0 は待たずに続けて実行（ベンチマークなど）
+            target = earliest
+        else:
+            # 過ぎてしまったティックは飛ばす
+            behind = earliest - self._scheduled(self._tick)
+            if behind > 0:
+                skip = math.ceil(behind / self.interval)
+                self._tick += skip
+                self.skipped += skip
+            target = self._scheduled(self._tick)
+        if self.jitter:
+            target += random.uniform(-self.jitter, self.jitter) * self.interval
+            target = max(target, earliest)
+        if self.stop_event.wait(max(0.0, target - now)):
+            return False
+        self.last_lag = max(0.0, self.clock() - target)
+        return True
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class AdaptiveScheduler:
+    """レイテンシの変化に応じて帯域測定を行うスケジューラ
+
+    - probe_interval ごとにレイテンシを測定（probe() は ms または失敗時 None を返す）。
+      can_probe() が False の間（speedtest のサーバーが未選択など、測る接続先がない）は
+      測定せず、失敗とも数えない
+    - 次の場合に帯域測定（run_test()）を実行する
+        * baseline_interval が経過した
+        * レイテンシが EWMA から latency_factor 倍以上かつ latency_margin_ms 以上悪化、
+          または測定が failure_threshold 回続けて失敗した
+          （前回の帯域測定から min_test_gap 以上経っている場合のみ）
+        * 前回の帯域測定が EWMA の throughput_drop 倍を下回った（min_test_gap 後に再確認）
+    """
+
+    def __init__(self, probe, run_test, probe_interval=2.0, baseline_interval=600.0,
+                 min_test_gap=60.0, latency_factor=2.0, latency_margin_ms=20.0,
+                 throughput_drop=0.5, alpha=0.1, jitter=0.1, stop_event=None,
+                 clock=time.monotonic, can_probe=None, failure_threshold=3):
+        self.probe = probe
+        self.run_test = run_test
+        self.can_probe = can_probe
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.baseline_interval = baseline_interval
+        self.min_test_gap = min_test_gap
+        self.latency_factor = latency_factor
+        self.latency_margin_ms = latency_margin_ms
+        self.throughput_drop = throughput_drop
+        self.alpha = alpha
+        self.clock = clock
+        self.ticker = FixedRateScheduler(probe_interval, jitter=jitter,
+                                         stop_event=stop_event, clock=clock)
+        self.stop_event = self.ticker.stop_event
+        self.latency_ewma = None
+        self.download_ewma = None
+        self.last_test = None
+        self.next_baseline = clock()  # 起動直後に1回測定
+        self.probes = 0
+        self.probe_failures = 0  # 連続した失敗の回数
+        self.tests = 0
+
+    @property
+    def last_lag(self):
+        return self.ticker.last_lag
+
+    def observe_latency(self, rtt_ms):
+        """レイテンシを記録し、異常なら理由を返す"""
+        self.probes += 1
+        if rtt_ms is None:
+            # 1回の損失では測らず、続けて失敗したときだけ回線の異常とみなす
+            self.probe_failures += 1
+            if self.probe_failures < self.failure_threshold:
+                return None
+            return f'{self.probe_failures} consecutive probe failures'
+        self.probe_failures = 0
+        if self.latency_ewma is None:
+            self.latency_ewma = rtt_ms
+            return None
+        threshold = max(self.latency_ewma * self.latency_factor,
+                        self.latency_ewma + self.latency_margin_ms)
+        anomaly = rtt_ms > threshold
+        # 異常値で基準が引きずられないよう、正常時のみ EWMA を更新
+        if not anomaly:
+            self.latency_ewma += self.alpha * (rtt_ms - self.latency_ewma)
+            return None
+        return f'latency {rtt_ms:.1f} ms (baseline {self.latency_ewma:.1f} ms)'
+
+    def observe_throughput(self, download):
+        """帯域測定の結果を記録し、低下していれば再確認を早める"""
+        if download is None:
+            return
+        if self.download_ewma is not None and download < self.download_ewma * self.throughput_drop:
+            self.next_baseline = min(self.next_baseline, self.clock() + self.min_test_gap)
+            return
+        if self.download_ewma is None:
+            self.download_ewma = download
+        else:
+            self.download_ewma += self.alpha * (download - self.download_ewma)
+
+    def should_test(self, reason):
+        """今回のティックで帯域測定を行うかどうか"""
+        now = self.clock()
+        if now >= self.next_baseline:
+            return True
+        if reason is None:
+            return False
+        return self.last_test is None or now - self.last_test >= self.min_test_gap
+
+    def _test(self, reason):
+        if reason:
+            print(f"Escalating to bandwidth test: {reason}")
+        self.tests += 1
+        self.last_test = self.clock()
+        self.next_baseline = self.last_test + self.baseline_interval
+        self.observe_throughput(self.run_test())
+
+    def run(self, backoff=None):
+        """停止要求まで繰り返す（backoff() は帯域測定を控える残り秒数）"""
+        while not self.stop_event.is_set():
+            if self.can_probe is None or self.can_probe():
+                reason = self.observe_latency(self.probe())
+            else:
+                # 接続先がない（ベースラインの帯域測定で決まるまで待つ）
+                reason = None
+            if self.should_test(reason) and not (backoff and backoff() > 0):
+                self._test(reason)
+            if not self.ticker.wait_next():
+                return
+
+    def stop(self):
+        self.stop_event.set()
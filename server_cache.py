@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""speedtest.net の設定・サーバー選択キャッシュ
+
+毎回の get_best_server（候補サーバー全体へのレイテンシ測定）と、
+エラー時の設定・サーバー一覧の再取得を避けるため、
+設定 / 近傍サーバー一覧 / 最速サーバーをディスクに保存して再利用する。
+"""
+import json
+import os
+import time
+
+from instrumentation import span
+
+DEFAULT_CACHE_FILE = "speedtest_cache.json"
+
+
+class ServerCache:
+    """設定とサーバー選択を TTL 付きで保存する"""
+
+    def __init__(self, path=DEFAULT_CACHE_FILE, ttl=24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self.data = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+
+    def save(self):
+        """一時ファイルに書いてから置き換える（書きかけのキャッシュを残さない）"""
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self.data, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Server cache save failed: {e}")
+
+    def _fresh(self, key):
+        saved_at = self.data.get(f"{key}_saved_at", 0)
+        return key in self.data and time.time() - saved_at < self.ttl
+
+    def get(self, key):
+        """TTL 内であれば値を、期限切れ・未保存なら None を返す"""
+        return self.data[key] if self._fresh(key) else None
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data[f"{key}_saved_at"] = time.time()
+        self.save()
+
+    def invalidate(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+            self.data.pop(f"{key}_saved_at", None)
+        self.save()
+
+
+def _make_cached_speedtest(config, lat_lon):
+    """キャッシュ済み設定があれば get_config の通信を省く Speedtest を作る"""
+    import speedtest
+
+    class CachedSpeedtest(speedtest.Speedtest):
+        def get_config(self):
+            if config is None:
+                return super().get_config()
+            self.config.update(config)
+            self.lat_lon = tuple(lat_lon)
+            return self.config
+
+    return CachedSpeedtest()
+
+
+class SpeedtestSession:
+    """キャッシュを使って speedtest.net の測定を行う
+
+    - 最速サーバーはキャッシュを使い、そのサーバーへの ping だけで状態を確認
+    - ping が基準値から degrade_factor 倍以上（かつ degrade_ms 以上）悪化したら再選択
+    - 失敗時は最速サーバーを破棄し、連続失敗に応じて指数バックオフする
+    """
+
+    def __init__(self, cache=None, degrade_factor=1.5, degrade_ms=20.0,
+                 backoff_base=30.0, backoff_max=1800.0):
+        self.cache = cache if cache is not None else ServerCache()
+        self.degrade_factor = degrade_factor
+        self.degrade_ms = degrade_ms
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failures = 0
+        self.backoff_until = 0.0
+        self.st = None
+        self.last_ping = None
+
+    def _client(self):
+        """Speedtest インスタンスを用意（設定はキャッシュがあれば再利用）"""
+        if self.st is not None:
+            return self.st
+        config = self.cache.get('config')
+        lat_lon = self.cache.get('lat_lon')
+        if config is None or lat_lon is None:
+            print("Initializing speedtest...")
+            self.st = _make_cached_speedtest(None, None)
+            self.cache.put('config', self.st.config)
+            self.cache.put('lat_lon', list(self.st.lat_lon))
+        else:
+            self.st = _make_cached_speedtest(config, lat_lon)
+        return self.st
+
+    def _select_server(self, st):
+        """近傍サーバー一覧（キャッシュ）から最速サーバーを選び直す"""
+        closest = self.cache.get('closest')
+        if closest:
+            best = st.get_best_server(closest)
+        else:
+            best = st.get_best_server()
+            self.cache.put('closest', st.closest)
+        self.cache.put('best', best)
+        print(f"Selected server: {best.get('sponsor')} ({best.get('name')}) "
+              f"{best['latency']:.1f} ms")
+        return best
+
+    def ensure_server(self):
+        """キャッシュ済みのサーバーを確認し、劣化していれば再選択"""
+        st = self._client()
+        best = self.cache.get('best')
+        if best is None:
+            return self._select_server(st)
+        baseline = best['latency']
+        current = st.get_best_server([dict(best)])
+        if current['latency'] > max(baseline * self.degrade_factor, baseline + self.degrade_ms):
+            print(f"Latency degraded ({baseline:.1f} -> {current['latency']:.1f} ms), reselecting server")
+            return self._select_server(st)
+        return current
+
+    def measure(self):
+        """(download Mbps, upload Mbps, ping ms) を返す。失敗時は例外"""
+        with span('get_best_server'):
+            server = self.ensure_server()
+        st = self.st
+        with span('download'):
+            download = st.download() / 1_000_000
+        with span('upload'):
+            upload = st.upload() / 1_000_000
+        self.last_ping = server['latency']
+        self.failures = 0
+        self.backoff_until = 0.0
+        return download, upload, self.last_ping
+
+    def record_failure(self):
+        """失敗を記録し、次の試行までの待ち時間（秒）を返す"""
+        self.failures += 1
+        # サーバー選択はやり直す。設定・一覧は2回連続で失敗したときだけ取り直す
+        self.cache.invalidate('best')
+        if self.failures >= 2:
+            self.st = None
+            self.cache.invalidate('config', 'lat_lon', 'closest')
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (self.failures - 1))
+        self.backoff_until = time.monotonic() + delay
+        return delay
+
+    def backoff_remaining(self):
+        return max(0.0, self.backoff_until - time.monotonic())
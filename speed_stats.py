@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""NumPy による速度系列の統計と劣化検知
+
+系列全体をまとめて処理するバッチ関数と、サンプルごとに更新する
+DegradationDetector を提供する。どちらも同じ定義で計算するので、
+履歴の一括読み込み後に1件ずつ追記しても結果は変わらない。
+
+- ewma: 指数加重移動平均（ブロックごとの閉形式でベクトル化）
+- rolling_percentile / rolling_jitter / rolling_apply: 直近 window 件の統計
+- robust_scores: 直前 window 件の中央値と MAD による外れ値スコア
+- change_points: 前後の窓の中央値の差による水準変化の検出
+- analyze: 上記をまとめて各サンプルの状態（OK / WARN / DEGRADED / DOWN）を求める
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# 状態コード（大きいほど悪い）
+WARMUP, OK, WARN, DEGRADED, DOWN = -1, 0, 1, 2, 3
+STATUS_NAMES = {WARMUP: 'WARMUP', OK: 'OK', WARN: 'WARN', DEGRADED: 'DEGRADED', DOWN: 'DOWN'}
+
+# 正規分布で MAD を標準偏差に換算する係数
+MAD_SCALE = 1.4826
+
+
+def ewma(x, alpha, initial=None):
+    """指数加重移動平均 y[i] = (1 - alpha) * y[i-1] + alpha * x[i]
+
+    initial は x[0] より前の値（None なら x[0] から始める）。
+    (1 - alpha)^k がアンダーフローしない長さのブロックごとに閉形式で計算する。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    out = np.empty(len(x))
+    if len(x) == 0:
+        return out
+    beta = 1.0 - alpha
+    if beta <= 0.0:
+        out[:] = x
+        return out
+    prev = x[0] if initial is None else float(initial)
+    # beta^block >= 1e-200 に収める
+    block = max(1, int(200 / -np.log10(beta))) if beta < 1.0 else len(x)
+    for start in range(0, len(x), block):
+        seg = x[start:start + block]
+        powers = beta ** np.arange(1, len(seg) + 1)
+        # y[i] = beta^(i+1) * (prev + alpha * Σ_{j<=i} x[j] / beta^(j+1))
+        out[start:start + len(seg)] = powers * (prev + alpha * np.cumsum(seg / powers))
+        prev = out[start + len(seg) - 1]
+    return out
+
+
+def ewm_variance(x, alpha, mean_initial=None, var_initial=0.0):
+    """EWMA まわりの指数加重分散（ewma と同じ alpha）
+
+    var[i] = (1 - alpha) * (var[i-1] + alpha * d[i]^2)、d[i] = x[i] - mean[i-1]
+    """
+    x = np.asarray(x, dtype=np.float64)
+    if len(x) == 0:
+        return np.empty(0)
+    mean = ewma(x, alpha, mean_initial)
+    prev_mean = np.empty(len(x))
+    prev_mean[0] = x[0] if mean_initial is None else mean_initial
+    prev_mean[1:] = mean[:-1]
+    beta = 1.0 - alpha
+    return ewma(beta * (x - prev_mean) ** 2, alpha, var_initial)
+
+
+def rolling_apply(x, window, func, include_current=True, start=0):
+    """各位置で直近 window 件に func(2次元配列, axis=1) を適用
+
+    include_current=False なら現在の値を含まない直前 window 件を使う。
+    先頭の窓が満たない位置は得られた分だけで計算し、1件もなければ NaN。
+    start より前の位置は計算しない（NaN のまま）。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    n = len(x)
+    out = np.full(n, np.nan)
+    if n == 0 or window <= 0:
+        return out
+    offset = 0 if include_current else 1
+    # 窓が満たない先頭部分
+    head = min(n, window - 1 + offset)
+    for i in range(start, head):
+        end = i + 1 - offset
+        if end > 0:
+            out[i] = func(x[max(0, end - window):end].reshape(1, -1), axis=1)[0]
+    # 以降はスライディングウィンドウでまとめて計算（位置 i の窓は x[i+1-offset-window : i+1-offset]）
+    first = max(head, start)
+    if first < n:
+        windows = sliding_window_view(x[:n - offset], window)
+        out[first:] = func(windows[first - head:], axis=1)
+    return out
+
+
+def rolling_percentile(x, window, q):
+    """直近 window 件の q パーセンタイル（q は 0〜100）"""
+    return rolling_apply(x, window, lambda a, axis: np.percentile(a, q, axis=axis))
+
+
+def _mean_abs_diff(a, axis):
+    if a.shape[axis] < 2:
+        return np.zeros(a.shape[0])
+    return np.abs(np.diff(a, axis=axis)).mean(axis=axis)
+
+
+def rolling_jitter(x, window):
+    """直近 window 件の連続する値の差の絶対値の平均"""
+    return rolling_apply(x, window, _mean_abs_diff)
+
+
+def _robust_scale(a, axis):
+    """中央値と MAD（標準偏差換算）を返す"""
+    median = np.median(a, axis=axis)
+    mad = np.median(np.abs(a - np.expand_dims(median, axis)), axis=axis) * MAD_SCALE
+    return median, mad
+
+
+def _scale_floor(median, mad, rel_floor):
+    # 値がほとんど変わらない系列でスコアが発散しないよう、中央値の rel_floor 倍を下限にする
+    return np.maximum(mad, np.maximum(np.abs(median) * rel_floor, 1e-9))
+
+
+def robust_scores(x, window=30, rel_floor=0.05, start=0):
+    """直前 window 件の中央値・MAD に対する各値の外れ具合 (x - median) / scale
+
+    返り値は (score, median)。直前の値がない位置と start より前は NaN。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    median = rolling_apply(x, window, np.median, include_current=False, start=start)
+    mad = rolling_apply(x, window, lambda a, axis: _robust_scale(a, axis)[1],
+                        include_current=False, start=start)
+    return (x - median) / _scale_floor(median, mad, rel_floor), median
+
+
+def change_points(x, window=30, threshold=4.0, rel_floor=0.05):
+    """前後 window 件の中央値の差が大きい位置（水準変化の開始位置）を返す
+
+    スコアは (後の中央値 - 前の中央値) / 前の窓の scale。
+    しきい値を超えた区間ごとに |スコア| が最大の位置を1つ選ぶ。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    n = len(x)
+    if n < 2 * window:
+        return np.empty(0, dtype=np.intp), np.empty(0)
+    windows = sliding_window_view(x, window)
+    median, mad = _robust_scale(windows, 1)
+    # 位置 i の前の窓は windows[i - window]、後の窓は windows[i]
+    before_median, before_mad = median[:n - 2 * window + 1], mad[:n - 2 * window + 1]
+    after_median = median[window:]
+    score = (after_median - before_median) / _scale_floor(before_median, before_mad, rel_floor)
+    above = np.abs(score) > threshold
+    if not above.any():
+        return np.empty(0, dtype=np.intp), np.empty(0)
+    # しきい値を超えた連続区間ごとに最大の位置
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], above.astype(np.int8), [0]))))
+    points = [start + int(np.abs(score[start:end]).argmax())
+              for start, end in zip(edges[0::2], edges[1::2])]
+    points = np.asarray(points, dtype=np.intp)
+    return points + window, score[points]
+
+
+def _streaks(flags, initial=0):
+    """各位置で終わる True の連続数（initial は直前までの連続数）"""
+    n = len(flags)
+    idx = np.arange(n)
+    last_false = np.maximum.accumulate(np.where(flags, -1, idx))
+    streak = idx - last_false
+    # 先頭から連続している分は直前までの連続数を足す
+    head = last_false < 0
+    streak[head] = idx[head] + 1 + initial
+    return streak
+
+
+class DetectorConfig:
+    """劣化検知のパラメータ
+
+    - window: 外れ値判定に使う直前の件数
+    - threshold: 外れ値とみなすロバスト z スコア
+    - alpha / slow_alpha: 短期・長期 EWMA の係数
+    - drop_ratio: 短期 EWMA が長期 EWMA のこの割合を下回ったら DEGRADED
+    - degraded_after: 外れ値がこの回数続いたら DEGRADED
+    - min_samples: 判定を始めるまでの件数（それまでは WARMUP）
+    - higher_is_worse: レイテンシのように値が大きいほど悪い系列
+    """
+
+    def __init__(self, window=30, threshold=3.5, alpha=0.2, slow_alpha=0.01,
+                 drop_ratio=0.7, degraded_after=3, min_samples=10, rel_floor=0.05,
+                 higher_is_worse=False):
+        self.window = window
+        self.threshold = threshold
+        self.alpha = alpha
+        self.slow_alpha = slow_alpha
+        self.drop_ratio = drop_ratio
+        self.degraded_after = degraded_after
+        self.min_samples = min_samples
+        self.rel_floor = rel_floor
+        self.higher_is_worse = higher_is_worse
+
+
+def analyze(values, config=None, history=None, state=None):
+    """系列の統計と状態をまとめて計算する
+
+    history は values より前の値（外れ値判定の窓にだけ使う）、
+    state は前回の analyze / DegradationDetector の続きの状態
+    （'ewma', 'ewm_var', 'slow_ewma', 'streak', 'count'）。
+    返り値は values と同じ長さの配列を持つ dict と、最後の状態。
+    """
+    config = config or DetectorConfig()
+    values = np.asarray(values, dtype=np.float64)
+    history = np.asarray(history if history is not None else (), dtype=np.float64)
+    state = state or {}
+    full = np.concatenate((history[-config.window:], values))
+    offset = len(full) - len(values)
+
+    score, median = robust_scores(full, config.window, config.rel_floor, start=offset)
+    score, median = score[offset:], median[offset:]
+    fast = ewma(values, config.alpha, state.get('ewma'))
+    var = ewm_variance(values, config.alpha, state.get('ewma'), state.get('ewm_var', 0.0))
+    slow = ewma(values, config.slow_alpha, state.get('slow_ewma'))
+
+    sign = 1.0 if config.higher_is_worse else -1.0
+    outlier = np.nan_to_num(sign * score, nan=0.0) > config.threshold
+    streak = _streaks(outlier, state.get('streak', 0))
+    if config.higher_is_worse:
+        drifted = fast * config.drop_ratio > slow
+        down = ~np.isfinite(values)
+    else:
+        drifted = fast < slow * config.drop_ratio
+        down = values <= 0
+    count = state.get('count', 0) + np.arange(1, len(values) + 1)
+
+    status = np.full(len(values), OK, dtype=np.int8)
+    status[outlier] = WARN
+    status[drifted | (streak >= config.degraded_after)] = DEGRADED
+    status[down] = DOWN
+    status[count < config.min_samples] = WARMUP
+
+    result = {
+        'ewma': fast,
+        'ewm_std': np.sqrt(var),
+        'slow_ewma': slow,
+        'median': median,
+        'score': score,
+        'outlier': outlier,
+        'streak': streak,
+        'status': status,
+    }
+    if len(values):
+        state = {
+            'ewma': float(fast[-1]),
+            'ewm_var': float(var[-1]),
+            'slow_ewma': float(slow[-1]),
+            'streak': int(streak[-1]),
+            'count': int(count[-1]),
+        }
+    return result, state
+
+
+class DegradationDetector:
+    """1系列の状態をサンプルごと（または一括で）更新する
+
+    直近 window 件だけを保持し、EWMA などは状態として引き継ぐ。
+    """
+
+    def __init__(self, config=None):
+        self.config = config or DetectorConfig()
+        self._recent = np.empty(0)
+        self.state = {}
+        self.status = WARMUP
+        self.score = float('nan')
+
+    def extend(self, values):
+        """複数のサンプルをまとめて取り込み、最後の状態を返す"""
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return self.status
+        result, self.state = analyze(values, self.config, self._recent, self.state)
+        self.status = int(result['status'][-1])
+        self.score = float(result['score'][-1])
+        self._recent = np.concatenate((self._recent, values))[-self.config.window:]
+        return self.status
+
+    def update(self, value):
+        """1サンプル取り込み、状態を返す"""
+        return self.extend((value,))
+
+    @property
+    def status_name(self):
+        return STATUS_NAMES[self.status]
+
+    @property
+    def ewma(self):
+        return self.state.get('ewma')
+
+    @property
+    def variation(self):
+        """変動係数（EWMA 標準偏差 / EWMA）"""
+        mean = self.state.get('ewma')
+        if not mean:
+            return None
+        return float(np.sqrt(self.state.get('ewm_var', 0.0))) / abs(mean)
+
+    def jitter(self):
+        """直近 window 件の連続する値の差の絶対値の平均"""
+        if len(self._recent) < 2:
+            return None
+        return float(np.abs(np.diff(self._recent)).mean())
+
+    def percentiles(self, q=(5, 95)):
+        """直近 window 件のパーセンタイル"""
+        if not len(self._recent):
+            return None
+        return tuple(float(v) for v in np.percentile(self._recent, q))
@@ -0,0 +1,193 @@
+import json
+import time
+from datetime import datetime
+
+import pytest
+
+import aggregator
+from aggregator import AggregatorPusher, AggregatorService
+from history_store import open_history_store
+
+DAY = 86400
+BASE = 1_700_000_000 - 1_700_000_000 % DAY
+
+
+def _entry(offset, download=10.0):
+    return {'timestamp': datetime.fromtimestamp(BASE + offset).isoformat(),
+            'download': download, 'upload': 1.0}
+
+
+class _Response:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def test_pusher_keeps_entries_added_while_sending(monkeypatch):
+    pusher = AggregatorPusher('http://aggregator', 'site', max_pending=3)
+    for i in range(3):
+        pusher.push(_entry(i))
+    bodies = []
+
+    def urlopen(request, timeout=None):
+        bodies.append(json.loads(request.data))
+        # 送信中に上限を超えて追加され、送信中の古い分が先に押し出される
+        pusher.push(_entry(3))
+        pusher.push(_entry(4))
+        return _Response()
+
+    monkeypatch.setattr(aggregator.urllib.request, 'urlopen', urlopen)
+    assert pusher.send()
+    assert len(bodies[0]) == 3
+    assert pusher.dropped == 2
+    # 送っていない新しい2件は残る
+    assert [entry for _, entry in pusher._pending] == [_entry(3), _entry(4)]
+
+
+def test_pusher_counts_entries_dropped_at_capacity(monkeypatch, capsys):
+    pusher = AggregatorPusher('http://aggregator', 'site', max_pending=2)
+
+    def urlopen(request, timeout=None):
+        raise OSError('connection refused')
+
+    monkeypatch.setattr(aggregator.urllib.request, 'urlopen', urlopen)
+    for i in range(5):
+        pusher.push(_entry(i))
+    assert not pusher.send()
+    assert pusher.dropped == 3
+    assert 'dropped 3 oldest entries' in capsys.readouterr().out
+    assert [entry for _, entry in pusher._pending] == [_entry(3), _entry(4)]
+
+
+@pytest.fixture
+def service(tmp_path):
+    pytest.importorskip('numpy')
+    store = open_history_store(str(tmp_path / 'aggregate.db'))
+    service = AggregatorService(store, raw_limit=1000)
+    # 1分ごとに 3000 件（約2日）
+    service.ingest([_entry(i * 60, download=float(i % 100)) for i in range(3000)], 'a')
+    service.flush_pending()
+    yield service
+    service.stop()
+    store.close()
+
+
+def test_query_long_range_is_served_from_rollups(service, monkeypatch):
+    def read_history_range(*args, **kwargs):
+        raise AssertionError('raw rows read for a long range')
+
+    monkeypatch.setattr(aggregator, 'read_history_range', read_history_range)
+    series = service.query(['a'], points=200)['a']
+    assert series['resolution'] == 'hour'
+    assert series['count'] == 3000
+    download = series['download']
+    assert len(download['value']) <= 200
+    assert min(download['value']) == 0.0 and max(download['value']) == 99.0
+    assert download['summary']['count'] == 3000
+    assert download['summary']['p95'] == pytest.approx(95, rel=0.03)
+
+
+def test_query_short_range_reads_raw_rows(service):
+    series = service.query(['a'], start=BASE, end=BASE + 600 * 60, points=200)['a']
+    assert series['resolution'] == 'raw'
+    assert series['count'] == 600
+    download = series['download']
+    assert len(download['value']) <= 200
+    assert download['timestamp'][0] == BASE and download['timestamp'][-1] == BASE + 599 * 60
+    assert download['summary']['max'] == 99.0
+
+
+def test_query_includes_entries_ingested_after_the_first_query(service):
+    service.query(['a'], points=200)
+    service.ingest([_entry(3000 * 60, download=500.0)], 'a')
+    service.flush_pending()
+    series = service.query(['a'], points=200)['a']
+    assert series['count'] == 3001
+    assert max(series['download']['value']) == 500.0
+
+
+class _FlakyStore:
+    """最初の failures 回の書き込みで失敗するストア"""
+
+    def __init__(self, store, failures=1):
+        self.store = store
+        self.path = store.path
+        self.failures = failures
+
+    def append_many(self, entries):
+        if self.failures:
+            self.failures -= 1
+            raise OSError('disk full')
+        return self.store.append_many(entries)
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+
+def test_failed_write_is_requeued_and_retried(tmp_path):
+    store = open_history_store(str(tmp_path / 'aggregate.db'))
+    service = AggregatorService(_FlakyStore(store))
+    service.ingest([_entry(i) for i in range(3)], 'a')
+    with pytest.raises(OSError):
+        service.flush_pending()
+    # 書けなかった分は、その間に届いた分より前に戻る
+    service.ingest([_entry(3)], 'a')
+    assert service.flush_pending() == 4
+    assert [e['timestamp'] for e in store.tail(10, target='a')] == \
+        [_entry(i)['timestamp'] for i in range(4)]
+    store.close()
+
+
+def test_requeue_respects_max_pending(tmp_path, capsys):
+    store = open_history_store(str(tmp_path / 'aggregate.db'))
+    flaky = _FlakyStore(store)
+    service = AggregatorService(flaky, max_pending=5)
+    service.ingest([_entry(i) for i in range(4)], 'a')
+    append_many = flaky.append_many
+
+    def append_during_write(entries):
+        # 書き込み中にディレクトリ追跡から上限を無視して追加された
+        service.ingest([_entry(i) for i in range(4, 7)], 'a', enforce_limit=False)
+        return append_many(entries)
+
+    flaky.append_many = append_during_write
+    with pytest.raises(OSError):
+        service.flush_pending()
+    assert service.dropped == 2
+    assert 'dropped 2 oldest entries' in capsys.readouterr().out
+    flaky.append_many = append_many
+    assert service.flush_pending() == 5
+    assert [e['timestamp'] for e in store.tail(10)] == [_entry(i)['timestamp'] for i in range(2, 7)]
+    with pytest.raises(aggregator.IngestBusy):
+        service.ingest([_entry(i) for i in range(6)], 'a')
+    store.close()
+
+
+def test_writer_thread_retries_until_the_store_recovers(tmp_path):
+    store = open_history_store(str(tmp_path / 'aggregate.db'))
+    service = AggregatorService(_FlakyStore(store, failures=2), batch_interval=0.01,
+                                max_retry_delay=0.05)
+    service.start()
+    service.ingest([_entry(i) for i in range(3)], 'a')
+    deadline = time.monotonic() + 5
+    while service.written < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    service.stop()
+    assert service.written == 3
+    assert len(store.tail(10)) == 3
+    store.close()
+
+
+def test_sqlite_append_many_rolls_back_a_failed_batch(tmp_path):
+    store = open_history_store(str(tmp_path / 'history.db'))
+    store.append(_entry(0))
+    bad = dict(_entry(2), download=None)
+    with pytest.raises(Exception):
+        store.append_many([_entry(1), bad])
+    store.append_many([_entry(1), _entry(2)])
+    store.close()
+    store = open_history_store(str(tmp_path / 'history.db'))
+    assert [e['timestamp'] for e in store.tail(10)] == [_entry(i)['timestamp'] for i in range(3)]
+    store.close()
@@ -0,0 +1,78 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from binary_history import BinaryHistory, convert, read_range  # noqa: E402
+from history_query import RollupIndex, rollup_path  # noqa: E402
+from history_store import open_history_store, read_history_range  # noqa: E402
+
+DAY = 86400
+BASE = 1_700_000_000 - 1_700_000_000 % DAY
+
+
+def _entry(i, target=None, ping=None):
+    entry = {'timestamp': datetime.fromtimestamp(BASE + i * 60).isoformat(),
+             'download': float(10 + i), 'upload': 1.5}
+    if target is not None:
+        entry['target'] = target
+    if ping is not None:
+        entry['ping'] = ping
+    return entry
+
+
+def _write_jsonl(path, entries):
+    with open_history_store(path) as store:
+        store.append_many(entries)
+
+
+def _read(path):
+    if path.endswith('.json'):
+        with open(path) as f:
+            return json.load(f)
+    return read_history_range(path)
+
+
+def test_round_trip_keeps_values_and_targets(tmp_path):
+    src = str(tmp_path / 'history.jsonl')
+    entries = [_entry(i, target='a' if i % 2 else 'b', ping=12.5 if i == 3 else None)
+               for i in range(6)]
+    _write_jsonl(src, entries)
+    dst = str(tmp_path / 'history.bin')
+    assert convert(src, dst) == 6
+    assert BinaryHistory(dst).targets == ['b', 'a']
+    back = read_range(dst)
+    assert [e['timestamp'] for e in back] == [e['timestamp'] for e in entries]
+    assert [e['download'] for e in back] == [e['download'] for e in entries]
+    assert back[3]['ping'] == 12.5 and 'ping' not in back[2]
+    assert [e['download'] for e in read_range(dst, target='a')] == [11.0, 13.0, 15.0]
+
+
+@pytest.mark.parametrize('suffix', ['.bin', '.jsonl', '.db', '.json'])
+def test_convert_twice_replaces_destination(tmp_path, suffix):
+    src = str(tmp_path / 'source.jsonl')
+    _write_jsonl(src, [_entry(i) for i in range(5)])
+    dst = str(tmp_path / f"converted{suffix}")
+    assert convert(src, dst) == 5
+    assert convert(src, dst) == 5
+    assert len(_read(dst)) == 5
+    # 一時ファイルは残らない（-wal / -shm は読み込み側の SQLite が作るもの）
+    names = [name for name in os.listdir(tmp_path) if not name.endswith(('-wal', '-shm'))]
+    assert sorted(names) == sorted(['source.jsonl', f"converted{suffix}"])
+
+
+def test_convert_drops_stale_rollup_index(tmp_path):
+    src = str(tmp_path / 'source.jsonl')
+    _write_jsonl(src, [_entry(i) for i in range(5)])
+    dst = str(tmp_path / 'converted.db')
+    convert(src, dst)
+    with RollupIndex(rollup_path(dst)) as index:
+        index.sync(dst)
+    convert(src, dst)
+    with RollupIndex(rollup_path(dst)) as index:
+        index.sync(dst)
+        rows = index.query(resolution='day', columns=('download',))
+        assert sum(row['download']['count'] for row in rows) == 5
@@ -0,0 +1,63 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from dashboard_export import DashboardExporter, Tile
+from history_store import open_history_store
+
+pytest.importorskip('matplotlib')
+
+DAY = 86400
+BASE = 1_700_000_000 - 1_700_000_000 % DAY
+
+
+def _write_history(path, count=20):
+    store = open_history_store(path)
+    store.append_many([{'timestamp': datetime.fromtimestamp(BASE + i * 600).isoformat(),
+                        'download': 50.0 + i, 'upload': 10.0} for i in range(count)])
+    store.close()
+
+
+def _html(out_dir):
+    with open(os.path.join(out_dir, 'index.html'), encoding='utf-8') as f:
+        return f.read()
+
+
+def test_empty_range_removes_previous_image(tmp_path):
+    path = str(tmp_path / 'history.jsonl')
+    out_dir = str(tmp_path / 'out')
+    _write_history(path)
+    image = os.path.join(out_dir, 'history-all-24h.png')
+
+    exporter = DashboardExporter(out_dir)
+    assert exporter.export([Tile(path, None, '24h', now=BASE + DAY / 2)])['rendered'] == 1
+    assert os.path.exists(image)
+    assert '<img' in _html(out_dir)
+
+    # 同じ名前のタイルが、期間がずれてデータのない範囲を指すようになった
+    exporter = DashboardExporter(out_dir)
+    assert exporter.export([Tile(path, None, '24h', now=BASE + 10 * DAY)])['rendered'] == 1
+    assert not os.path.exists(image)
+    document = _html(out_dir)
+    assert '<img' not in document
+    assert '0 samples' in document and 'NO DATA' in document
+
+
+def test_image_tag_ignores_files_not_rendered_for_current_data(tmp_path):
+    path = str(tmp_path / 'history.jsonl')
+    out_dir = str(tmp_path / 'out')
+    _write_history(path)
+    tile = Tile(path, None, '24h', now=BASE + 10 * DAY)
+    os.makedirs(out_dir)
+    # 別の実行で残った画像があっても、今回のデータで描いていなければ載せない
+    with open(os.path.join(out_dir, f"{tile.name}.svg"), 'w') as f:
+        f.write('<svg/>')
+    DashboardExporter(out_dir).export([tile])
+    assert '<img' not in _html(out_dir)
+    # データが戻れば描き直して載せる
+    tile = Tile(path, None, '24h', now=BASE + DAY / 2)
+    exporter = DashboardExporter(out_dir)
+    assert exporter.export([tile])['rendered'] == 1
+    assert exporter.export([tile])['skipped'] == 1
+    assert 'data:image/png' in _html(out_dir)
@@ -0,0 +1,84 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from downsample import TieredAggregator, decimate_for_width, lttb, minmax_decimate  # noqa: E402
+
+
+def _series(n=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.arange(n, dtype=np.float64), rng.normal(100.0, 10.0, n)
+
+
+def test_minmax_keeps_bucket_extremes_in_time_order():
+    x, y = _series()
+    xs, ys = minmax_decimate(x, y, 50)
+    assert len(xs) == 100
+    assert np.all(np.diff(xs) >= 0)
+    assert ys.min() == y.min() and ys.max() == y.max()
+    # 各バケット（20 点）の最小・最大がそのまま残る
+    for i in range(50):
+        block = y[i * 20:(i + 1) * 20]
+        assert set(ys[2 * i:2 * i + 2]) == {block.min(), block.max()}
+
+
+def test_minmax_uneven_last_bucket_stays_in_range():
+    x, y = _series(1001)
+    xs, ys = minmax_decimate(x, y, 50)
+    assert len(xs) <= 100
+    assert xs[-1] <= x[-1]
+    assert ys.min() == y.min() and ys.max() == y.max()
+
+
+def test_minmax_returns_short_input_unchanged():
+    x, y = _series(100)
+    xs, ys = minmax_decimate(x, y, 50)
+    assert xs is not None and np.array_equal(xs, x) and np.array_equal(ys, y)
+
+
+def test_lttb_keeps_endpoints_and_width():
+    x, y = _series()
+    y[500] = 1000.0
+    xs, ys = lttb(x, y, 100)
+    assert len(xs) == 100
+    assert (xs[0], ys[0]) == (x[0], y[0])
+    assert (xs[-1], ys[-1]) == (x[-1], y[-1])
+    assert np.all(np.diff(xs) > 0)
+    # 目立つ1点のスパイクは残る
+    assert 1000.0 in ys
+
+
+@pytest.mark.parametrize('method', ['minmax', 'lttb'])
+@pytest.mark.parametrize('width', [2, 3, 101, 640])
+def test_decimate_for_width_fits_pixels(method, width):
+    x, y = _series(5000)
+    xs, ys = decimate_for_width(x, y, width, method=method)
+    assert len(xs) == len(ys) <= max(2, width)
+    assert np.all(np.diff(xs) >= 0)
+
+
+def test_tiers_extend_matches_append():
+    ts = 1_700_000_000 + np.cumsum(np.full(500, 7.0))
+    down = np.linspace(10.0, 90.0, 500)
+    up = down / 10
+    one = TieredAggregator(100)
+    for t, d, u in zip(ts, down, up):
+        one.append(t, d, u)
+    bulk = TieredAggregator(100)
+    bulk.extend(ts[:123], down[:123], up[:123])
+    bulk.extend(ts[123:], down[123:], up[123:])
+    for tier in ('1min', '10min', '1h'):
+        for column in ('download', 'upload'):
+            for a, b in zip(one.series(tier, column), bulk.series(tier, column)):
+                np.testing.assert_allclose(a, b)
+
+
+def test_tier_buckets_hold_min_max_mean():
+    agg = TieredAggregator(10, columns=('download',))
+    for i, value in enumerate([1.0, 5.0, 3.0, 10.0]):
+        agg.append(60.0 * 100 + i * 20, value)
+    ts, mean, low, high = agg.series('1min', 'download')
+    np.testing.assert_array_equal(ts, [6000.0, 6060.0])
+    np.testing.assert_allclose(mean, [3.0, 10.0])
+    np.testing.assert_allclose(low, [1.0, 10.0])
+    np.testing.assert_allclose(high, [5.0, 10.0])
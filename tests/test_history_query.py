@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from history_query import RollupIndex, main, rollup_path
+from history_store import JsonlHistoryStore, open_history_store, read_history_range
+
+DAY = 86400
+BASE = 1_700_000_000 - 1_700_000_000 % DAY
+
+
+def _entry(offset, download=10.0, target=None):
+    entry = {'timestamp': datetime.fromtimestamp(BASE + offset).isoformat(),
+             'download': download, 'upload': 1.0}
+    if target is not None:
+        entry['target'] = target
+    return entry
+
+
+def _count(index, target=None):
+    rows = index.query(resolution='day', target=target, columns=('download',))
+    return sum(row['download']['count'] for row in rows)
+
+
+@pytest.mark.parametrize('suffix', ['.jsonl', '.db', '.bin'])
+def test_sync_includes_entries_older_than_the_last_one(tmp_path, suffix):
+    path = str(tmp_path / f"history{suffix}")
+    store = open_history_store(path)
+    store.append_many([_entry(100), _entry(300)])
+    with RollupIndex(rollup_path(path)) as index:
+        assert index.sync(path) == 2
+        # 集約サービスのまとめ書きなどで、最新より古い時刻のエントリが後から追記される
+        store.append_many([_entry(200, target='late'), _entry(50, target='late')])
+        store.flush()
+        assert index.sync(path) == 2
+        assert index.sync(path) == 0
+        assert _count(index) == 4
+        assert _count(index, 'late') == 2
+    store.close()
+
+
+def test_sync_follows_rotation_without_double_counting(tmp_path):
+    path = str(tmp_path / 'history.jsonl')
+    # 数行ごとにローテーションし、最も古いバックアップは削除前にロールアップへ集約される
+    store = open_history_store(path, max_bytes=300, backups=2)
+    with RollupIndex(rollup_path(path)) as index:
+        for i in range(60):
+            store.append(_entry(i * 60))
+            if i % 7 == 0:
+                store.flush()
+                index.sync(path, backups=2)
+        store.flush()
+        index.sync(path, backups=2)
+        assert _count(index) == 60
+    store.close()
+
+
+def test_sync_ignores_partial_trailing_line(tmp_path):
+    path = str(tmp_path / 'history.jsonl')
+    store = open_history_store(path)
+    store.append(_entry(0))
+    store.close()
+    with open(path, 'ab') as f:
+        f.write(b'{"timestamp": "2023-11-1')
+    with RollupIndex(rollup_path(path)) as index:
+        assert index.sync(path) == 1
+        with open(path, 'ab') as f:
+            f.write(b'4T00:00:00", "download": 5.0, "upload": 1.0}\n')
+        assert index.sync(path) == 1
+        assert _count(index) == 2
+
+
+def test_legacy_timestamp_cursor_is_migrated(tmp_path):
+    path = str(tmp_path / 'history.jsonl')
+    store = open_history_store(path)
+    store.append_many([_entry(100), _entry(200), _entry(300)])
+    store.close()
+    with RollupIndex(rollup_path(path)) as index:
+        # 旧版の索引は 200 までを取り込み済みとして時刻を記録していた
+        index.add_entries([_entry(100), _entry(200)])
+        index.conn.execute("INSERT INTO cursors (source, ts) VALUES (?, ?)",
+                           (str(tmp_path / 'history.jsonl'), BASE + 200))
+        assert index.sync(path) == 1
+        assert index.position(str(tmp_path / 'history.jsonl')) is not None
+        assert _count(index) == 3
+
+
+def test_sqlite_position_is_reset_after_compaction_empties_the_table(tmp_path):
+    path = str(tmp_path / 'history.db')
+    store = open_history_store(path)
+    store.append_many([_entry(0), _entry(60)])
+    store.close()
+    with RollupIndex(rollup_path(path)) as index:
+        index.sync(path)
+    from history_query import compact
+    compact(path, keep_days=0)
+    store = open_history_store(path)
+    store.append_many([_entry(120), _entry(180), _entry(240)])
+    store.close()
+    with RollupIndex(rollup_path(path)) as index:
+        assert index.sync(path) == 3
+        assert _count(index) == 5
+
+
+@pytest.mark.parametrize('suffix', ['.jsonl', '.db', '.bin'])
+def test_read_history_range_returns_out_of_order_rows_sorted(tmp_path, suffix):
+    path = str(tmp_path / f"history{suffix}")
+    store = open_history_store(path)
+    store.append_many([_entry(100), _entry(300), _entry(200), _entry(10)])
+    store.close()
+    entries = read_history_range(path, start=BASE + 50)
+    assert [e['timestamp'] for e in entries] == [_entry(o)['timestamp'] for o in (100, 200, 300)]
+    entries = read_history_range(path, start=BASE, end=BASE + 150)
+    assert [e['timestamp'] for e in entries] == [_entry(o)['timestamp'] for o in (10, 100)]
+
+
+def test_rollup_statistics_match_raw_values(tmp_path):
+    np = pytest.importorskip('numpy')
+    path = str(tmp_path / 'history.db')
+    values = np.random.default_rng(0).lognormal(4.0, 0.5, 2000)
+    store = open_history_store(path)
+    # 1分ごと（約33時間）、0 Mbps の失敗も含む
+    values[::97] = 0.0
+    store.append_many([_entry(i * 60, download=float(v)) for i, v in enumerate(values)])
+    store.close()
+    with RollupIndex(rollup_path(path)) as index:
+        index.sync(path)
+        total = index.summary(resolution='hour', columns=('download',))['download']
+        assert total['count'] == len(values)
+        assert total['min'] == 0.0 and total['max'] == pytest.approx(values.max())
+        assert total['mean'] == pytest.approx(values.mean())
+        for stat, q in (('p5', 5), ('p95', 95)):
+            assert total[stat] == pytest.approx(np.percentile(values, q), rel=0.03)
+        # 分・時・日のどの解像度でも件数の合計は同じ
+        for resolution in ('minute', 'hour', 'day'):
+            rows = index.query(resolution=resolution, columns=('download',))
+            assert sum(row['download']['count'] for row in rows) == len(values)
+        hours = index.query(start=BASE, end=BASE + 3600, resolution='hour', columns=('download',))
+        assert len(hours) == 1
+        assert hours[0]['download']['mean'] == pytest.approx(values[:60].mean())
+
+
+def test_report_includes_the_partial_first_bucket(tmp_path, capsys):
+    path = str(tmp_path / 'history.jsonl')
+    now = time.time()
+    store = open_history_store(path)
+    # 期間の始まりの直後（その日の区間の開始時刻は期間の始まりより前）
+    store.append_many([{'timestamp': datetime.fromtimestamp(now - DAY + 60).isoformat(),
+                        'download': 42.0, 'upload': 1.0}])
+    store.close()
+    main(['--data-file', path, 'report', '--days', '1', '--resolution', 'day', '--json'])
+    rows = json.loads(capsys.readouterr().out)
+    assert sum(row['download']['count'] for row in rows) == 1
+
+
+def test_rotation_compacts_in_the_background(tmp_path, monkeypatch):
+    path = str(tmp_path / 'history.jsonl')
+    store = open_history_store(path, max_bytes=200, backups=1)
+    release = threading.Event()
+    compact = JsonlHistoryStore._compact_into_rollups
+
+    def slow_compact(self):
+        release.wait(5)
+        compact(self)
+
+    monkeypatch.setattr(JsonlHistoryStore, '_compact_into_rollups', slow_compact)
+    for i in range(12):
+        store.append(_entry(i * 60))
+    # 集約を待たずに追記が続き、押し出されたファイルは集約待ちの枠に残る
+    assert os.path.exists(store.compaction_path())
+    with RollupIndex(rollup_path(path)) as index:
+        # 集約中に別プロセスが sync しても二重に数えない
+        index.sync(path, backups=1)
+        release.set()
+        store.close()
+        index.sync(path, backups=1)
+        assert _count(index) == 12
+    assert not os.path.exists(store.compaction_path())
@@ -0,0 +1,160 @@
+import os
+import threading
+from datetime import datetime
+
+import pytest
+
+import history_store
+from history_store import JsonlHistoryReader, list_targets, open_history_store, read_history_range
+
+DAY = 86400
+BASE = 1_700_000_000 - 1_700_000_000 % DAY
+
+
+def _entry(i, target=None):
+    entry = {'timestamp': datetime.fromtimestamp(BASE + i * 60).isoformat(),
+             'download': float(i), 'upload': 1.0}
+    if target is not None:
+        entry['target'] = target
+    return entry
+
+
+def _downloads(entries):
+    return [int(entry['download']) for entry in entries]
+
+
+def test_rotation_keeps_backups_and_order(tmp_path):
+    path = str(tmp_path / 'history.jsonl')
+    store = open_history_store(path, max_bytes=400, backups=2, rollups=False)
+    for i in range(40):
+        store.append(_entry(i))
+    assert os.path.exists(f"{path}.1") and os.path.exists(f"{path}.2")
+    assert not os.path.exists(f"{path}.3")
+    # 最新の分はローテーションをまたいで古い順に返る
+    assert _downloads(store.tail(10)) == list(range(30, 40))
+    kept = _downloads(read_history_range(path, backups=2))
+    assert kept == list(range(40 - len(kept), 40))
+    assert len(kept) < 40
+    store.close()
+
+
+@pytest.mark.parametrize('suffix', ['.jsonl', '.db'])
+def test_tail_filters_by_target(tmp_path, suffix):
+    path = str(tmp_path / f"history{suffix}")
+    with open_history_store(path) as store:
+        store.append_many([_entry(i, target='a' if i % 2 else 'b') for i in range(20)])
+        assert _downloads(store.tail(3, target='a')) == [15, 17, 19]
+        assert _downloads(store.tail(100, target='b')) == list(range(0, 20, 2))
+
+
+def test_partial_trailing_line_is_truncated_on_open(tmp_path):
+    path = str(tmp_path / 'history.jsonl')
+    with open_history_store(path) as store:
+        store.append_many([_entry(0), _entry(1)])
+    with open(path, 'ab') as f:
+        f.write(b'{"timestamp": "2023-11-1')
+    # クラッシュ後の再起動で書きかけの行を捨て、続きから追記できる
+    with open_history_store(path) as store:
+        store.append(_entry(2))
+        assert _downloads(store.tail(10)) == [0, 1, 2]
+    with open(path, 'rb') as f:
+        assert f.read().count(b'\n') == 3
+
+
+
+def test_reader_skips_incomplete_line_and_follows_rotation(tmp_path):
+    path = str(tmp_path / 'history.jsonl')
+    store = open_history_store(path, max_bytes=0, rollups=False)
+    store.append_many([_entry(0), _entry(1)])
+    reader = JsonlHistoryReader(path)
+    assert _downloads(reader.tail(10)) == [0, 1]
+
+    with open(path, 'ab') as f:
+        f.write(b'{"timestamp": "2023-11-1')
+    assert reader.poll() == []
+    with open(path, 'ab') as f:
+        f.write(b'4T00:00:00", "download": 2.0, "upload": 1.0}\n')
+    assert _downloads(reader.poll()) == [2]
+
+    # ローテーション前に書かれた分も取りこぼさない
+    store.close()
+    store = open_history_store(path, max_bytes=0, rollups=False)
+    store.append(_entry(3))
+    store.rotate()
+    store.append(_entry(4))
+    store.flush()
+    assert _downloads(reader.poll()) == [3, 4]
+    store.close()
+
+
+def test_reader_reads_every_generation_after_two_rotations(tmp_path, capsys):
+    path = str(tmp_path / 'history.jsonl')
+    store = open_history_store(path, max_bytes=0, backups=2, rollups=False)
+    store.append(_entry(0))
+    store.flush()
+    reader = JsonlHistoryReader(path, backups=2)
+    assert _downloads(reader.tail(10)) == [0]
+    # poll の間に2回ローテーションしても、真ん中の世代を取りこぼさない
+    for i in (1, 2, 3):
+        store.append(_entry(i))
+        store.flush()
+        if i < 3:
+            store.rotate()
+    assert _downloads(reader.poll()) == [1, 2, 3]
+    # 読んでいたファイルが残っていなければ警告して新しいファイルから続ける
+    # （開いたままにして、削除後に inode が使い回されないようにする）
+    with open(path, 'rb'):
+        for i in (4, 5, 6):
+            store.rotate()
+            store.append(_entry(i))
+            store.flush()
+        assert _downloads(reader.poll()) == [6]
+    assert 'some entries were skipped' in capsys.readouterr().out
+    store.close()
+
+
+def test_list_targets_reads_only_appended_lines(tmp_path, monkeypatch):
+    path = str(tmp_path / 'history.jsonl')
+    store = open_history_store(path, max_bytes=0, rollups=False)
+    store.append_many([_entry(i, target='b' if i % 2 else 'a') for i in range(10)])
+    store.flush()
+    assert list_targets(path) == ['a', 'b']
+    parsed = []
+    loads = history_store.json.loads
+
+    def counting_loads(line):
+        parsed.append(line)
+        return loads(line)
+
+    monkeypatch.setattr(history_store.json, 'loads', counting_loads)
+    store.rotate()
+    store.append(_entry(10, target='c'))
+    store.append(_entry(11))
+    store.flush()
+    assert list_targets(path) == ['a', 'b', 'c']
+    # ローテーションした旧ファイルは読み直さず、target のない行は解析しない
+    assert len(parsed) == 1
+    store.close()
+
+
+def test_sqlite_store_can_be_shared_between_threads(tmp_path):
+    path = str(tmp_path / 'history.db')
+    store = open_history_store(path, commit_every=1)
+    errors = []
+
+    def write(offset):
+        try:
+            for i in range(200):
+                store.append_many([_entry(offset + i)])
+                store.tail(5)
+        except Exception as exc:  # noqa: BLE001
+            errors.append(exc)
+
+    threads = [threading.Thread(target=write, args=(k * 1000,)) for k in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(store.tail(1000)) == 800
+    store.close()
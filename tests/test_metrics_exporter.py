@@ -0,0 +1,89 @@
+import re
+
+from collector import SpeedCollector
+from latency_probe import LatencyProber
+from metrics_exporter import DURATION_BUCKETS, SPEED_BUCKETS, SpeedMetrics
+
+
+def _lines(metrics, openmetrics):
+    return metrics.render(openmetrics).decode('utf-8').splitlines()
+
+
+def test_histogram_bucket_bounds_are_canonical_floats():
+    metrics = SpeedMetrics()
+    metrics.observe_test('isp', 42.0, 8.0, duration=3.0)
+    for openmetrics in (False, True):
+        lines = _lines(metrics, openmetrics)
+        bounds = [re.search(r'le="([^"]+)"', line).group(1)
+                  for line in lines if line.startswith('netspeed_download_mbps_bucket')]
+        assert bounds == [repr(float(b)) for b in SPEED_BUCKETS] + ['+Inf']
+        assert 'netspeed_download_mbps_bucket{target="isp",le="1.0"} 0' in lines
+        assert 'netspeed_download_mbps_bucket{target="isp",le="50.0"} 1' in lines
+        assert 'netspeed_test_duration_seconds_bucket{target="isp",le="2.5"} 0' in lines
+        durations = [line for line in lines
+                     if line.startswith('netspeed_test_duration_seconds_bucket')]
+        assert len(durations) == len(DURATION_BUCKETS) + 1
+
+
+def test_bucket_bound_is_inclusive_and_counts_are_cumulative():
+    metrics = SpeedMetrics()
+    for value in (1, 5, 5.5, 3000):
+        metrics.observe_test('isp', value, 1.0)
+    lines = _lines(metrics, True)
+    assert 'netspeed_download_mbps_bucket{target="isp",le="1.0"} 1' in lines
+    assert 'netspeed_download_mbps_bucket{target="isp",le="5.0"} 2' in lines
+    assert 'netspeed_download_mbps_bucket{target="isp",le="10.0"} 3' in lines
+    assert 'netspeed_download_mbps_bucket{target="isp",le="+Inf"} 4' in lines
+    assert 'netspeed_download_mbps_count{target="isp"} 4' in lines
+    assert lines[-1] == '# EOF'
+
+
+def test_counters_and_render_cache():
+    metrics = SpeedMetrics()
+    metrics.observe_failure('dc1')
+    first = metrics.render()
+    assert metrics.render() is first
+    assert b'netspeed_tests_total{target="dc1"} 1' in first
+    assert b'# TYPE netspeed_tests_total counter' in first
+    assert b'# TYPE netspeed_tests counter' in metrics.render(True)
+    metrics.observe_probe('dc1', None)
+    assert metrics.render() is not first
+    assert b'netspeed_probe_failures_total{target="dc1"} 1' in metrics.render()
+
+
+class _Engine:
+    name = 'isp'
+
+    def close(self):
+        pass
+
+
+class _Probe:
+    def __init__(self, rtts):
+        self.rtts = iter(rtts)
+
+    def probe(self):
+        return next(self.rtts)
+
+
+def test_latency_batches_reach_metrics_and_other_callbacks(tmp_path):
+    metrics = SpeedMetrics()
+    prober = LatencyProber(_Probe([10.0, None, 14.0, 12.0]), 'udp://127.0.0.1:7')
+    seen = []
+    prober.on_batch = seen.append
+    collector = SpeedCollector(data_file=str(tmp_path / 'history.jsonl'), engine=_Engine(),
+                               metrics=metrics, prober=prober)
+    # 表示側が後からコールバックを足しても、メトリクスへの記録は外れない
+    prober.add_batch_callback(seen.append)
+    for _ in range(4):
+        prober._rtts.append(prober.probe.probe())
+    prober._flush()
+    collector.history.close()
+    assert len(seen) == 2
+    lines = _lines(metrics, False)
+    label = '{target="udp://127.0.0.1:7"}'
+    assert f'netspeed_probes_total{label} 4' in lines
+    assert f'netspeed_probe_failures_total{label} 1' in lines
+    assert f'netspeed_last_ping_ms{label} 12.0' in lines
+    assert f'netspeed_jitter_ms{label} 3.0' in lines
+    assert f'netspeed_probe_loss_ratio{label} 0.25' in lines
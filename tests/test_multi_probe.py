@@ -0,0 +1,50 @@
+import asyncio
+import threading
+
+import pytest
+
+from multi_probe import MultiTargetScheduler, ProbeTarget
+
+
+@pytest.mark.parametrize('probe, expected', [
+    ('1.1.1.1:443', ('1.1.1.1', 443)),
+    ('[::1]:443', ('::1', 443)),
+    ('[fd00::5]:22', ('fd00::5', 22)),
+    ('example.com:8080', ('example.com', 8080)),
+])
+def test_probe_address_accepts_ipv6_literals(probe, expected):
+    assert ProbeTarget('t', probe=probe).probe_address == expected
+
+
+def test_probe_without_port_is_rejected():
+    with pytest.raises(ValueError):
+        ProbeTarget('t', probe='[::1]')
+
+
+def test_speedtest_targets_use_their_own_cache_file():
+    isp, vpn = ProbeTarget('isp'), ProbeTarget('vpn/tokyo')
+    assert isp.cache_path('cache.json') == 'cache.isp.json'
+    assert vpn.cache_path('cache.json') == 'cache.vpn_tokyo.json'
+    assert isp.engine('cache.json').session.cache.path == 'cache.isp.json'
+
+
+class _Store:
+    def __init__(self):
+        self.threads = []
+
+    def append(self, entry):
+        self.threads.append(threading.current_thread())
+
+
+def test_save_writes_outside_the_event_loop_thread():
+    store = _Store()
+    scheduler = MultiTargetScheduler([], store)
+    target = ProbeTarget('t')
+
+    async def save():
+        scheduler._store_lock = asyncio.Lock()
+        await scheduler._save(target, 10.0, 1.0, None)
+
+    asyncio.run(save())
+    assert len(store.threads) == 1
+    assert store.threads[0] is not threading.current_thread()
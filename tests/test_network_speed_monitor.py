@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('matplotlib')
+
+
+def _monitor_with_canvas(n=200, capacity=200, download=lambda i: 90.0 + i % 7):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from network_speed_monitor import BlitManager, NetworkSpeedMonitor
+
+    start = datetime(2024, 1, 1)
+    entries = [{'timestamp': (start + timedelta(seconds=10 * i)).isoformat(),
+                'download': download(i), 'upload': 17.0} for i in range(n)]
+    monitor = NetworkSpeedMonitor(max_data_points=capacity, entries=entries)
+    monitor.fig = Figure(figsize=(12, 6), dpi=50)
+    FigureCanvasAgg(monitor.fig)
+    monitor.blit_manager = BlitManager(monitor.fig.canvas)
+    monitor.setup_layout()
+    monitor.update_graph()
+    draws = []
+    monitor.fig.canvas.mpl_connect('draw_event', draws.append)
+    return monitor, start + timedelta(seconds=10 * n), draws
+
+
+def test_new_samples_are_blitted_without_full_redraw():
+    monitor, clock, draws = _monitor_with_canvas()
+    for i in range(10):
+        monitor.record_sample(clock + timedelta(seconds=10 * i), 92.0, 17.0)
+        monitor.update_graph()
+    # バッファが満杯（毎回最古のサンプルが消える）でも X 軸は余白を使い切るまで動かない
+    assert draws == []
+
+
+def test_x_axis_is_reanchored_when_the_slack_is_used_up():
+    monitor, clock, draws = _monitor_with_canvas(n=50, capacity=50)
+    left, right = monitor.ax1.get_xlim()
+    for i in range(20):
+        monitor.record_sample(clock + timedelta(seconds=10 * i), 92.0, 17.0)
+        monitor.update_graph()
+    assert draws
+    new_left, new_right = monitor.ax1.get_xlim()
+    assert new_left > left and new_right > right
+    x, _ = monitor.down_line.get_data()
+    assert new_left <= x[0] and x[-1] <= new_right
+
+
+def test_render_without_blit_manager_draws_fully():
+    from matplotlib.figure import Figure
+    from network_speed_monitor import NetworkSpeedMonitor
+
+    entries = [{'timestamp': datetime(2024, 1, 1, 0, 0, i).isoformat(),
+                'download': 50.0, 'upload': 5.0} for i in range(5)]
+    monitor = NetworkSpeedMonitor(max_data_points=10, entries=entries)
+    fig = monitor.render(Figure(figsize=(8, 4)))
+    # 書き出し用の描画はデータの範囲に合わせる（右端の余白なし）
+    left, right = monitor.ax1.get_xlim()
+    assert right < 4 + 1
+    # 軸の変わらない更新はブリットの経路に入るが、ブリットなしでも失敗しない
+    monitor.show_profile = True
+    monitor.update_graph()
+    assert fig is monitor.fig
+
+
+def test_status_texts_are_redrawn_only_when_their_strings_change(monkeypatch):
+    monitor, clock, draws = _monitor_with_canvas(download=lambda i: 90.0)
+    drawn = []
+    draw_artist = monitor.fig.draw_artist
+    monkeypatch.setattr(monitor.fig, 'draw_artist', lambda a: (drawn.append(a), draw_artist(a)))
+    monitor.record_sample(clock, 90.0, 17.0)
+    monitor.update_graph()
+    # バッファは満杯で値も同じなので、ステータスの文字列は変わらない
+    assert monitor.down_line in drawn and monitor.current_down_text in drawn
+    assert not set(drawn) & set(monitor.status_texts)
+    drawn.clear()
+    before = [text.get_text() for text in monitor.status_texts]
+    monitor.record_sample(clock + timedelta(seconds=10), 95.0, 17.0)
+    monitor.update_graph()
+    changed = [text for text, old in zip(monitor.status_texts, before) if text.get_text() != old]
+    assert changed
+    assert [a for a in drawn if a in monitor.status_texts] == changed
+    assert draws == []
+
+
+def test_layout_does_not_use_tight_layout(recwarn):
+    monitor, _, _ = _monitor_with_canvas()
+    monitor.fig.canvas.draw()
+    assert not [w for w in recwarn if 'tight_layout' in str(w.message)]
+    # グラフの軸ラベル・タイトルが図の中に収まる
+    renderer = monitor.fig.canvas.get_renderer()
+    fig_box = monitor.fig.bbox
+    for artist in (monitor.ax1.yaxis.label, monitor.ax2.yaxis.label, monitor.ax1.title):
+        box = artist.get_window_extent(renderer)
+        assert fig_box.x0 <= box.x0 and box.x1 <= fig_box.x1 and box.y1 <= fig_box.y1
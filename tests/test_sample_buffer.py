@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from sample_buffer import SampleBuffer
+
+
+def _reference(values, capacity, window):
+    kept = np.asarray(values[-capacity:], dtype=np.float32).astype(np.float64)
+    return {'count': len(kept), 'mean': kept.mean(), 'max': kept.max(), 'min': kept.min(),
+            'rolling_mean': kept[-window:].mean()}
+
+
+def _assert_stats(buffer, values, window):
+    expected = _reference(values, buffer.capacity, min(window, buffer.capacity))
+    stats = buffer.stats('download')
+    assert stats['count'] == expected['count']
+    for key in ('mean', 'max', 'min', 'rolling_mean'):
+        assert stats[key] == pytest.approx(expected[key], rel=1e-5), key
+
+
+@pytest.mark.parametrize('capacity, window', [(5, 7), (7, 7), (8, 7), (20, 30), (100, 30)])
+def test_append_aggregates_after_eviction(capacity, window):
+    rng = np.random.default_rng(capacity * 100 + window)
+    buffer = SampleBuffer(capacity, columns=('download',), rolling_window=window)
+    values = []
+    for i in range(capacity * 6):
+        value = float(rng.uniform(0, 1000))
+        values.append(value)
+        buffer.append(float(i), value)
+        _assert_stats(buffer, values, window)
+
+
+@pytest.mark.parametrize('capacity, window', [(5, 7), (7, 7), (50, 30)])
+def test_extend_matches_append(capacity, window):
+    rng = np.random.default_rng(7)
+    values = rng.uniform(0, 1000, size=capacity * 3)
+    appended = SampleBuffer(capacity, columns=('download',), rolling_window=window)
+    extended = SampleBuffer(capacity, columns=('download',), rolling_window=window)
+    for i, value in enumerate(values):
+        appended.append(float(i), value)
+    half = len(values) // 2
+    extended.extend(np.arange(half, dtype=np.float64), values[:half])
+    extended.extend(np.arange(half, len(values), dtype=np.float64), values[half:])
+    np.testing.assert_array_equal(appended.timestamps, extended.timestamps)
+    np.testing.assert_array_equal(appended.column('download'), extended.column('download'))
+    for key, value in appended.stats('download').items():
+        assert extended.stats('download')[key] == pytest.approx(value, rel=1e-5), key
+    # まとめて追加した後も1件ずつの追記で集計が崩れない
+    for i in range(capacity * 2):
+        extended.append(float(len(values) + i), float(i))
+        appended.append(float(len(values) + i), float(i))
+    for key, value in appended.stats('download').items():
+        assert extended.stats('download')[key] == pytest.approx(value, rel=1e-5), key
+
+
+def test_snapshot_is_unchanged_by_later_appends():
+    buffer = SampleBuffer(4, columns=('download',))
+    for i in range(4):
+        buffer.append(float(i), float(i))
+    snap = buffer.snapshot()
+    for i in range(4, 20):
+        buffer.append(float(i), float(i))
+    np.testing.assert_array_equal(snap.timestamps, [0.0, 1.0, 2.0, 3.0])
+    np.testing.assert_array_equal(snap.column('download'), [0.0, 1.0, 2.0, 3.0])
+    assert not snap.timestamps.flags.writeable
+
+
+@pytest.mark.parametrize('capacity, window', [(5, 7), (50, 30)])
+def test_aggregates_use_the_clamped_window(capacity, window):
+    buffer = SampleBuffer(capacity, columns=('download',), rolling_window=window)
+    expected = min(capacity, window)
+    assert buffer._aggregates['download'].rolling_window == expected
+    buffer.extend(np.arange(3, dtype=np.float64), np.ones(3))
+    assert buffer._aggregates['download'].rolling_window == expected
+    buffer.clear()
+    assert buffer._aggregates['download'].rolling_window == expected
@@ -0,0 +1,143 @@
+import pytest
+
+from scheduler import AdaptiveScheduler, FixedRateScheduler
+
+
+class FakeClock:
+    """wait() で時計を進める停止イベント兼用の時計（実時間は待たない）"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.stopped = False
+        self.stop_after = None
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def wait(self, timeout):
+        self.now += timeout
+        if self.stop_after is not None:
+            self.stop_after -= 1
+            self.stopped = self.stop_after <= 0
+        return self.stopped
+
+    def is_set(self):
+        return self.stopped
+
+    def set(self):
+        self.stopped = True
+
+
+def test_fixed_rate_does_not_drift_with_work_time():
+    clock = FakeClock()
+    scheduler = FixedRateScheduler(10.0, stop_event=clock, clock=clock)
+    start = clock.now
+    for k in range(1, 1001):
+        clock.sleep(3.7)  # 測定にかかる時間
+        assert scheduler.wait_next()
+        assert clock.now == pytest.approx(start + k * 10.0)
+    assert scheduler.skipped == 0
+    assert scheduler.last_lag == 0.0
+
+
+def test_fixed_rate_skips_missed_ticks_and_stays_on_grid():
+    clock = FakeClock()
+    scheduler = FixedRateScheduler(10.0, stop_event=clock, clock=clock)
+    start = clock.now
+    clock.sleep(25.0)
+    assert scheduler.wait_next()
+    # 10, 20 のティックは過ぎているので飛ばし、まとめて実行しない
+    assert clock.now == pytest.approx(start + 30.0)
+    assert scheduler.skipped == 2
+    assert scheduler.wait_next(min_delay=15.0)
+    assert clock.now == pytest.approx(start + 50.0)
+
+
+def test_fixed_rate_jitter_stays_within_bounds():
+    clock = FakeClock()
+    scheduler = FixedRateScheduler(10.0, jitter=0.1, stop_event=clock, clock=clock)
+    start = clock.now
+    for k in range(1, 200):
+        assert scheduler.wait_next()
+        assert abs(clock.now - (start + k * 10.0)) <= 1.0 + 1e-9
+        clock.now = start + k * 10.0
+
+
+def test_fixed_rate_stops():
+    clock = FakeClock()
+    clock.set()
+    assert not FixedRateScheduler(10.0, stop_event=clock, clock=clock).wait_next()
+
+
+def test_adaptive_tests_on_baseline_and_latency_spikes():
+    clock = FakeClock()
+    rtts = iter([20.0] * 50 + [200.0] * 5 + [20.0] * 45)
+    tested = []
+
+    def run_test():
+        tested.append(clock.now)
+        return 100.0
+
+    scheduler = AdaptiveScheduler(lambda: next(rtts), run_test, probe_interval=2.0,
+                                  baseline_interval=600.0, min_test_gap=60.0, jitter=0.0,
+                                  stop_event=clock, clock=clock)
+    clock.stop_after = 100
+    scheduler.run()
+    assert scheduler.probes == 100
+    # 起動直後のベースラインと、スパイクの1回目（続くスパイクは min_test_gap 内なので測らない）
+    assert len(tested) == 2
+    assert tested[1] - tested[0] == pytest.approx(100.0)
+
+
+def _run_adaptive(clock, rtts, ticks, **kwargs):
+    tested = []
+
+    def run_test():
+        tested.append(clock.now)
+        return 100.0
+
+    scheduler = AdaptiveScheduler(lambda: next(rtts), run_test, probe_interval=2.0,
+                                  baseline_interval=600.0, min_test_gap=60.0, jitter=0.0,
+                                  stop_event=clock, clock=clock, **kwargs)
+    clock.stop_after = ticks
+    scheduler.run()
+    return scheduler, tested
+
+
+def test_adaptive_without_probe_target_only_runs_baselines():
+    clock = FakeClock()
+    # 測定を呼べば空のイテレーターで StopIteration になる
+    scheduler, tested = _run_adaptive(clock, iter(()), 1000, can_probe=lambda: False)
+    # 2000 秒の間にベースライン（起動時と 600 秒ごと）だけ
+    assert len(tested) == 4
+    assert scheduler.probes == 0
+
+
+def test_adaptive_escalates_only_after_consecutive_probe_failures():
+    clock = FakeClock()
+    # 単発の損失は何度あっても測らない
+    rtts = iter(([20.0] * 9 + [None]) * 20)
+    scheduler, tested = _run_adaptive(clock, rtts, 200)
+    assert len(tested) == 1
+    rtts = iter([20.0] * 50 + [None] * 50)
+    scheduler, tested = _run_adaptive(FakeClock(), rtts, 100, failure_threshold=3)
+    # 3 回目の連続失敗で1回、以降は min_test_gap（30 ティック）ごと
+    assert len(tested) == 3
+    assert tested[1] - tested[0] == pytest.approx(2.0 * 52)
+
+
+def test_adaptive_starts_probing_once_a_target_is_known():
+    clock = FakeClock()
+    known = []
+    rtts = iter([20.0] * 40 + [300.0] * 5 + [20.0] * 55)
+    scheduler, tested = _run_adaptive(clock, rtts, 100, can_probe=lambda: bool(known))
+    assert len(tested) == 1
+    known.append(True)
+    clock.stopped = False
+    clock.stop_after = 100
+    scheduler.run()
+    assert scheduler.probes == 100
+    assert len(tested) == 2
@@ -0,0 +1,74 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from speed_stats import (DEGRADED, DOWN, OK, WARMUP, WARN, DegradationDetector,  # noqa: E402
+                         change_points, ewma, rolling_jitter, rolling_percentile)
+
+
+def _noisy(n=200, level=100.0, seed=0):
+    return np.random.default_rng(seed).normal(level, 2.0, n)
+
+
+def test_ewma_matches_recurrence():
+    x = _noisy(300)
+    expected = []
+    value = x[0]
+    for v in x:
+        value = 0.2 * v + 0.8 * value
+        expected.append(value)
+    np.testing.assert_allclose(ewma(x, 0.2), expected)
+    np.testing.assert_allclose(ewma(x[150:], 0.2, initial=expected[149]), expected[150:])
+
+
+def test_rolling_statistics_match_naive_windows():
+    x = _noisy(50)
+    p95 = rolling_percentile(x, 10, 95)
+    jitter = rolling_jitter(x, 10)
+    for i in range(len(x)):
+        window = x[max(0, i - 9):i + 1]
+        assert p95[i] == pytest.approx(np.percentile(window, 95))
+        expected = np.abs(np.diff(window)).mean() if len(window) > 1 else 0.0
+        assert jitter[i] == pytest.approx(expected)
+
+
+def test_detector_updates_match_bulk_extend():
+    x = np.concatenate((_noisy(100), _noisy(50, level=40.0, seed=1)))
+    bulk = DegradationDetector()
+    bulk.extend(x[:60])
+    bulk.extend(x[60:])
+    single = DegradationDetector()
+    statuses = [single.update(v) for v in x]
+    assert single.status == bulk.status
+    for key, value in bulk.state.items():
+        assert single.state[key] == pytest.approx(value)
+    assert statuses[0] == WARMUP
+
+
+def test_detector_statuses():
+    detector = DegradationDetector()
+    assert detector.extend(_noisy(100)) == OK
+    assert detector.update(50.0) == WARN
+    # 低下が続くと DEGRADED、0 Mbps は DOWN
+    assert detector.extend(np.full(5, 50.0)) == DEGRADED
+    assert detector.update(0.0) == DOWN
+    assert detector.status_name == 'DOWN'
+
+
+def test_detector_recent_statistics():
+    detector = DegradationDetector()
+    detector.extend(np.arange(1.0, 101.0))
+    recent = np.arange(71.0, 101.0)
+    assert detector.jitter() == pytest.approx(1.0)
+    low, high = detector.percentiles((5, 95))
+    assert (low, high) == pytest.approx(tuple(np.percentile(recent, (5, 95))))
+    assert detector.variation is not None and detector.variation >= 0
+
+
+def test_change_points_finds_level_shift():
+    x = np.concatenate((_noisy(100), _noisy(100, level=50.0, seed=1)))
+    points, scores = change_points(x, window=30)
+    assert len(points) == 1
+    assert abs(int(points[0]) - 100) <= 2
+    assert scores[0] < 0
+    assert len(change_points(_noisy(200), window=30)[0]) == 0